@@ -0,0 +1,245 @@
+"""Benchmark the scan service against ZAP stubs at increasing concurrency
+
+Starts one or more bench/zap_stub.py servers and the Flask service (or
+uses running ones), then for each concurrency level submits scans with
+that many concurrent clients, waits for each job, downloads its report
+and reports throughput, p50/p99 latency, service memory and ZAP calls
+per scan.
+
+    python bench/run_bench.py --concurrency 1,4,16 --scans 32 --mode quick
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from zap_stub import add_config_arguments
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+SERVICE_SCRIPT = (
+    "import sys, zap_service; zap_service.setup_environment(); "
+    "zap_service.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"
+)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def process_memory(pid):
+    """Return (rss, peak rss) in MiB from /proc, or (None, None) where unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None, None
+    return tuple(int(fields[key].split()[0]) / 1024 if key in fields else None for key in ('VmRSS', 'VmHWM'))
+
+
+def ensure_port_free(port):
+    """Refuse a port something already listens on, so a stale stub or service is not benchmarked instead"""
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+    except OSError:
+        return
+    raise RuntimeError(f"Port {port} is already in use; stop what is listening there or pick another port")
+
+
+def wait_until_up(url, process, log, timeout=30):
+    """Wait for the started process to answer on url, failing as soon as it exits"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before coming up, see {log}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def stub_arguments(args):
+    return ['--latency', str(args.latency), '--jitter', str(args.jitter),
+            '--spider-duration', str(args.spider_duration), '--ascan-duration', str(args.ascan_duration),
+            '--pscan-duration', str(args.pscan_duration), '--curve', args.curve,
+            '--fail-rate', str(args.fail_rate), '--drop-rate', str(args.drop_rate),
+            '--report-size', str(args.report_size), '--alerts', str(args.alerts), '--urls', str(args.urls),
+            '--churn', str(args.churn)]
+
+
+def start_processes(args, workdir):
+    """Start the stubs and the service; return (processes, service URL, stub URLs, service pid)"""
+    processes = []
+    stub_urls = []
+    stub_ports = [args.stub_port + i for i in range(args.zap_instances)]
+    for port in stub_ports + [args.service_port]:
+        ensure_port_free(port)
+    for port in stub_ports:
+        log = open(os.path.join(workdir, f"stub_{port}.log"), 'w')
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, 'zap_stub.py'), '--port', str(port)] + stub_arguments(args),
+            stdout=log, stderr=subprocess.STDOUT))
+        stub_urls.append(f"http://127.0.0.1:{port}")
+
+    env = dict(os.environ,
+               ZAP_URLS=','.join(stub_urls),
+               REPORT_DIR=os.path.join(workdir, 'reports'),
+               STATE_DB=os.path.join(workdir, 'zap_service.db'))
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    log = open(os.path.join(workdir, 'service.log'), 'w')
+    service = subprocess.Popen([sys.executable, '-c', SERVICE_SCRIPT, str(args.service_port)],
+                               cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    processes.append(service)
+
+    service_url = f"http://127.0.0.1:{args.service_port}"
+    for port, url, process in zip(stub_ports, stub_urls, processes):
+        wait_until_up(f"{url}/stub/stats", process, os.path.join(workdir, f"stub_{port}.log"))
+    wait_until_up(f"{service_url}/metrics", service, log.name)
+    return processes, service_url, stub_urls, service.pid
+
+
+def run_one(session, service_url, target, args):
+    """Submit one scan, wait for it and download its report; return a sample dict"""
+    sample = {"target": target, "success": False}
+    start = time.monotonic()
+    try:
+        res = session.post(f"{service_url}/scan", json={"url": target, "mode": args.mode, "force": "true"}, timeout=30)
+        job_id = res.json()["job_id"]
+        while True:
+            job = session.get(f"{service_url}/jobs/{job_id}", timeout=30).json()
+            if job["status"] in ("completed", "failed"):
+                break
+            time.sleep(args.poll_interval)
+        sample["scan_seconds"] = time.monotonic() - start
+        result = job.get("result") or {}
+        sample["success"] = job["status"] == "completed"
+
+        if result.get("report_path"):
+            download_start = time.monotonic()
+            headers = {} if args.gzip else {'Accept-Encoding': 'identity'}
+            with session.get(f"{service_url}/download-report", params={"report_path": result["report_path"]},
+                             headers=headers, stream=True, timeout=60) as report:
+                sample["report_bytes"] = sum(len(chunk) for chunk in report.raw.stream(65536, decode_content=False))
+            sample["download_seconds"] = time.monotonic() - download_start
+    except (requests.RequestException, KeyError, ValueError) as e:
+        sample["error"] = str(e)
+    return sample
+
+
+def run_level(service_url, stub_urls, service_pid, concurrency, args):
+    for url in stub_urls:
+        requests.get(f"{url}/stub/reset", timeout=5)
+
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    targets = [f"http://bench-c{concurrency}-{i}.stub.local" for i in range(args.scans)]
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(lambda target: run_one(session, service_url, target, args), targets))
+    elapsed = time.monotonic() - start
+
+    zap_calls = 0
+    for url in stub_urls:
+        zap_calls += requests.get(f"{url}/stub/stats", timeout=5).json()["total_calls"]
+    rss, peak_rss = process_memory(service_pid) if service_pid else (None, None)
+
+    scan_times = [s["scan_seconds"] for s in samples if "scan_seconds" in s]
+    download_times = [s["download_seconds"] for s in samples if "download_seconds" in s]
+    downloaded = sum(s.get("report_bytes", 0) for s in samples)
+    return {
+        "concurrency": concurrency,
+        "scans": len(samples),
+        "succeeded": sum(1 for s in samples if s["success"]),
+        "errors": [s["error"] for s in samples if "error" in s][:5],
+        "elapsed_seconds": elapsed,
+        "scans_per_second": len(scan_times) / elapsed if elapsed else None,
+        "scan_p50": percentile(scan_times, 50),
+        "scan_p99": percentile(scan_times, 99),
+        "download_p50": percentile(download_times, 50),
+        "download_p99": percentile(download_times, 99),
+        "download_mib_per_second": downloaded / 1048576 / sum(download_times) if download_times else None,
+        "zap_calls_per_scan": zap_calls / len(samples) if samples else None,
+        "rss_mib": rss,
+        "peak_rss_mib": peak_rss
+    }
+
+
+def format_row(row):
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else 'n/a'
+    return (f"{row['concurrency']:>5} {row['succeeded']:>4}/{row['scans']:<4} {fmt(row['scans_per_second'], '8.2f')} "
+            f"{fmt(row['scan_p50'], '8.2f')} {fmt(row['scan_p99'], '8.2f')} "
+            f"{fmt(row['download_p50'], '8.3f')} {fmt(row['download_p99'], '8.3f')} "
+            f"{fmt(row['download_mib_per_second'], '8.1f')} {fmt(row['zap_calls_per_scan'], '9.1f')} "
+            f"{fmt(row['rss_mib'], '7.1f')} {fmt(row['peak_rss_mib'], '7.1f')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ZAP scan service against ZAP stubs")
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated client concurrency levels")
+    parser.add_argument('--scans', type=int, default=16, help="Scans per concurrency level")
+    parser.add_argument('--mode', default='quick', choices=['baseline', 'quick', 'full'])
+    parser.add_argument('--poll-interval', type=float, default=0.2, help="Seconds between job status polls")
+    parser.add_argument('--gzip', action='store_true', help="Download reports with Accept-Encoding: gzip")
+    parser.add_argument('--zap-instances', type=int, default=1, help="ZAP stubs to start")
+    parser.add_argument('--stub-port', type=int, default=18090, help="Port of the first stub")
+    parser.add_argument('--service-port', type=int, default=15000)
+    parser.add_argument('--service-url', help="Benchmark a running service instead of starting one")
+    parser.add_argument('--stub-url', action='append', default=[],
+                        help="Stub used by --service-url, for call counts (repeatable)")
+    parser.add_argument('--service-pid', type=int, help="PID of the running service, for memory figures")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="Environment for the started service, e.g. SCAN_WORKERS=16 (repeatable)")
+    parser.add_argument('--json', help="Also write the results to this file")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    processes = []
+    workdir = tempfile.mkdtemp(prefix='zap-bench-')
+    try:
+        if args.service_url:
+            service_url, stub_urls, service_pid = args.service_url.rstrip('/'), args.stub_url, args.service_pid
+        else:
+            processes, service_url, stub_urls, service_pid = start_processes(args, workdir)
+            print(f"Service and stub logs in {workdir}")
+
+        print(f"{'conc':>5} {'ok':>9} {'scans/s':>8} {'p50 s':>8} {'p99 s':>8} {'dl p50':>8} {'dl p99':>8} "
+              f"{'dl MiB/s':>8} {'zap/scan':>9} {'rss MiB':>7} {'peak':>7}")
+        results = []
+        for concurrency in levels:
+            row = run_level(service_url, stub_urls, service_pid, concurrency, args)
+            results.append(row)
+            print(format_row(row))
+            for error in row["errors"]:
+                print(f"      error: {error}")
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""Fake ZAP API server for benchmarking the service without a ZAP JVM
+
+Implements the ZAP endpoints used by zap_service.py and zap_scan.py with
+configurable latency, spider/active scan progress curves, failure
+injection and report sizes. Call counts per endpoint are exposed at
+/stub/stats and cleared by /stub/reset.
+
+    python bench/zap_stub.py --port 8090 --latency 0.01 --ascan-duration 5
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+RISKS = ['High', 'Medium', 'Low', 'Informational']
+CONFIDENCES = ['High', 'Medium', 'Low']
+
+
+def linear(t):
+    return t
+
+
+def sigmoid(t):
+    # Slow start and finish, fast middle
+    return t * t * (3 - 2 * t)
+
+
+def stall(t):
+    # Reaches 50% quickly, stalls for half the run, then finishes
+    if t < 0.25:
+        return 2 * t
+    if t < 0.75:
+        return 0.5
+    return 0.5 + 2 * (t - 0.75)
+
+
+CURVES = {'linear': linear, 'sigmoid': sigmoid, 'stall': stall}
+
+
+class StubConfig:
+    def __init__(self, latency=0.0, jitter=0.0, spider_duration=2.0, ascan_duration=4.0,
+                 pscan_duration=0.5, curve='linear', fail_rate=0.0, drop_rate=0.0,
+                 report_size=100000, alerts=200, urls=50, churn=0.0):
+        self.latency = latency                  # Seconds added to every API call
+        self.jitter = jitter                    # Extra random seconds, uniform in [0, jitter]
+        self.spider_duration = spider_duration  # Seconds until a spider reports 100%
+        self.ascan_duration = ascan_duration    # Seconds until an active scan reports 100%
+        self.pscan_duration = pscan_duration    # Seconds until the passive scan queue drains
+        self.curve = CURVES[curve]              # Shape of spider and active scan progress
+        self.fail_rate = fail_rate              # Fraction of calls answered with HTTP 500
+        self.drop_rate = drop_rate              # Fraction of calls whose connection is closed unanswered
+        self.report_size = report_size          # Bytes in each HTML report
+        self.alerts = alerts                    # Alerts raised for a target by each scan started on it
+        self.urls = urls                        # URLs per target
+        self.churn = churn                      # Fraction of URLs whose response changes between scans
+
+
+class StubState:
+    """Scans, contexts and call counts shared by all request threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.spiders = {}
+        self.ascans = {}
+        self.ajax_started = None
+        self.policies = set()
+        self.contexts = {}
+        self.calls = Counter()
+        self.generation = 0
+        self.pscan_until = 0.0
+        # Alerts held in the session per target URL, which grow with every scan like ZAP's
+        self.raised = Counter()
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.spiders.clear()
+            self.ascans.clear()
+            self.ajax_started = None
+            self.contexts.clear()
+            self.raised.clear()
+            self.generation += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one write so clients do not wait on delayed ACKs
+    wbufsize = -1
+
+    config = None
+    state = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self._handle(url.path, {k: v[0] for k, v in parse_qs(url.query).items()})
+
+    def do_POST(self):
+        # ZAP also takes API parameters as a form body
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        params.update({k: v[0] for k, v in parse_qs(body, keep_blank_values=True).items()})
+        self._handle(url.path, params)
+
+    def _handle(self, path, params):
+        parts = path.strip('/').split('/')
+
+        if parts[0] == 'stub':
+            return self._stub_endpoint(parts[1:])
+
+        # /{JSON|OTHER}/{component}/{view|action|other}/{name}/
+        endpoint = '/'.join(parts[1:4])
+        with self.state.lock:
+            self.state.calls[endpoint] += 1
+
+        config = self.config
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+        if config.drop_rate and random.random() < config.drop_rate:
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if config.fail_rate and random.random() < config.fail_rate:
+            return self._send_json({'code': 'internal_error', 'message': 'Injected failure'}, status=500)
+
+        if endpoint == 'core/other/htmlreport':
+            return self._send_report()
+        handler = getattr(self, '_' + endpoint.replace('/', '_'), None)
+        response = handler(params) if handler else {'Result': 'OK'}
+        # Handlers return the JSON body, or (body, status) for an API error
+        if not isinstance(response, tuple):
+            response = (response,)
+        self._send_json(*response)
+
+    # ZAP API
+
+    def _core_view_version(self, params):
+        return {'version': '2.14.0-stub'}
+
+    def _context_action_newContext(self, params):
+        with self.state.lock:
+            context_id = str(next(self.state.ids))
+            self.state.contexts[params.get('contextName')] = context_id
+        return {'contextId': context_id}
+
+    def _context_view_urls(self, params):
+        return {'urls': [f"http://stub.local/page{i}" for i in range(self.config.urls)]}
+
+    def _core_action_sendRequest(self, params):
+        if not params.get('request', '').split(' ', 1)[0].isupper():
+            return self._error('illegal_parameter', "Request is not a valid HTTP request")
+        return {'sendRequest': []}
+
+    def _core_action_newSession(self, params):
+        with self.state.lock:
+            self.state.raised.clear()
+        return {'Result': 'OK'}
+
+    def _spider_action_scan(self, params):
+        self._raise_alerts(params)
+        return {'scan': self._start(self.state.spiders)}
+
+    def _spider_view_status(self, params):
+        return {'status': str(self._progress(self.state.spiders, params, self.config.spider_duration))}
+
+    def _spider_view_results(self, params):
+        # URLs are found in proportion to the spider's progress
+        found = self.config.urls * self._progress(self.state.spiders, params, self.config.spider_duration) // 100
+        return {'results': [f"http://stub.local/page{i}" for i in range(found)]}
+
+    def _spider_action_stop(self, params):
+        with self.state.lock:
+            self.state.spiders.pop(params.get('scanId'), None)
+        return {'Result': 'OK'}
+
+    def _ajaxSpider_action_scan(self, params):
+        with self.state.lock:
+            self.state.ajax_started = time.time()
+        return {'Result': 'OK'}
+
+    def _ajaxSpider_view_status(self, params):
+        started = self.state.ajax_started
+        running = started is not None and time.time() - started < self.config.spider_duration
+        return {'status': 'running' if running else 'stopped'}
+
+    def _ajaxSpider_action_stop(self, params):
+        with self.state.lock:
+            self.state.ajax_started = None
+        return {'Result': 'OK'}
+
+    def _ascan_action_scan(self, params):
+        policy = params.get('scanPolicyName')
+        if policy and policy not in self.state.policies:
+            return self._error('does_not_exist', f"Scan policy {policy} does not exist")
+        self._raise_alerts(params)
+        return {'scan': self._start(self.state.ascans)}
+
+    def _ascan_view_scanPolicyNames(self, params):
+        return {'scanPolicyNames': ['Default Policy'] + sorted(self.state.policies)}
+
+    def _ascan_action_addScanPolicy(self, params):
+        with self.state.lock:
+            self.state.policies.add(params.get('scanPolicyName'))
+        return {'Result': 'OK'}
+
+    def _ascan_action_removeScanPolicy(self, params):
+        with self.state.lock:
+            self.state.policies.discard(params.get('scanPolicyName'))
+        return {'Result': 'OK'}
+
+    def _ascan_view_status(self, params):
+        return {'status': str(self._progress(self.state.ascans, params, self.config.ascan_duration))}
+
+    def _core_action_accessUrl(self, params):
+        self._raise_alerts(params)
+        with self.state.lock:
+            self.state.pscan_until = max(self.state.pscan_until, time.time() + self.config.pscan_duration)
+        return {'Result': 'OK'}
+
+    def _pscan_view_recordsToScan(self, params):
+        remaining = self.state.pscan_until - time.time()
+        return {'recordsToScan': str(max(0, int(remaining * 10)))}
+
+    def _core_view_numberOfAlerts(self, params):
+        return {'numberOfAlerts': str(self._raised(params))}
+
+    def _core_view_alerts(self, params):
+        base_url = params.get('baseurl', 'http://stub.local')
+        total = self._raised(params)
+        start = int(params.get('start', 0))
+        count = int(params.get('count', 0)) or total
+        return {'alerts': [self._alert(base_url, i) for i in range(start, min(start + count, total))]}
+
+    def _alert_view_alertsSummary(self, params):
+        total = self._raised(params)
+        return {'alertsSummary': {risk: len(range(i, total, len(RISKS))) for i, risk in enumerate(RISKS)}}
+
+    def _reports_action_generate(self, params):
+        path = os.path.join(params.get('reportDir', '.'), params.get('reportFileName', 'report.html'))
+        with open(path, 'wb') as f:
+            f.write((b'<tr><td>stub finding</td></tr>\n' * (self.config.report_size // 31 + 1))[:self.config.report_size])
+        return {'generate': path}
+
+    def _core_view_numberOfMessages(self, params):
+        # Each running spider has fetched URLs in proportion to its progress
+        with self.state.lock:
+            spiders = list(self.state.spiders)
+        found = sum(self.config.urls * self._progress(self.state.spiders, {'scanId': scan_id}, self.config.spider_duration)
+                    // 100 for scan_id in spiders)
+        return {'numberOfMessages': str(found)}
+
+    def _core_view_messages(self, params):
+        base_url = params.get('baseurl', 'http://stub.local')
+        start = int(params.get('start', 0))
+        count = int(params.get('count', 0)) or self.config.urls
+        changing = int(self.config.urls * self.config.churn)
+        messages = []
+        for i in range(start, min(start + count, self.config.urls)):
+            body = f"page {i}" + (f" v{self.state.generation}-{time.time()}" if i < changing else '')
+            messages.append({
+                'requestHeader': f"GET {base_url}/page{i} HTTP/1.1\r\nHost: stub.local",
+                'responseHeader': 'HTTP/1.1 200 OK\r\nContent-Type: text/html',
+                'responseBody': body
+            })
+        return {'messages': messages}
+
+    # Helpers
+
+    def _error(self, code, message):
+        return {'code': code, 'message': message}, 400
+
+    def _raise_alerts(self, params):
+        with self.state.lock:
+            self.state.raised[params.get('url', 'http://stub.local')] += self.config.alerts
+
+    def _raised(self, params):
+        base_url = params.get('baseurl')
+        with self.state.lock:
+            if not base_url:
+                return sum(self.state.raised.values())
+            return sum(count for url, count in self.state.raised.items() if url.startswith(base_url))
+
+    def _start(self, scans):
+        with self.state.lock:
+            scan_id = str(next(self.state.ids))
+            scans[scan_id] = time.time()
+        return scan_id
+
+    def _progress(self, scans, params, duration):
+        started = scans.get(params.get('scanId'))
+        if started is None:
+            return 100
+        t = min(1.0, (time.time() - started) / duration) if duration > 0 else 1.0
+        return int(100 * self.config.curve(t))
+
+    def _alert(self, base_url, i):
+        return {
+            'id': str(i),
+            'pluginId': str(10000 + i % 20),
+            'alert': f"Stub alert {i % 20}",
+            'risk': RISKS[i % len(RISKS)],
+            'confidence': CONFIDENCES[i % len(CONFIDENCES)],
+            'url': f"{base_url}/page{i % max(1, self.config.urls)}",
+            'method': 'GET',
+            'param': 'q' if i % 2 else '',
+            'evidence': f"evidence {i}",
+            'cweid': '79',
+            'wascid': '8'
+        }
+
+    def _send_report(self):
+        size = self.config.report_size
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = (b'<tr><td>stub finding</td></tr>\n' * 2048)[:65536]
+        remaining = size
+        while remaining > 0:
+            self.wfile.write(chunk[:remaining])
+            remaining -= min(len(chunk), remaining)
+        self.wfile.flush()
+
+    def _stub_endpoint(self, parts):
+        if parts[:1] == ['reset']:
+            self.state.reset()
+            return self._send_json({'Result': 'OK'})
+        if parts[:1] == ['stats']:
+            with self.state.lock:
+                calls = dict(self.state.calls)
+            return self._send_json({'total_calls': sum(calls.values()), 'calls': calls})
+        self._send_json({'message': 'Unknown stub endpoint'}, status=404)
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+
+def make_server(host='127.0.0.1', port=8090, config=None):
+    """Return a ThreadingHTTPServer serving the stub with its own state"""
+    handler = type('BoundStubHandler', (StubHandler,), {'config': config or StubConfig(), 'state': StubState()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every API call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument('--spider-duration', type=float, default=2.0, help="Seconds until a spider finishes")
+    parser.add_argument('--ascan-duration', type=float, default=4.0, help="Seconds until an active scan finishes")
+    parser.add_argument('--pscan-duration', type=float, default=0.5, help="Seconds until passive scanning drains")
+    parser.add_argument('--curve', choices=sorted(CURVES), default='linear', help="Progress curve")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of calls answered with HTTP 500")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="Fraction of calls dropped without an answer")
+    parser.add_argument('--report-size', type=int, default=100000, help="Bytes per HTML report")
+    parser.add_argument('--alerts', type=int, default=200, help="Alerts raised for a target by each scan")
+    parser.add_argument('--urls', type=int, default=50, help="URLs per target")
+    parser.add_argument('--churn', type=float, default=0.0, help="Fraction of URLs that change between scans")
+
+
+def config_from_args(args):
+    return StubConfig(latency=args.latency, jitter=args.jitter, spider_duration=args.spider_duration,
+                      ascan_duration=args.ascan_duration, pscan_duration=args.pscan_duration, curve=args.curve,
+                      fail_rate=args.fail_rate, drop_rate=args.drop_rate, report_size=args.report_size,
+                      alerts=args.alerts, urls=args.urls, churn=args.churn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake ZAP API server for benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = make_server(args.host, args.port, config_from_args(args))
+    logger.info(f"ZAP stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+import hashlib
+import logging
+import os
+import re
+import urllib.parse
+from collections import defaultdict
+from datetime import datetime
+
+from state_db import connect, ensure_schema
+
+logger = logging.getLogger(__name__)
+
+ALERT_PAGE_SIZE = int(os.getenv("ALERT_PAGE_SIZE", "500"))  # Alerts fetched from ZAP per call
+ALERT_QUERY_LIMIT = int(os.getenv("ALERT_QUERY_LIMIT", "500"))  # Max alerts returned by one /alerts page
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    target TEXT NOT NULL,
+    mode TEXT,
+    zap_alert_id TEXT,
+    plugin_id TEXT,
+    name TEXT,
+    risk TEXT COLLATE NOCASE,
+    confidence TEXT COLLATE NOCASE,
+    url TEXT,
+    method TEXT,
+    param TEXT,
+    attack TEXT,
+    evidence TEXT,
+    cwe_id TEXT,
+    wasc_id TEXT,
+    description TEXT,
+    solution TEXT,
+    reference TEXT,
+    fingerprint TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_job ON alerts(job_id);
+CREATE INDEX IF NOT EXISTS idx_alerts_target_risk ON alerts(target, risk);
+CREATE INDEX IF NOT EXISTS idx_alerts_plugin ON alerts(plugin_id);
+CREATE INDEX IF NOT EXISTS idx_alerts_risk_confidence ON alerts(risk, confidence);
+CREATE TABLE IF NOT EXISTS alert_scans (
+    job_id TEXT PRIMARY KEY,
+    target TEXT NOT NULL,
+    mode TEXT,
+    status TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alert_scans_target ON alert_scans(target, created_at);
+"""
+
+# Path segments and evidence tokens that change between scans of the same finding: numbers, UUIDs, long hex
+VOLATILE_SEGMENT = re.compile(r'^(?:\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{16,})$', re.I)
+VOLATILE_TOKEN = re.compile(r'\b(?:\d{4,}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{16,})\b', re.I)
+
+# Columns returned for each finding in a diff
+DIFF_FIELDS = ('id', 'fingerprint', 'plugin_id', 'name', 'risk', 'confidence', 'url', 'method', 'param', 'evidence')
+
+# ZAP alert field -> alerts column
+ALERT_FIELDS = {
+    'id': 'zap_alert_id',
+    'pluginId': 'plugin_id',
+    'alert': 'name',
+    'risk': 'risk',
+    'confidence': 'confidence',
+    'url': 'url',
+    'method': 'method',
+    'param': 'param',
+    'attack': 'attack',
+    'evidence': 'evidence',
+    'cweid': 'cwe_id',
+    'wascid': 'wasc_id',
+    'description': 'description',
+    'solution': 'solution',
+    'reference': 'reference'
+}
+
+# Query parameter -> alerts column
+FILTERS = {
+    'target': 'target',
+    'job_id': 'job_id',
+    'risk': 'risk',
+    'confidence': 'confidence',
+    'plugin_id': 'plugin_id',
+    'fingerprint': 'fingerprint'
+}
+
+
+def url_pattern(url):
+    """Normalize a URL so the same endpoint matches across scans
+
+    Scheme and host are lowercased, default ports, fragments and trailing
+    slashes dropped, IDs in the path replaced by {id} and query values
+    dropped, keeping the sorted parameter names.
+    """
+    parts = urllib.parse.urlsplit(url or '')
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, parts.port) in (('http', 80), ('https', 443)):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = '/'.join('{id}' if VOLATILE_SEGMENT.match(segment) else segment
+                    for segment in parts.path.split('/')).rstrip('/')
+    names = sorted({name for name, _ in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)})
+    return urllib.parse.urlunsplit((scheme, netloc, path, '&'.join(f"{name}=" for name in names), ''))
+
+
+def alert_fingerprint(plugin_id, method, url, param, evidence):
+    """Identity of a finding across scans: plugin, method, URL pattern, parameter and a hash of the evidence
+
+    Whitespace and volatile tokens in the evidence are normalized first,
+    so a finding keeps its fingerprint when only a timestamp or ID changes.
+    """
+    evidence = VOLATILE_TOKEN.sub('{n}', ' '.join(str(evidence or '').split()))
+    evidence_hash = hashlib.sha256(evidence.encode()).hexdigest()[:16]
+    key = '\x1f'.join([str(plugin_id or ''), str(method or '').upper(), url_pattern(url), str(param or ''),
+                       evidence_hash])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _migrate(conn):
+    """Fingerprint alerts stored before fingerprints existed, and index them by job and target"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if 'fingerprint' not in [row[1] for row in conn.execute("PRAGMA table_info(alerts)")]:
+            conn.execute("ALTER TABLE alerts ADD COLUMN fingerprint TEXT")
+            rows = conn.execute("SELECT id, plugin_id, method, url, param, evidence FROM alerts").fetchall()
+            conn.executemany("UPDATE alerts SET fingerprint = ? WHERE id = ?",
+                             [(alert_fingerprint(*row[1:]), row[0]) for row in rows])
+            conn.execute("""
+                INSERT OR IGNORE INTO alert_scans (job_id, target, mode, status, created_at)
+                SELECT job_id, target, mode, 'completed', MIN(created_at) FROM alerts GROUP BY job_id""")
+            logger.info(f"Fingerprinted {len(rows)} stored alerts")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_job_fingerprint ON alerts(job_id, fingerprint)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _ensure_schema():
+    ensure_schema('findings', SCHEMA, migrate=_migrate)
+
+
+def fetch_alerts(zap, base_url, start=0, stop=None, page_size=ALERT_PAGE_SIZE):
+    """Yield pages of alerts under base_url from ZAP, from offset `start` up to `stop` (the end when None)"""
+    while stop is None or start < stop:
+        count = page_size if stop is None else min(page_size, stop - start)
+        page = zap.view('core', 'alerts', baseurl=base_url, start=start, count=count).get('alerts', [])
+        if not page:
+            return
+        yield page
+        if len(page) < count:
+            return
+        start += len(page)
+
+
+def number_of_alerts(zap, base_url):
+    """How many alerts ZAP holds under base_url; a cheap count, unlike fetching them"""
+    return int(zap.view('core', 'numberOfAlerts', baseurl=base_url).get('numberOfAlerts', 0))
+
+
+def ingest_alerts(zap, job_id, target_url, mode, start=0):
+    """Copy the target's alerts from ZAP, from offset `start`, into the findings store; return how many were stored"""
+    return save_alerts(job_id, target_url, mode, fetch_alerts(zap, target_url, start=start))
+
+
+def save_alerts(job_id, target_url, mode, pages):
+    """Store pages of ZAP alerts as job_id's findings; return how many were stored"""
+    _ensure_schema()
+    conn = connect()
+    columns = ['job_id', 'target', 'mode', 'created_at', 'fingerprint'] + list(ALERT_FIELDS.values())
+    sql = f"INSERT INTO alerts ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    now = datetime.now().isoformat()
+    stored = 0
+    for page in pages:
+        rows = [[job_id, target_url, mode, now,
+                 alert_fingerprint(alert.get('pluginId'), alert.get('method'), alert.get('url'), alert.get('param'),
+                                   alert.get('evidence'))]
+                + [alert.get(field) for field in ALERT_FIELDS] for alert in page]
+        with conn:
+            conn.executemany(sql, rows)
+        stored += len(rows)
+    logger.info(f"Stored {stored} alerts for job {job_id}")
+    return stored
+
+
+def carry_over_alerts(job_id, mode, unchanged):
+    """Copy earlier findings for unchanged URLs into job_id
+
+    `unchanged` maps URL -> job that last scanned it. Alerts the new job
+    already holds for the same plugin, URL and parameter are skipped.
+    """
+    _ensure_schema()
+    by_job = defaultdict(list)
+    for url, previous_job in unchanged.items():
+        by_job[previous_job].append(url)
+
+    columns = ', '.join(['target', 'fingerprint'] + list(ALERT_FIELDS.values()))
+    conn = connect()
+    copied = 0
+    for previous_job, urls in by_job.items():
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            with conn:
+                cursor = conn.execute(f"""
+                    INSERT INTO alerts (job_id, mode, created_at, {columns})
+                    SELECT ?, ?, ?, {columns} FROM alerts AS a
+                    WHERE a.job_id = ? AND a.url IN ({', '.join('?' for _ in chunk)})
+                    AND NOT EXISTS (
+                        SELECT 1 FROM alerts AS n
+                        WHERE n.job_id = ? AND n.plugin_id = a.plugin_id AND n.url = a.url AND n.param IS a.param
+                    )""", [job_id, mode, datetime.now().isoformat(), previous_job] + chunk + [job_id])
+                copied += cursor.rowcount
+    logger.info(f"Carried over {copied} alerts for {len(unchanged)} unchanged URLs into job {job_id}")
+    return copied
+
+
+def query_alerts(filters, limit=100, offset=0):
+    """Return (alerts, total) matching the filters; values may be comma-separated lists"""
+    _ensure_schema()
+    clauses = []
+    params = []
+    for key, column in FILTERS.items():
+        value = filters.get(key)
+        if not value:
+            continue
+        values = [v.strip() for v in value.split(',') if v.strip()]
+        clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    conn = connect()
+    total = conn.execute(f"SELECT COUNT(*) FROM alerts {where}", params).fetchone()[0]
+    rows = conn.execute(f"SELECT * FROM alerts {where} ORDER BY id LIMIT ? OFFSET ?",
+                        params + [min(limit, ALERT_QUERY_LIMIT), offset]).fetchall()
+    return [dict(row) for row in rows], total
+
+
+def get_alert(alert_id):
+    _ensure_schema()
+    row = connect().execute("SELECT * FROM alerts WHERE id = ?", (alert_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def count_by_risk(job_id):
+    """Return {risk: count} for one job"""
+    _ensure_schema()
+    rows = connect().execute("SELECT risk, COUNT(*) FROM alerts WHERE job_id = ? GROUP BY risk", (job_id,))
+    return {risk: count for risk, count in rows}
+
+
+def record_scan(job_id, target_url, mode, status):
+    """Add a scan whose findings are stored to the target's scan index, including scans that found nothing"""
+    _ensure_schema()
+    conn = connect()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO alert_scans (job_id, target, mode, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                     (job_id, target_url, mode, status, datetime.now().isoformat()))
+
+
+def diff_findings(target_url, from_job=None, to_job=None, limit=100):
+    """Compare the findings of two scans of a target by fingerprint
+
+    `to_job` defaults to the target's latest scan and `from_job` to the
+    completed scan of the same mode before it. Returns the two scans, a
+    summary of new, fixed and persisting findings by risk, and up to
+    `limit` findings of each kind; raises LookupError when either scan is
+    unknown for the target.
+    """
+    _ensure_schema()
+    conn = connect()
+    to_scan = _indexed_scan(conn, target_url, to_job)
+    if to_scan is None:
+        raise LookupError(f"No scan {to_job} of {target_url}" if to_job else f"No scans of {target_url}")
+    if from_job:
+        from_scan = _indexed_scan(conn, target_url, from_job)
+    else:
+        from_scan = conn.execute("""
+            SELECT * FROM alert_scans WHERE target = ? AND mode IS ? AND status = 'completed' AND created_at < ?
+            ORDER BY created_at DESC LIMIT 1""", (target_url, to_scan['mode'], to_scan['created_at'])).fetchone()
+    if from_scan is None:
+        raise LookupError(f"No scan {from_job} of {target_url}" if from_job else
+                          f"No earlier completed {to_scan['mode']} scan of {target_url} to compare with")
+
+    before = _fingerprints(conn, from_scan['job_id'])
+    after = _fingerprints(conn, to_scan['job_id'])
+    kinds = {
+        "new": [after[fp] for fp in after.keys() - before.keys()],
+        "fixed": [before[fp] for fp in before.keys() - after.keys()],
+        "persisting": [after[fp] for fp in after.keys() & before.keys()]
+    }
+    diff = {"target": target_url, "from": dict(from_scan), "to": dict(to_scan), "summary": {}}
+    for kind, ids in kinds.items():
+        findings = _findings(conn, ids)
+        by_risk = defaultdict(int)
+        for finding in findings:
+            by_risk[finding['risk']] += 1
+        diff["summary"][kind] = {"total": len(findings), "by_risk": dict(by_risk)}
+        diff[kind] = findings[:min(limit, ALERT_QUERY_LIMIT)]
+    return diff
+
+
+def _indexed_scan(conn, target_url, job_id=None):
+    if job_id:
+        return conn.execute("SELECT * FROM alert_scans WHERE target = ? AND job_id = ?", (target_url, job_id)).fetchone()
+    return conn.execute("SELECT * FROM alert_scans WHERE target = ? ORDER BY created_at DESC LIMIT 1",
+                        (target_url,)).fetchone()
+
+
+def _fingerprints(conn, job_id):
+    """Return {fingerprint: ID of the job's first alert with it}, read from the fingerprint index alone"""
+    return {row[0]: row[1] for row in conn.execute(
+        "SELECT fingerprint, MIN(id) FROM alerts WHERE job_id = ? GROUP BY fingerprint", (job_id,))}
+
+
+def _findings(conn, alert_ids):
+    """Return the alerts with these IDs, highest risk first"""
+    rank = {risk: i for i, risk in enumerate(['high', 'medium', 'low', 'informational'])}
+    findings = []
+    ids = sorted(alert_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows = conn.execute(f"SELECT {', '.join(DIFF_FIELDS)} FROM alerts WHERE id IN ({', '.join('?' for _ in chunk)})",
+                            chunk)
+        findings.extend(dict(row) for row in rows)
+    return sorted(findings, key=lambda f: (rank.get(str(f['risk']).lower(), len(rank)), f['id']))
@@ -0,0 +1,45 @@
+import os
+import signal
+
+# Production server: gunicorn -c gunicorn.conf.py zap_service:app
+#
+# Every worker serves the API from the shared job store; the first worker
+# to take the runner lock also runs scans (see job_store.claim_runner).
+# The app is not preloaded, so the master never takes the lock itself and
+# a replacement worker can take over scanning when the runner dies.
+
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "1"))  # Worker processes serving the API
+SERVICE_THREADS = int(os.getenv("SERVICE_THREADS", "8"))  # Request threads per worker, including open event streams
+DRAIN_TIMEOUT = int(os.getenv("DRAIN_TIMEOUT", "60"))  # Seconds shutdown waits for running scans
+
+bind = "0.0.0.0:5000"
+workers = SERVICE_WORKERS
+worker_class = "gthread"
+threads = SERVICE_THREADS
+preload_app = False
+# Event streams stay open for minutes, so workers are only restarted when they stop heartbeating
+timeout = 120
+# Long enough for the runner to drain before the master kills it
+graceful_timeout = DRAIN_TIMEOUT + 15
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    """Prepare the report directory and start draining as soon as the worker is told to stop"""
+    import zap_service
+
+    zap_service.setup_environment()
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def on_term(signum, frame):
+        zap_service.begin_drain()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_exit(server, worker):
+    """Wait for running scans, leaving any still running to be resumed by the next runner"""
+    import zap_service
+
+    zap_service.drain()
@@ -0,0 +1,288 @@
+import fcntl
+import json
+import logging
+import os
+
+from state_db import STATE_DB, connect, ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Held by the one process that runs scans; released by the OS when it exits
+RUNNER_LOCK = os.getenv("RUNNER_LOCK", f"{STATE_DB}.runner.lock")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    scan_key TEXT NOT NULL,
+    target TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    options TEXT NOT NULL,
+    priority TEXT,
+    tenant TEXT,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    result TEXT,
+    claimed INTEGER NOT NULL DEFAULT 0,
+    checkpoint TEXT,
+    queue_position INTEGER,
+    estimated_start TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_key_status ON jobs(scan_key, status);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    concurrency INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    finished_at TEXT,
+    entries TEXT NOT NULL,
+    claimed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_batches_status_created ON batches(status, created_at);
+"""
+
+# Job and batch fields stored as JSON
+JSON_FIELDS = ('options', 'result', 'checkpoint', 'entries')
+JOB_FIELDS = ('job_id', 'target', 'mode', 'options', 'priority', 'tenant', 'status', 'created_at', 'started_at',
+              'finished_at', 'result')
+BATCH_FIELDS = ('batch_id', 'status', 'concurrency', 'created_at', 'finished_at', 'entries')
+
+_runner_lock = None
+
+
+def claim_runner():
+    """Return True if this process is the one that runs scans
+
+    The first process to lock RUNNER_LOCK keeps it until it exits, so with
+    several WSGI workers exactly one runs scans and a replacement worker
+    takes over when it dies.
+    """
+    global _runner_lock
+    if _runner_lock is not None:
+        return True
+    os.makedirs(os.path.dirname(RUNNER_LOCK) or '.', exist_ok=True)
+    lock = open(RUNNER_LOCK, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _runner_lock = lock
+    logger.info(f"Process {os.getpid()} runs scans (holds {RUNNER_LOCK})")
+    return True
+
+
+def encode_key(scan_key):
+    return json.dumps(scan_key)
+
+
+def _encode(fields):
+    return {name: json.dumps(value) if name in JSON_FIELDS and value is not None else value
+            for name, value in fields.items()}
+
+
+def _decode(row, fields):
+    record = {}
+    for name in fields:
+        value = row[name]
+        record[name] = json.loads(value) if name in JSON_FIELDS and value is not None else value
+    return record
+
+
+def _job(row):
+    """A job dict as JobManager keeps it; queued jobs carry the runner's last queue estimate, if any yet"""
+    job = _decode(row, JOB_FIELDS)
+    if row['status'] == 'queued':
+        job.update(queue_position=row['queue_position'], estimated_start=row['estimated_start'])
+    return job
+
+
+def save_job(job, scan_key, claimed=True):
+    """Insert or replace a job; unclaimed jobs wait for the runner to adopt them"""
+    ensure_schema('jobs', SCHEMA)
+    fields = _encode({name: job.get(name) for name in JOB_FIELDS})
+    fields.update(scan_key=encode_key(scan_key), claimed=int(claimed))
+    conn = connect()
+    with conn:
+        conn.execute(f"INSERT OR REPLACE INTO jobs ({', '.join(fields)}) VALUES ({', '.join('?' for _ in fields)})",
+                     list(fields.values()))
+
+
+def update_job(job_id, **fields):
+    ensure_schema('jobs', SCHEMA)
+    fields = _encode(fields)
+    conn = connect()
+    with conn:
+        conn.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE job_id = ?",
+                     list(fields.values()) + [job_id])
+
+
+def load_job(job_id):
+    ensure_schema('jobs', SCHEMA)
+    row = connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return _job(row) if row else None
+
+
+def load_jobs(statuses, claimed=None):
+    """Return [(job, scan_key)] in the given statuses, oldest first; `claimed` filters on adoption"""
+    ensure_schema('jobs', SCHEMA)
+    sql = f"SELECT * FROM jobs WHERE status IN ({', '.join('?' for _ in statuses)})"
+    params = list(statuses)
+    if claimed is not None:
+        sql += " AND claimed = ?"
+        params.append(int(claimed))
+    rows = connect().execute(sql + " ORDER BY created_at", params).fetchall()
+    return [(_job(row), _tuple(json.loads(row['scan_key']))) for row in rows]
+
+
+def _tuple(value):
+    """Undo JSON's tuple-to-list conversion of a scan key"""
+    return tuple(_tuple(item) for item in value) if isinstance(value, list) else value
+
+
+def claim_jobs(job_ids):
+    ensure_schema('jobs', SCHEMA)
+    conn = connect()
+    with conn:
+        conn.executemany("UPDATE jobs SET claimed = 1 WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+
+
+def submit_job(job, scan_key, in_flight, completed=None, completed_since=None, max_queued=0):
+    """Atomically queue a job unless an equivalent one is in flight or recently completed
+
+    Returns (job, outcome): the existing job and 'coalesced' or 'cached',
+    (None, 'full') when `max_queued` jobs are already waiting, or the new
+    job and 'queued'. The new job is left unclaimed for the runner.
+    """
+    ensure_schema('jobs', SCHEMA)
+    key = encode_key(scan_key)
+    queued = job['status']
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(f"SELECT * FROM jobs WHERE scan_key = ? AND status IN ({', '.join('?' for _ in in_flight)})"
+                           " ORDER BY created_at LIMIT 1", [key] + list(in_flight)).fetchone() if in_flight else None
+        if row:
+            conn.rollback()
+            return _job(row), 'coalesced'
+        if completed and completed_since:
+            row = conn.execute("SELECT * FROM jobs WHERE scan_key = ? AND status = ? AND finished_at >= ?"
+                               " ORDER BY finished_at DESC LIMIT 1", (key, completed, completed_since)).fetchone()
+            if row:
+                conn.rollback()
+                return _job(row), 'cached'
+        if max_queued and conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (queued,)).fetchone()[0] >= max_queued:
+            conn.rollback()
+            return None, 'full'
+        fields = _encode({name: job.get(name) for name in JOB_FIELDS})
+        fields.update(scan_key=key, claimed=0)
+        conn.execute(f"INSERT INTO jobs ({', '.join(fields)}) VALUES ({', '.join('?' for _ in fields)})",
+                     list(fields.values()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return job, 'queued'
+
+
+def find_job(scan_key, status, finished_since=None):
+    """Return the newest job for a scan key in `status`, finished after `finished_since` if given"""
+    ensure_schema('jobs', SCHEMA)
+    sql = "SELECT * FROM jobs WHERE scan_key = ? AND status = ?"
+    params = [encode_key(scan_key), status]
+    if finished_since:
+        sql += " AND finished_at >= ?"
+        params.append(finished_since)
+    row = connect().execute(sql + " ORDER BY created_at DESC LIMIT 1", params).fetchone()
+    return _job(row) if row else None
+
+
+def job_priorities(status):
+    """Return {job_id: priority} of the jobs in `status`, for picking up changes made by other processes"""
+    ensure_schema('jobs', SCHEMA)
+    return {row[0]: row[1] for row in connect().execute("SELECT job_id, priority FROM jobs WHERE status = ?",
+                                                        (status,))}
+
+
+def save_queue_estimates(estimates):
+    """Store {job_id: (queue position, estimated start)} so other processes can report them"""
+    ensure_schema('jobs', SCHEMA)
+    conn = connect()
+    with conn:
+        conn.executemany("UPDATE jobs SET queue_position = ?, estimated_start = ? WHERE job_id = ?",
+                         [(position, start, job_id) for job_id, (position, start) in estimates.items()])
+
+
+def job_counts():
+    ensure_schema('jobs', SCHEMA)
+    return {row[0]: row[1] for row in connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+
+def queue_depths(status):
+    ensure_schema('jobs', SCHEMA)
+    return {(row[0], row[1]): row[2] for row in connect().execute(
+        "SELECT priority, tenant, COUNT(*) FROM jobs WHERE status = ? GROUP BY priority, tenant", (status,))}
+
+
+def save_checkpoint(job_id, checkpoint):
+    """Record the ZAP-side state of a running scan so another process can resume or clean it up"""
+    update_job(job_id, checkpoint=checkpoint)
+
+
+def load_checkpoint(job_id):
+    ensure_schema('jobs', SCHEMA)
+    row = connect().execute("SELECT checkpoint FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+def prune_jobs(statuses, keep):
+    """Delete all but the newest `keep` jobs in the given (finished) statuses"""
+    ensure_schema('jobs', SCHEMA)
+    conn = connect()
+    with conn:
+        cursor = conn.execute(f"""
+            DELETE FROM jobs WHERE job_id IN (
+                SELECT job_id FROM jobs WHERE status IN ({', '.join('?' for _ in statuses)})
+                ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )""", list(statuses) + [keep])
+    return cursor.rowcount
+
+
+def save_batch(batch, claimed=True):
+    ensure_schema('jobs', SCHEMA)
+    fields = _encode({name: batch.get(name) for name in BATCH_FIELDS})
+    fields['claimed'] = int(claimed)
+    conn = connect()
+    with conn:
+        conn.execute(f"INSERT OR REPLACE INTO batches ({', '.join(fields)}) VALUES ({', '.join('?' for _ in fields)})",
+                     list(fields.values()))
+
+
+def load_batch(batch_id):
+    ensure_schema('jobs', SCHEMA)
+    row = connect().execute("SELECT * FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+    return _decode(row, BATCH_FIELDS) if row else None
+
+
+def load_batches(status, claimed=None):
+    """Return batches in `status`, oldest first; `claimed` filters on adoption"""
+    ensure_schema('jobs', SCHEMA)
+    sql = "SELECT * FROM batches WHERE status = ?"
+    params = [status]
+    if claimed is not None:
+        sql += " AND claimed = ?"
+        params.append(int(claimed))
+    return [_decode(row, BATCH_FIELDS) for row in connect().execute(sql + " ORDER BY created_at", params)]
+
+
+def prune_batches(status, keep):
+    """Delete all but the newest `keep` batches in `status`"""
+    ensure_schema('jobs', SCHEMA)
+    conn = connect()
+    with conn:
+        conn.execute("""
+            DELETE FROM batches WHERE batch_id IN (
+                SELECT batch_id FROM batches WHERE status = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )""", (status, keep))
@@ -0,0 +1,254 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from report_store import GZIP_SUFFIX, find_report, uncompressed_size
+from state_db import connect, ensure_schema
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+REPORT_QUERY_LIMIT = int(os.getenv("REPORT_QUERY_LIMIT", "500"))  # Max reports returned by one /reports page
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    job_id TEXT,
+    target TEXT,
+    mode TEXT,
+    status TEXT,
+    size_bytes INTEGER NOT NULL,
+    uncompressed_bytes INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reports_target_created ON reports(target, created_at);
+CREATE INDEX IF NOT EXISTS idx_reports_created ON reports(created_at);
+"""
+
+# Query parameter -> reports column
+FILTERS = {
+    'target': 'target',
+    'mode': 'mode',
+    'status': 'status',
+    'job_id': 'job_id'
+}
+
+REPORT_PREFIX = 'zap_report_'
+REPORT_SUFFIX = '.html'
+
+EVICTED = counter('zap_reports_evicted_total', 'Reports deleted by retention', ('reason',))
+
+
+def new_report_name(mode):
+    """Return (report_id, filename) for a new report; the random suffix keeps same-second scans apart"""
+    report_id = f"{mode}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    return report_id, f"{REPORT_PREFIX}{report_id}{REPORT_SUFFIX}"
+
+
+def report_id_for(filename):
+    """The report ID in a report filename, or None for files that are not reports"""
+    name = os.path.basename(filename)
+    if name.endswith(GZIP_SUFFIX):
+        name = name[:-len(GZIP_SUFFIX)]
+    if not (name.startswith(REPORT_PREFIX) and name.endswith(REPORT_SUFFIX)):
+        return None
+    return name[len(REPORT_PREFIX):-len(REPORT_SUFFIX)]
+
+
+def _migrate(conn):
+    """Add the uncompressed size column to catalogs created before it existed"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if 'uncompressed_bytes' not in [row[1] for row in conn.execute("PRAGMA table_info(reports)")]:
+            conn.execute("ALTER TABLE reports ADD COLUMN uncompressed_bytes INTEGER")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _ensure_schema():
+    ensure_schema('reports', SCHEMA, migrate=_migrate)
+
+
+def catalog_report(report_dir, filename, target, mode, status, job_id=None, uncompressed_bytes=None):
+    """Record a stored report; return its catalog entry, or None if the file is missing
+
+    `uncompressed_bytes` is the size write_report returned; it is counted
+    from the file when not given.
+    """
+    _ensure_schema()
+    path = find_report(report_dir, filename)
+    if not path:
+        logger.warning(f"Not cataloguing missing report {filename}")
+        return None
+    stat = os.stat(path)
+    if uncompressed_bytes is None:
+        uncompressed_bytes = uncompressed_size(path) if path.endswith(GZIP_SUFFIX) else stat.st_size
+    entry = {
+        "report_id": report_id_for(filename),
+        "filename": filename,
+        "job_id": job_id,
+        "target": target,
+        "mode": mode,
+        "status": status,
+        "size_bytes": stat.st_size,
+        "uncompressed_bytes": uncompressed_bytes,
+        "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat()
+    }
+    conn = connect()
+    with conn:
+        conn.execute(f"INSERT OR REPLACE INTO reports ({', '.join(entry)}) VALUES ({', '.join('?' for _ in entry)})",
+                     list(entry.values()))
+    return entry
+
+
+def query_reports(filters, limit=100, offset=0):
+    """Return (reports, total) matching the filters, newest first
+
+    `since` and `until` bound created_at (ISO dates or timestamps);
+    `latest=true` keeps only the newest report per target.
+    """
+    _ensure_schema()
+    clauses = []
+    params = []
+    for key, column in FILTERS.items():
+        value = filters.get(key)
+        if not value:
+            continue
+        values = [v.strip() for v in value.split(',') if v.strip()]
+        clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+    for key, op in (('since', '>='), ('until', '<')):
+        if filters.get(key):
+            clauses.append(f"created_at {op} ?")
+            params.append(datetime.fromisoformat(filters[key]).isoformat())
+    if str(filters.get('latest', 'false')).lower() == 'true':
+        clauses.append("created_at = (SELECT MAX(created_at) FROM reports AS newer WHERE newer.target = reports.target)")
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    conn = connect()
+    total = conn.execute(f"SELECT COUNT(*) FROM reports {where}", params).fetchone()[0]
+    rows = conn.execute(f"SELECT * FROM reports {where} ORDER BY created_at DESC, report_id LIMIT ? OFFSET ?",
+                        params + [min(limit, REPORT_QUERY_LIMIT), offset]).fetchall()
+    return [dict(row) for row in rows], total
+
+
+def get_report(report_id):
+    _ensure_schema()
+    row = connect().execute("SELECT * FROM reports WHERE report_id = ?", (report_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def catalog_totals():
+    """Return (reports, bytes) held in the catalog"""
+    _ensure_schema()
+    count, size = connect().execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM reports").fetchone()
+    return count, size
+
+
+def import_untracked(report_dir):
+    """Catalog report files the catalog does not know yet, e.g. written before it existed
+
+    Their target and status are unknown, so only age and the disk quota
+    apply to them. Returns how many were added.
+    """
+    _ensure_schema()
+    conn = connect()
+    known = {row[0] for row in conn.execute("SELECT filename FROM reports")}
+    added = 0
+    for name in os.listdir(report_dir):
+        report_id = report_id_for(name)
+        filename = name[:-len(GZIP_SUFFIX)] if name.endswith(GZIP_SUFFIX) else name
+        if report_id is None or filename in known:
+            continue
+        mode = report_id.split('_', 1)[0]
+        catalog_report(report_dir, filename, None, mode, None)
+        known.add(filename)
+        added += 1
+    if added:
+        logger.info(f"Catalogued {added} existing reports in {report_dir}")
+    return added
+
+
+def enforce_retention(report_dir, max_age_days=0, max_per_target=0, quota_bytes=0):
+    """Delete reports older than max_age_days, beyond the newest max_per_target per target,
+    then the oldest ones until the rest fit in quota_bytes; 0 disables a limit
+
+    Returns {reason: reports deleted}.
+    """
+    _ensure_schema()
+    conn = connect()
+    evicted = {}
+    if max_age_days:
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat()
+        rows = conn.execute("SELECT report_id, filename FROM reports WHERE created_at < ?", (cutoff,)).fetchall()
+        evicted['age'] = _evict(report_dir, rows, 'age')
+    if max_per_target:
+        rows = conn.execute("""
+            SELECT report_id, filename FROM (
+                SELECT report_id, filename,
+                       ROW_NUMBER() OVER (PARTITION BY target ORDER BY created_at DESC) AS newer
+                FROM reports WHERE target IS NOT NULL
+            ) WHERE newer > ?""", (max_per_target,)).fetchall()
+        evicted['count'] = _evict(report_dir, rows, 'count')
+    if quota_bytes:
+        _, total = catalog_totals()
+        rows = []
+        if total > quota_bytes:
+            for row in conn.execute("SELECT report_id, filename, size_bytes FROM reports ORDER BY created_at"):
+                if total <= quota_bytes:
+                    break
+                rows.append(row)
+                total -= row['size_bytes']
+        evicted['quota'] = _evict(report_dir, rows, 'quota')
+    return evicted
+
+
+def _evict(report_dir, rows, reason):
+    conn = connect()
+    deleted = 0
+    for row in rows:
+        path = find_report(report_dir, row['filename'])
+        try:
+            if path:
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not delete report {path}: {str(e)}")
+            continue
+        with conn:
+            conn.execute("DELETE FROM reports WHERE report_id = ?", (row['report_id'],))
+        EVICTED.inc(reason=reason)
+        deleted += 1
+        logger.debug(f"Deleted report {row['filename']} ({reason})")
+    return deleted
+
+
+def start_retention(report_dir, interval, max_age_days=0, max_per_target=0, quota_bytes=0):
+    """Catalog untracked reports once, then apply retention every `interval` seconds in the background
+
+    Starts at import, before the service's setup_environment(), so the
+    report directory is created here rather than failing the first sweep.
+    """
+    os.makedirs(report_dir, exist_ok=True)
+
+    def loop():
+        try:
+            import_untracked(report_dir)
+        except OSError as e:
+            logger.warning(f"Could not catalog existing reports: {str(e)}")
+        while True:
+            try:
+                evicted = enforce_retention(report_dir, max_age_days, max_per_target, quota_bytes)
+                if any(evicted.values()):
+                    logger.info(f"Report retention deleted {evicted}")
+            except Exception as e:
+                logger.error(f"Report retention failed: {str(e)}")
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="report-retention", daemon=True).start()
+    logger.debug(f"Applying report retention every {interval}s")
@@ -0,0 +1,173 @@
+import gzip
+import logging
+import os
+import time
+
+from flask import Response, request, send_file
+
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+REPORT_CHUNK_SIZE = int(os.getenv("REPORT_CHUNK_SIZE", "65536"))  # Bytes per read/write when streaming reports
+REPORT_COMPRESSLEVEL = int(os.getenv("REPORT_COMPRESSLEVEL", "6"))
+
+GZIP_SUFFIX = '.gz'
+
+REPORT_BYTES = counter('zap_report_bytes_written_total', 'Report bytes written to disk', ('encoding',))
+DOWNLOAD_BYTES = counter('zap_report_download_bytes_total', 'Report bytes sent by /download-report', ('encoding',))
+DOWNLOAD_SECONDS = histogram('zap_report_download_seconds', 'Time to send a report from /download-report', ('encoding',))
+
+
+def write_report(report_path, chunks):
+    """Stream report chunks into `report_path` + '.gz'
+
+    The file is written under a temporary name and renamed into place so
+    readers never see a partial report. Returns (compressed, uncompressed)
+    byte counts.
+    """
+    stored_path = report_path + GZIP_SUFFIX
+    tmp_path = stored_path + '.part'
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as raw:
+            with gzip.GzipFile(filename=os.path.basename(report_path), mode='wb',
+                               compresslevel=REPORT_COMPRESSLEVEL, fileobj=raw) as gz:
+                for chunk in chunks:
+                    if chunk:
+                        gz.write(chunk)
+                        size += len(chunk)
+        os.replace(tmp_path, stored_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    compressed = os.path.getsize(stored_path)
+    REPORT_BYTES.inc(compressed, encoding='gzip')
+    REPORT_BYTES.inc(size, encoding='identity')
+    logger.debug(f"Wrote report {stored_path}: {size} bytes, {compressed} compressed")
+    return compressed, size
+
+
+def find_report(report_dir, report_filename):
+    """Return the stored path for a report name, or None if it does not exist"""
+    name = os.path.basename(report_filename)
+    if name.endswith(GZIP_SUFFIX):
+        name = name[:-len(GZIP_SUFFIX)]
+    for candidate in (name + GZIP_SUFFIX, name):
+        path = os.path.join(report_dir, candidate)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def uncompressed_size(gz_path):
+    """Count a gzip report's original size by decompressing it
+
+    The gzip trailer's ISIZE is only the size modulo 2**32, so this is the
+    fallback for reports whose size was not recorded when they were written.
+    """
+    size = 0
+    with gzip.open(gz_path, 'rb') as gz:
+        while True:
+            chunk = gz.read(REPORT_CHUNK_SIZE)
+            if not chunk:
+                return size
+            size += len(chunk)
+
+
+def serve_report(path, download_name, size=None):
+    """Serve a stored report honouring Accept-Encoding, Range and If-None-Match
+
+    `size` is the report's uncompressed size if known, e.g. from the catalog.
+    """
+    response = _serve_report(path, download_name, size)
+    if response.status_code in (200, 206):
+        response.response = _MeteredBody(response.response, response.headers.get('Content-Encoding', 'identity'))
+    return response
+
+
+class _MeteredBody:
+    """Count the bytes of a response body and the time until the server closes it
+
+    Report responses are passed straight through to the WSGI server, which
+    skips Response.call_on_close, so the body itself does the recording.
+    """
+
+    def __init__(self, body, encoding):
+        self._body = body
+        self._encoding = encoding
+        self._start = time.monotonic()
+        self._sent = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self._body, 'close'):
+            self._body.close()
+        DOWNLOAD_SECONDS.observe(time.monotonic() - self._start, encoding=self._encoding)
+        DOWNLOAD_BYTES.inc(self._sent, encoding=self._encoding)
+
+
+def _serve_report(path, download_name, size):
+    if not path.endswith(GZIP_SUFFIX):
+        # Reports written before compression was introduced
+        return send_file(path, mimetype='text/html', as_attachment=True,
+                         download_name=download_name, conditional=True)
+
+    stat = os.stat(path)
+    etag = f"{stat.st_size:x}-{int(stat.st_mtime):x}"
+
+    if request.accept_encodings['gzip']:
+        response = send_file(path, mimetype='text/html', as_attachment=True,
+                             download_name=download_name, conditional=True, etag=f"{etag}-gz")
+        if response.status_code in (200, 206):
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    # Client cannot take gzip: decompress on the fly
+    headers = {
+        'ETag': f'"{etag}"',
+        'Vary': 'Accept-Encoding',
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename={download_name}'
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    length = size if size is not None else uncompressed_size(path)
+    start, stop = 0, length
+    status = 200
+    byte_range = request.range
+    if_range = request.if_range
+    if (if_range.etag or if_range.date) and if_range.etag != etag:
+        # The client's copy is stale; send the whole report
+        byte_range = None
+    if byte_range:
+        bounds = byte_range.range_for_length(length)
+        if bounds is None:
+            headers['Content-Range'] = f"bytes */{length}"
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        status = 206
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+    headers['Content-Length'] = str(stop - start)
+
+    return Response(_decompress(path, start, stop), status=status, mimetype='text/html',
+                    headers=headers, direct_passthrough=True)
+
+
+def _decompress(path, start, stop):
+    with gzip.open(path, 'rb') as gz:
+        gz.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = gz.read(min(REPORT_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
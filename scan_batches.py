@@ -0,0 +1,203 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import job_store
+from scan_jobs import JobQueueFullError, JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED, FINISHED_STATES
+
+logger = logging.getLogger(__name__)
+
+BATCH_RUNNING = 'running'
+BATCH_FINISHED = 'finished'
+
+# Entries not yet handed to the job manager
+ENTRY_PENDING = 'pending'
+
+
+class BatchManager:
+    """Fan a list of scans out to a JobManager, at most `concurrency` at a time per batch
+
+    A finished target releases its slot to the next pending one, so a slow
+    or failing target never holds up the rest of the batch.
+
+    Batches are written through to the job store. Only the process running
+    scans (`runner`) dispatches them: it picks up batches other processes
+    stored on its next sync, and on start carries on with the batches an
+    earlier process left unfinished.
+    """
+
+    def __init__(self, job_manager, retention=100, count_alerts=None, runner=True):
+        self._job_manager = job_manager
+        self._retention = retention
+        self._count_alerts = count_alerts
+        self._runner = runner
+        self._batches = OrderedDict()
+        # Re-entrant: a cached job reports back from inside JobManager.submit
+        self._lock = threading.RLock()
+        if runner:
+            with self._lock:
+                for stored in job_store.load_batches(BATCH_RUNNING):
+                    self._adopt(stored)
+
+    def submit(self, entries, concurrency):
+        """Start a batch of {"target", "mode", "options", "force", "priority", "tenant"} entries; return its snapshot"""
+        batch_id = uuid.uuid4().hex
+        batch = {
+            "batch_id": batch_id,
+            "status": BATCH_RUNNING,
+            "concurrency": concurrency,
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "entries": [
+                {
+                    "target": entry["target"],
+                    "mode": entry["mode"],
+                    "options": entry.get("options") or {},
+                    "force": entry.get("force", False),
+                    "priority": entry.get("priority"),
+                    "tenant": entry.get("tenant"),
+                    "job_id": None,
+                    "status": ENTRY_PENDING,
+                    "error": None
+                }
+                for entry in entries
+            ],
+            "pending": deque(range(len(entries))),
+            "active": 0,
+            "dispatching": False
+        }
+        if not self._runner:
+            job_store.save_batch(self._stored(batch), claimed=False)
+            logger.info(f"Stored batch {batch_id} for the scan runner: {len(entries)} targets")
+            return self.get(batch_id)
+        with self._lock:
+            self._batches[batch_id] = batch
+            self._prune()
+            logger.info(f"Started batch {batch_id}: {len(entries)} targets, concurrency {concurrency}")
+            self._dispatch(batch)
+        return self.get(batch_id)
+
+    def sync(self):
+        """Start dispatching batches that other processes stored"""
+        with self._lock:
+            for stored in job_store.load_batches(BATCH_RUNNING, claimed=False):
+                self._adopt(stored)
+
+    def _adopt(self, stored):
+        """Dispatch a stored batch: watch its entries' jobs and queue the entries not yet handed over"""
+        batch = dict(stored, pending=deque(), active=0, dispatching=True)
+        self._batches[batch["batch_id"]] = batch
+        for index, entry in enumerate(batch["entries"]):
+            if entry["job_id"] is None and entry["status"] == ENTRY_PENDING:
+                batch["pending"].append(index)
+            elif entry["job_id"] and entry["status"] not in FINISHED_STATES:
+                batch["active"] += 1
+                if not self._job_manager.watch(entry["job_id"],
+                                               lambda job, index=index: self._finished(batch, index, job)):
+                    entry.update(status=JOB_FAILED, error="Job no longer exists")
+                    batch["active"] -= 1
+        logger.info(f"Dispatching batch {batch['batch_id']}: {len(batch['pending'])} targets pending, "
+                    f"{batch['active']} in flight")
+        self._dispatch(batch)
+
+    def get(self, batch_id):
+        """Return progress, per-target state and an alert summary for a batch, or None"""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is not None:
+                batch = self._stored(batch)
+                batch["entries"] = [dict(entry) for entry in batch["entries"]]
+        if batch is None:
+            # Finished before this process started, or stored by another process
+            batch = job_store.load_batch(batch_id)
+            if batch is None:
+                return None
+        entries = batch["entries"]
+        snapshot = {key: batch[key] for key in ("batch_id", "status", "concurrency", "created_at", "finished_at")}
+
+        progress = {"total": len(entries), ENTRY_PENDING: 0, JOB_QUEUED: 0, JOB_RUNNING: 0,
+                    JOB_COMPLETED: 0, JOB_FAILED: 0}
+        summary = {"by_target": {}, "by_risk": {}}
+        targets = []
+        counted = set()
+        for entry in entries:
+            job = self._job_manager.get(entry["job_id"]) if entry["job_id"] else None
+            if job and entry["status"] not in FINISHED_STATES:
+                entry["status"] = job["status"]
+            progress[entry["status"]] += 1
+            result = job["result"] if job and entry["status"] in FINISHED_STATES else None
+            targets.append({
+                "target": entry["target"],
+                "mode": entry["mode"],
+                "job_id": entry["job_id"],
+                "status": entry["status"],
+                "error": entry["error"] or (result or {}).get("error"),
+                "result": result
+            })
+            if entry["status"] == JOB_COMPLETED and self._count_alerts and entry["job_id"] not in counted:
+                # Duplicate entries coalesce into one job; count its alerts once
+                counted.add(entry["job_id"])
+                counts = self._count_alerts(entry["job_id"])
+                # The same target may be scanned in several modes, so its counts are kept per mode
+                summary["by_target"].setdefault(entry["target"], {})[entry["mode"]] = counts
+                for risk, count in counts.items():
+                    summary["by_risk"][risk] = summary["by_risk"].get(risk, 0) + count
+        progress["finished"] = progress[JOB_COMPLETED] + progress[JOB_FAILED]
+        snapshot.update(progress=progress, summary=summary, targets=targets)
+        return snapshot
+
+    def _dispatch(self, batch):
+        """Hand pending entries to the job manager until the batch's slots are full"""
+        batch["dispatching"] = True
+        while batch["pending"] and batch["active"] < batch["concurrency"]:
+            index = batch["pending"].popleft()
+            entry = batch["entries"][index]
+            batch["active"] += 1
+            try:
+                job = self._job_manager.submit(
+                    entry["target"], entry["mode"], options=entry["options"], force=entry["force"],
+                    priority=entry["priority"], tenant=entry["tenant"],
+                    on_finish=lambda job, batch=batch, index=index: self._finished(batch, index, job))
+            except JobQueueFullError as e:
+                logger.error(f"Batch {batch['batch_id']}: could not queue {entry['target']}: {str(e)}")
+                entry.update(status=JOB_FAILED, error=str(e))
+                batch["active"] -= 1
+                continue
+            if entry["job_id"] is None:
+                entry["job_id"] = job["job_id"]
+        batch["dispatching"] = False
+        self._check_finished(batch)
+        job_store.save_batch(self._stored(batch))
+
+    def _finished(self, batch, index, job):
+        with self._lock:
+            entry = batch["entries"][index]
+            entry.update(job_id=job["job_id"], status=job["status"])
+            batch["active"] -= 1
+            # Cached jobs finish inside submit(); the running dispatch loop picks up the freed slot
+            if not batch["dispatching"]:
+                self._dispatch(batch)
+
+    def _check_finished(self, batch):
+        if batch["status"] == BATCH_RUNNING and not batch["pending"] and batch["active"] == 0:
+            batch["status"] = BATCH_FINISHED
+            batch["finished_at"] = datetime.now().isoformat()
+            failed = sum(1 for entry in batch["entries"] if entry["status"] == JOB_FAILED)
+            logger.info(f"Batch {batch['batch_id']} finished: {len(batch['entries'])} targets, {failed} failed")
+            job_store.prune_batches(BATCH_FINISHED, self._retention)
+
+    def _stored(self, batch):
+        """The part of a batch kept in the job store"""
+        return {key: batch[key] for key in ("batch_id", "status", "concurrency", "created_at", "finished_at", "entries")}
+
+    def _prune(self):
+        """Drop the oldest finished batches once more than `retention` are kept"""
+        excess = len(self._batches) - self._retention
+        for batch_id in list(self._batches):
+            if excess <= 0:
+                break
+            if self._batches[batch_id]["status"] == BATCH_FINISHED:
+                del self._batches[batch_id]
+                excess -= 1
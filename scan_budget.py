@@ -0,0 +1,36 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ScanPlan:
+    """Split a scan's remaining time across its phases
+
+    Each phase is allotted its weight's share of the time left when it
+    starts, divided among itself and the phases still to come, so time an
+    earlier phase did not use flows to the later ones. `reserve` seconds
+    before the deadline are kept back for storing alerts and the report.
+    """
+
+    def __init__(self, deadline, weights, reserve=0):
+        self.deadline = deadline
+        self.reserve = reserve
+        self._pending = dict(weights)
+        self.allotments = {}
+
+    def allot(self, phase, cap=None):
+        """Return the seconds phase may run, at most `cap`; later phases share the rest"""
+        remaining = max(0, self.deadline - time.time() - self.reserve)
+        weight = self._pending.pop(phase, 0)
+        total = weight + sum(self._pending.values())
+        seconds = remaining * weight / total if total else remaining
+        if cap:
+            seconds = min(seconds, cap)
+        self.allotments[phase] = round(seconds, 1)
+        logger.debug(f"Allotted {seconds:.0f}s of {remaining:.0f}s remaining to {phase}")
+        return seconds
+
+    def skip(self, phase):
+        """Drop a phase that will not run so its share goes to the others"""
+        self._pending.pop(phase, None)
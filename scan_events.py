@@ -0,0 +1,119 @@
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(event_id, event, data):
+    """Encode one Server-Sent Event; an event_id of None sends no id"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+class EventStream:
+    """Buffered events of one job, numbered from 1 so clients can resume after a given id"""
+
+    def __init__(self, lock, buffer_size):
+        self.events = deque(maxlen=buffer_size)
+        self.next_id = 1
+        self.closed = False
+        self.watchers = 0
+        self.changed = threading.Condition(lock)
+
+    def after(self, event_id):
+        return [event for event in self.events if event[0] > event_id]
+
+
+class EventHub:
+    """Fan each job's events out to any number of subscribers
+
+    The scan publishes each event once, however many clients watch it;
+    every subscriber reads the same buffer. Closed streams are kept for
+    the `retention` most recent jobs so late subscribers can replay them.
+    """
+
+    def __init__(self, buffer_size=1000, retention=100):
+        self._buffer_size = buffer_size
+        self._retention = retention
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def publish(self, job_id, event, data):
+        with self._lock:
+            stream = self._stream(job_id)
+            if stream.closed:
+                return
+            stream.events.append((stream.next_id, event, data))
+            stream.next_id += 1
+            stream.changed.notify_all()
+
+    def close(self, job_id, event, data):
+        """Publish a final event and end the job's stream"""
+        with self._lock:
+            stream = self._stream(job_id)
+            if stream.closed:
+                return
+            stream.events.append((stream.next_id, event, data))
+            stream.next_id += 1
+            stream.closed = True
+            stream.changed.notify_all()
+            self._prune()
+
+    def watchers(self, job_id):
+        """Number of clients subscribed to a job's events"""
+        with self._lock:
+            stream = self._streams.get(job_id)
+            return stream.watchers if stream else 0
+
+    def known(self, job_id):
+        with self._lock:
+            return job_id in self._streams
+
+    def subscribe(self, job_id, after=0, heartbeat=15):
+        """Yield (id, event, data) tuples newer than `after` until the stream closes
+
+        Yields None when nothing happened for `heartbeat` seconds, so the
+        caller can keep the connection alive.
+        """
+        with self._lock:
+            stream = self._stream(job_id)
+            stream.watchers += 1
+        try:
+            while True:
+                with self._lock:
+                    pending = stream.after(after)
+                    if not pending and not stream.closed:
+                        stream.changed.wait(heartbeat)
+                        pending = stream.after(after)
+                    closed = stream.closed
+                if not pending:
+                    if closed:
+                        return
+                    yield None
+                    continue
+                for event in pending:
+                    yield event
+                    after = event[0]
+        finally:
+            with self._lock:
+                stream.watchers -= 1
+
+    def _stream(self, job_id):
+        stream = self._streams.get(job_id)
+        if stream is None:
+            stream = self._streams[job_id] = EventStream(self._lock, self._buffer_size)
+        return stream
+
+    def _prune(self):
+        """Drop the oldest closed, unwatched streams once more than `retention` are kept"""
+        excess = len(self._streams) - self._retention
+        for job_id in list(self._streams):
+            if excess <= 0:
+                break
+            stream = self._streams[job_id]
+            if stream.closed and not stream.watchers:
+                del self._streams[job_id]
+                excess -= 1
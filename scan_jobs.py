@@ -0,0 +1,525 @@
+import heapq
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import job_store
+from scan_scheduler import FairScheduler
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRIORITY = 'default'
+DEFAULT_TENANT = 'default'
+
+# Expected run time of a mode before any of its scans has finished
+DEFAULT_JOB_SECONDS = 300
+# Weight of the latest run in a mode's average run time
+DURATION_SMOOTHING = 0.2
+# Seconds between queue estimates published to the job store while the queue order is unchanged
+ESTIMATE_REFRESH = 10
+
+QUEUE_SECONDS = histogram('zap_job_queue_seconds', 'Time scan jobs wait for a worker', ('priority',))
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED)
+
+
+class JobQueueFullError(Exception):
+    """Raised when the scan queue cannot accept more jobs"""
+
+
+class ResultCache:
+    """Finished jobs by scan key, with a TTL and LRU eviction beyond max_size
+
+    Not thread-safe on its own; JobManager calls it under its lock.
+    """
+
+    def __init__(self, ttl=900, max_size=256):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, job = entry
+        if time.time() >= expires:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return job
+
+    def find(self, job_id):
+        """Return a cached job by ID, even if it has expired from the job list"""
+        for expires, job in self._entries.values():
+            if job["job_id"] == job_id and time.time() < expires:
+                return job
+        return None
+
+    def put(self, key, job):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        self._entries[key] = (time.time() + self.ttl, job)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def new_job(target_url, mode, options, priority, tenant):
+    return {
+        "job_id": uuid.uuid4().hex,
+        "status": JOB_QUEUED,
+        "target": target_url,
+        "mode": mode,
+        "options": options,
+        "priority": priority,
+        "tenant": tenant,
+        "created_at": datetime.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None
+    }
+
+
+def scan_key(target_url, mode, options):
+    """Identify scans that would produce the same result"""
+    return (target_url, mode, tuple(sorted(options.items())))
+
+
+class JobManager:
+    """Run scan jobs in the background on a bounded pool of worker threads
+
+    Workers take the next job from `scheduler`, which orders the queue by
+    priority class and tenant; without one, jobs run first come, first
+    served. Submissions for a scan key that is already queued or running
+    attach to the in-flight job, and recent successful results are served
+    from a ResultCache unless the caller forces a fresh scan. `on_status`
+    is called with a job's snapshot when it starts running and when it
+    finishes.
+
+    Every job is written through to the job store. On start, jobs an
+    earlier process left queued are queued again, and jobs it left running
+    are handed to `runner` before any others so it can resume them.
+    """
+
+    def __init__(self, runner, workers=4, max_queued=500, retention=1000, cache_ttl=900, cache_size=256,
+                 on_status=None, scheduler=None):
+        self._runner = runner
+        self._on_status = on_status
+        self._max_queued = max_queued
+        self._retention = retention
+        self._workers = workers
+        self._scheduler = scheduler or FairScheduler([(DEFAULT_PRIORITY, 1)], aging=0)
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self._callbacks = {}
+        self._cache = ResultCache(cache_ttl, cache_size)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queued = 0
+        self._durations = {}
+        self._order = None      # Queued job IDs in expected start order, rebuilt when the queue changes
+        self._published_at = 0
+        self._resuming = deque()
+        self._active = 0
+        self._draining = False
+        self._finished_since_prune = False
+        with self._lock:
+            self._restore()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"scan-worker-{i}", daemon=True).start()
+        logger.debug(f"Job manager started with {workers} workers, queue limit {max_queued}")
+
+    def submit(self, target_url, mode, options=None, force=False, on_finish=None, priority=None, tenant=None):
+        """Queue a scan and return a snapshot of its job
+
+        The snapshot has "coalesced" set when it is an existing in-flight
+        job and "cached" set when it is a recently completed one. A queued
+        job joined by a higher priority request moves up to that priority.
+        `on_finish` is called with the finished job's snapshot, right away
+        for a cached job.
+        """
+        options = options or {}
+        priority = priority or self._scheduler.classes[-1]
+        tenant = tenant or DEFAULT_TENANT
+        key = scan_key(target_url, mode, options)
+        with self._lock:
+            # Jobs other processes queued may already cover this scan
+            self._adopt()
+            snapshot = self._attach(key, target_url, mode, on_finish, priority) if not force else None
+            if snapshot is None:
+                snapshot = self._enqueue(key, target_url, mode, options, on_finish, priority, tenant)
+        if snapshot.get("cached") and on_finish:
+            self._notify(on_finish, snapshot)
+        elif not snapshot.get("coalesced"):
+            logger.info(f"Queued {mode} scan job {snapshot['job_id']} for {target_url} ({priority}, tenant {tenant})")
+        return snapshot
+
+    def watch(self, job_id, on_finish):
+        """Call on_finish with the job's snapshot once it finishes, right away if it already has
+
+        Returns False for a job that is no longer known.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job["status"] not in FINISHED_STATES:
+                self._callbacks[job_id].append(on_finish)
+                return True
+        job = self.get(job_id)
+        if job is None:
+            return False
+        self._notify(on_finish, job)
+        return True
+
+    def _attach(self, key, target_url, mode, on_finish, priority):
+        """Return the in-flight or cached job for key, or None"""
+        job_id = self._in_flight.get(key)
+        if job_id:
+            logger.info(f"Attaching {mode} scan of {target_url} to in-flight job {job_id}")
+            if on_finish:
+                self._callbacks[job_id].append(on_finish)
+            job = self._jobs[job_id]
+            if job["status"] == JOB_QUEUED and self._outranks(priority, job["priority"]):
+                self._promote(job, priority)
+            return self._snapshot(job, coalesced=True)
+        cached = self._cache.get(key)
+        if cached is None and self._cache.ttl > 0:
+            # Results of earlier processes are only in the job store
+            since = datetime.fromtimestamp(time.time() - self._cache.ttl).isoformat()
+            cached = job_store.find_job(key, JOB_COMPLETED, finished_since=since)
+        if cached:
+            logger.info(f"Serving {mode} scan of {target_url} from cached job {cached['job_id']}")
+            return dict(cached, cached=True)
+        return None
+
+    def _outranks(self, priority, other):
+        return self._scheduler.classes.index(priority) < self._scheduler.classes.index(other)
+
+    def _promote(self, job, priority):
+        self._scheduler.promote(job["job_id"], priority)
+        job["priority"] = priority
+        self._order = None
+        job_store.update_job(job["job_id"], priority=priority)
+
+    def _enqueue(self, key, target_url, mode, options, on_finish, priority, tenant):
+        if self._queued >= self._max_queued:
+            raise JobQueueFullError(f"Scan queue is full ({self._max_queued} jobs waiting)")
+        job = new_job(target_url, mode, options, priority, tenant)
+        job_store.save_job(job, key)
+        self._add(job, key, on_finish)
+        self._prune()
+        return self._snapshot(job)
+
+    def _add(self, job, key, on_finish=None):
+        """Track a queued or running job and, if queued, hand it to the scheduler"""
+        job_id = job["job_id"]
+        self._jobs[job_id] = job
+        self._in_flight[key] = job_id
+        self._callbacks[job_id] = [on_finish] if on_finish else []
+        if job["status"] == JOB_RUNNING:
+            self._resuming.append(job_id)
+            self._scheduler.running[job["tenant"]] += 1
+        else:
+            self._queued += 1
+            self._scheduler.add(job_id, job["priority"], job["tenant"],
+                                queued_at=datetime.fromisoformat(job["created_at"]).timestamp())
+            self._order = None
+        self._changed.notify()
+
+    def _restore(self):
+        """Take over the jobs an earlier process left queued or running"""
+        restored = job_store.load_jobs((JOB_QUEUED, JOB_RUNNING))
+        for job, key in restored:
+            self._add(self._stored(job), key)
+        if restored:
+            job_store.claim_jobs([job["job_id"] for job, _ in restored])
+            logger.info(f"Restored {self._queued} queued and {len(self._resuming)} running jobs from the job store")
+
+    def _adopt(self):
+        """Take over jobs other processes queued in the job store"""
+        adopted = job_store.load_jobs((JOB_QUEUED,), claimed=False)
+        for job, key in adopted:
+            logger.info(f"Adopting {job['mode']} scan job {job['job_id']} for {job['target']}")
+            self._add(self._stored(job), key)
+        if adopted:
+            job_store.claim_jobs([job["job_id"] for job, _ in adopted])
+
+    def _stored(self, job):
+        """A job loaded from the store, without the published estimates and with a known priority class"""
+        job.pop("queue_position", None)
+        job.pop("estimated_start", None)
+        if job["priority"] not in self._scheduler.classes:
+            job["priority"] = self._scheduler.classes[-1]
+        job["tenant"] = job["tenant"] or DEFAULT_TENANT
+        return job
+
+    def sync(self):
+        """Adopt jobs queued by other processes, apply their priority changes and publish queue estimates
+
+        Processes that do not run scans submit through the job store and
+        read the estimates from it; this is how they see the queue.
+        """
+        estimates = None
+        with self._lock:
+            self._adopt()
+            for job_id, priority in job_store.job_priorities(JOB_QUEUED).items():
+                job = self._jobs.get(job_id)
+                if job and job["status"] == JOB_QUEUED and priority in self._scheduler.classes and \
+                        self._outranks(priority, job["priority"]):
+                    self._promote(job, priority)
+            if self._queued and (self._order is None or time.time() - self._published_at >= ESTIMATE_REFRESH):
+                estimates = {job_id: (position, datetime.fromtimestamp(start).isoformat())
+                             for job_id, (position, start) in self._estimates().items()}
+                self._published_at = time.time()
+            prune = self._finished_since_prune
+            self._finished_since_prune = False
+        if estimates:
+            job_store.save_queue_estimates(estimates)
+        if prune:
+            job_store.prune_jobs(FINISHED_STATES, self._retention)
+
+    def drain(self, timeout):
+        """Stop starting jobs and wait up to `timeout` seconds for running ones; return how many still run
+
+        Queued jobs stay in the job store, and jobs still running are left
+        for the next process to resume.
+        """
+        ends_at = time.time() + timeout
+        with self._lock:
+            if not self._draining:
+                self._draining = True
+                logger.info(f"Draining: {self._active} jobs running, {self._queued} left queued")
+            while self._active and time.time() < ends_at:
+                self._changed.wait(ends_at - time.time())
+            return self._active
+
+    def get(self, job_id):
+        """Return a snapshot of a job, or None if it is unknown
+
+        Queued jobs include their `queue_position` (1 starts next) and an
+        `estimated_start` from the average run time of each mode.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id) or self._cache.find(job_id)
+            if job:
+                return self._snapshot(job)
+        return job_store.load_job(job_id)
+
+    def _snapshot(self, job, **extra):
+        snapshot = dict(job, **extra)
+        if job["status"] == JOB_QUEUED:
+            position, start = self._estimates().get(job["job_id"], (None, None))
+            snapshot["queue_position"] = position
+            snapshot["estimated_start"] = datetime.fromtimestamp(start).isoformat() if start else None
+        return snapshot
+
+    def _estimates(self):
+        """Return {job_id: (queue position, expected start time)} for the queued jobs
+
+        Running jobs are assumed to take their mode's average run time,
+        and queued jobs start in scheduler order on whichever worker frees
+        up first.
+        """
+        if self._order is None:
+            self._order = self._scheduler.order()
+        now = time.time()
+        free_at = [now] * self._workers
+        running = [job for job in self._jobs.values() if job["status"] == JOB_RUNNING]
+        for i, job in enumerate(running[:self._workers]):
+            started = datetime.fromisoformat(job["started_at"]).timestamp()
+            free_at[i] = max(now, started + self._expected_seconds(job["mode"]))
+        heapq.heapify(free_at)
+        estimates = {}
+        for position, queued_id in enumerate(self._order):
+            start = heapq.heappop(free_at)
+            estimates[queued_id] = (position + 1, start)
+            heapq.heappush(free_at, start + self._expected_seconds(self._jobs[queued_id]["mode"]))
+        return estimates
+
+    def _expected_seconds(self, mode):
+        return self._durations.get(mode, DEFAULT_JOB_SECONDS)
+
+    def stats(self):
+        """Return counts of jobs by status"""
+        with self._lock:
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_COMPLETED: 0, JOB_FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def queue_depths(self):
+        """Return {(priority, tenant): queued jobs}"""
+        with self._lock:
+            depths = {}
+            for job in self._jobs.values():
+                if job["status"] == JOB_QUEUED:
+                    key = (job["priority"], job["tenant"])
+                    depths[key] = depths.get(key, 0) + 1
+            return depths
+
+    def _work(self):
+        while True:
+            with self._lock:
+                job_id = self._next()
+                while job_id is None:
+                    self._changed.wait()
+                    job_id = self._next()
+            self._run(job_id)
+
+    def _next(self):
+        """The job to start next: a job to resume, then the scheduler's pick; None while draining"""
+        if self._draining:
+            return None
+        job_id = self._resuming.popleft() if self._resuming else self._scheduler.pop()
+        if job_id is not None:
+            self._active += 1
+        return job_id
+
+    def _run(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            # A job restored as running keeps its start time; the runner decides whether it can resume it
+            resumed = job["status"] == JOB_RUNNING
+            if not resumed:
+                self._queued -= 1
+                self._order = None
+                job["status"] = JOB_RUNNING
+                job["started_at"] = datetime.now().isoformat()
+                job_store.update_job(job_id, status=JOB_RUNNING, started_at=job["started_at"],
+                                     queue_position=None, estimated_start=None)
+            target_url, mode, options = job["target"], job["mode"], job["options"]
+            snapshot = dict(job)
+        if not resumed:
+            QUEUE_SECONDS.observe((datetime.fromisoformat(snapshot["started_at"]) -
+                                   datetime.fromisoformat(snapshot["created_at"])).total_seconds(),
+                                  priority=snapshot["priority"])
+
+        logger.info(f"{'Resuming' if resumed else 'Starting'} job {job_id}: {mode} scan of {target_url}")
+        if self._on_status:
+            self._notify(self._on_status, snapshot)
+        try:
+            result = self._runner(job_id, target_url, mode, options)
+        except Exception as e:
+            logger.error(f"Job {job_id} raised: {str(e)}")
+            result = {
+                "success": False,
+                "status": "failed",
+                "error": str(e)
+            }
+
+        with self._lock:
+            job["result"] = result
+            job["status"] = JOB_COMPLETED if result.get("success") else JOB_FAILED
+            job["finished_at"] = datetime.now().isoformat()
+            job_store.update_job(job_id, status=job["status"], finished_at=job["finished_at"], result=result,
+                                 checkpoint=None)
+            if not resumed:
+                # A resumed job's run time includes the restart
+                seconds = (datetime.fromisoformat(job["finished_at"]) -
+                           datetime.fromisoformat(job["started_at"])).total_seconds()
+                average = self._durations.get(mode)
+                self._durations[mode] = seconds if average is None else \
+                    average + DURATION_SMOOTHING * (seconds - average)
+            self._scheduler.finish(job["tenant"])
+            self._order = None
+            self._active -= 1
+            self._finished_since_prune = True
+            # A tenant at its cap may have jobs that can start now, and drain() may be waiting
+            self._changed.notify_all()
+            key = scan_key(target_url, mode, options)
+            if self._in_flight.get(key) == job_id:
+                del self._in_flight[key]
+            if job["status"] == JOB_COMPLETED:
+                self._cache.put(key, dict(job))
+            callbacks = self._callbacks.pop(job_id, [])
+            snapshot = dict(job)
+        logger.info(f"Job {job_id} finished with status {job['status']}")
+        if self._on_status:
+            callbacks.insert(0, self._on_status)
+        for callback in callbacks:
+            self._notify(callback, snapshot)
+
+    def _notify(self, callback, job):
+        try:
+            callback(job)
+        except Exception as e:
+            logger.error(f"Callback for job {job['job_id']} raised: {str(e)}")
+
+    def _prune(self):
+        """Drop the oldest finished jobs once more than `retention` are kept"""
+        excess = len(self._jobs) - self._retention
+        if excess <= 0:
+            return
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id]["status"] in FINISHED_STATES:
+                del self._jobs[job_id]
+                excess -= 1
+
+
+class RemoteJobManager:
+    """Submit and look up jobs through the job store, for processes that do not run scans
+
+    Jobs are queued in the store for the process running scans to adopt
+    on its next sync. Coalescing, the result cache and the queue limit are
+    checked against the store, so every process sees the same jobs.
+    """
+
+    def __init__(self, scheduler, max_queued=500, cache_ttl=900):
+        self._scheduler = scheduler
+        self._max_queued = max_queued
+        self._cache_ttl = cache_ttl
+
+    def submit(self, target_url, mode, options=None, force=False, priority=None, tenant=None):
+        """Queue a scan in the job store and return a snapshot of its job, as JobManager.submit does"""
+        options = options or {}
+        priority = priority or self._scheduler.classes[-1]
+        tenant = tenant or DEFAULT_TENANT
+        key = scan_key(target_url, mode, options)
+        since = datetime.fromtimestamp(time.time() - self._cache_ttl).isoformat() if self._cache_ttl > 0 else None
+        job, outcome = job_store.submit_job(
+            new_job(target_url, mode, options, priority, tenant), key,
+            in_flight=() if force else (JOB_QUEUED, JOB_RUNNING),
+            completed=None if force else JOB_COMPLETED, completed_since=since, max_queued=self._max_queued)
+        if outcome == 'full':
+            raise JobQueueFullError(f"Scan queue is full ({self._max_queued} jobs waiting)")
+        if outcome == 'coalesced':
+            logger.info(f"Attaching {mode} scan of {target_url} to in-flight job {job['job_id']}")
+            classes = self._scheduler.classes
+            if job["status"] == JOB_QUEUED and job["priority"] in classes and \
+                    classes.index(priority) < classes.index(job["priority"]):
+                # The runner applies the new priority on its next sync
+                job_store.update_job(job["job_id"], priority=priority)
+                job["priority"] = priority
+            return dict(job, coalesced=True)
+        if outcome == 'cached':
+            logger.info(f"Serving {mode} scan of {target_url} from cached job {job['job_id']}")
+            return dict(job, cached=True)
+        logger.info(f"Queued {mode} scan job {job['job_id']} for {target_url} ({priority}, tenant {tenant})")
+        return dict(job, queue_position=None, estimated_start=None)
+
+    def get(self, job_id):
+        """Return a job from the store; queued jobs carry the runner's last queue estimate"""
+        return job_store.load_job(job_id)
+
+    def stats(self):
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_COMPLETED: 0, JOB_FAILED: 0}
+        counts.update(job_store.job_counts())
+        return counts
+
+    def queue_depths(self):
+        return job_store.queue_depths(JOB_QUEUED)
+
+    def drain(self, timeout):
+        """Nothing runs here, so there is nothing to wait for"""
+        return 0
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+from zap_client import ZapError
+
+logger = logging.getLogger(__name__)
+
+SCAN_POLICIES_FILE = os.getenv("SCAN_POLICIES_FILE", "scan_policies.json")  # Named scan policy definitions
+DEFAULT_THREADS_PER_HOST = int(os.getenv("DEFAULT_THREADS_PER_HOST", "2"))  # Active scan threads for scans without a policy setting
+
+# Prefix of the policies this service creates in ZAP, so user-made policies are never touched
+POLICY_PREFIX = 'zapsvc'
+
+ATTACK_STRENGTHS = ('LOW', 'MEDIUM', 'HIGH', 'INSANE')
+ALERT_THRESHOLDS = ('OFF', 'LOW', 'MEDIUM', 'HIGH')
+
+
+def validate_policy(name, definition):
+    """Return a normalized copy of one policy definition or raise ValueError"""
+    if not isinstance(definition, dict):
+        raise ValueError(f"Scan policy {name} must be an object")
+    unknown = set(definition) - {'description', 'scanners', 'attack_strength', 'alert_threshold', 'threads_per_host'}
+    if unknown:
+        raise ValueError(f"Scan policy {name} has unknown settings: {', '.join(sorted(unknown))}")
+    policy = {
+        'description': definition.get('description', ''),
+        'scanners': sorted(str(int(scanner)) for scanner in definition.get('scanners') or []),
+        'attack_strength': str(definition.get('attack_strength', 'MEDIUM')).upper(),
+        'alert_threshold': str(definition.get('alert_threshold', 'MEDIUM')).upper(),
+        'threads_per_host': definition.get('threads_per_host')
+    }
+    if policy['attack_strength'] not in ATTACK_STRENGTHS:
+        raise ValueError(f"Scan policy {name}: attack_strength must be one of {', '.join(ATTACK_STRENGTHS)}")
+    if policy['alert_threshold'] not in ALERT_THRESHOLDS:
+        raise ValueError(f"Scan policy {name}: alert_threshold must be one of {', '.join(ALERT_THRESHOLDS)}")
+    if policy['threads_per_host'] is not None and int(policy['threads_per_host']) < 1:
+        raise ValueError(f"Scan policy {name}: threads_per_host must be at least 1")
+    return policy
+
+
+def load_policies(path=SCAN_POLICIES_FILE):
+    """Read {name: definition} from a JSON file; a missing file means no named policies"""
+    if not os.path.exists(path):
+        logger.debug(f"No scan policy file at {path}")
+        return {}
+    with open(path) as f:
+        definitions = json.load(f)
+    policies = {name: validate_policy(name, definition) for name, definition in definitions.items()}
+    logger.info(f"Loaded scan policies from {path}: {', '.join(sorted(policies)) or 'none'}")
+    return policies
+
+
+def policy_digest(policy):
+    """Short hash of the settings ZAP stores, so a changed definition gets a new ZAP policy"""
+    settings = {key: policy[key] for key in ('scanners', 'attack_strength', 'alert_threshold')}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:10]
+
+
+class PolicyManager:
+    """Create named scan policies in each ZAP instance on first use and reuse them
+
+    The ZAP policy name carries a hash of the definition, so a policy is
+    created once per instance and definition; editing a definition creates
+    a new policy and removes the old one. Threads per host is a ZAP-wide
+    option rather than a policy setting, so it is set just before the
+    active scan starts while holding the instance's lock.
+    """
+
+    def __init__(self, policies):
+        self.policies = policies
+        self._created = {}   # (instance, name) -> ZAP policy name
+        self._threads = {}   # instance -> threads per host last set
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._set_threads = any(p['threads_per_host'] for p in policies.values())
+
+    def start_scan(self, zap, policy_name=None, **params):
+        """Start an active scan with the named policy, or ZAP's default for None; return ZAP's response"""
+        instance = zap.base_url
+        policy = self.policies[policy_name] if policy_name else None
+        with self._instance_lock(instance):
+            self._prepare(zap, instance, policy_name, policy, params)
+            try:
+                return zap.action('ascan', 'scan', **params)
+            except ZapError as e:
+                if not policy or e.status_code != 400:
+                    raise
+                # ZAP restarted or the policy was removed behind our back; set it up again once
+                logger.warning(f"Scan policy {params['scanPolicyName']} missing on {instance}, re-creating it")
+                self.forget(instance)
+                self._prepare(zap, instance, policy_name, policy, params)
+                return zap.action('ascan', 'scan', **params)
+
+    def forget(self, instance):
+        """Drop what is cached for an instance, e.g. after it went away and may have restarted"""
+        with self._lock:
+            for key in [key for key in self._created if key[0] == instance]:
+                del self._created[key]
+            self._threads.pop(instance, None)
+
+    def _instance_lock(self, instance):
+        with self._lock:
+            return self._locks.setdefault(instance, threading.Lock())
+
+    def _prepare(self, zap, instance, policy_name, policy, params):
+        if policy:
+            params['scanPolicyName'] = self._ensure(zap, instance, policy_name, policy)
+        if self._set_threads:
+            self._apply_threads(zap, instance, (policy or {}).get('threads_per_host') or DEFAULT_THREADS_PER_HOST)
+
+    def _ensure(self, zap, instance, name, policy):
+        zap_name = f"{POLICY_PREFIX}-{name}-{policy_digest(policy)}"
+        if self._created.get((instance, name)) == zap_name:
+            return zap_name
+
+        existing = zap.view('ascan', 'scanPolicyNames').get('scanPolicyNames', [])
+        versions = re.compile(rf"{re.escape(POLICY_PREFIX)}-{re.escape(name)}-[0-9a-f]{{10}}")
+        for stale in existing:
+            if versions.fullmatch(stale) and stale != zap_name:
+                logger.info(f"Removing outdated scan policy {stale} from {instance}")
+                zap.action('ascan', 'removeScanPolicy', scanPolicyName=stale)
+        if zap_name not in existing:
+            logger.info(f"Creating scan policy {zap_name} on {instance}")
+            zap.action('ascan', 'addScanPolicy', scanPolicyName=zap_name,
+                       attackStrength=policy['attack_strength'], alertThreshold=policy['alert_threshold'])
+            if policy['scanners']:
+                zap.action('ascan', 'disableAllScanners', scanPolicyName=zap_name)
+                zap.action('ascan', 'enableScanners', ids=','.join(policy['scanners']), scanPolicyName=zap_name)
+        with self._lock:
+            self._created[(instance, name)] = zap_name
+        return zap_name
+
+    def _apply_threads(self, zap, instance, threads):
+        if self._threads.get(instance) == threads:
+            return
+        zap.action('ascan', 'setOptionThreadPerHost', Integer=threads)
+        with self._lock:
+            self._threads[instance] = threads
@@ -0,0 +1,148 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scan_trace import span
+
+logger = logging.getLogger(__name__)
+
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "1"))  # Seconds between polls of a fast-moving scan
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "15"))  # Seconds between polls of a stalled scan
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", "4"))  # Threads running due polls and their progress callbacks
+
+# What to poll for each kind of ZAP scan: (component, view, params key, result key)
+POLL_VIEWS = {
+    'spider': ('spider', 'status', 'scanId', 'status'),
+    'ascan': ('ascan', 'status', 'scanId', 'status'),
+    'pscan': ('pscan', 'recordsToScan', None, 'recordsToScan'),
+    'ajax': ('ajaxSpider', 'status', None, 'status')
+}
+
+
+class PollTask:
+    """One in-flight ZAP scan being watched by the poller"""
+
+    def __init__(self, zap, kind, scan_id, on_progress):
+        self.zap = zap
+        self.kind = kind
+        self.scan_id = scan_id
+        self.on_progress = on_progress
+        # Polls run in the waiting caller's context, so its ZAP call deadline applies
+        self.context = contextvars.copy_context()
+        self.interval = POLL_MIN_INTERVAL
+        self.progress = None
+        self.polled_at = None
+        self.polls = 0
+        self.error = None
+        self.done = threading.Event()
+
+    def poll(self):
+        component, view, id_param, key = POLL_VIEWS[self.kind]
+        params = {id_param: self.scan_id} if id_param else {}
+        value = self.zap.view(component, view, **params).get(key, 0)
+        # The AJAX spider only reports "running" or "stopped"
+        value = (100 if value == 'stopped' else 0) if self.kind == 'ajax' else int(value)
+        now = time.time()
+
+        if self.kind == 'pscan':
+            # Passive scan reports records left in the queue; convert to a rising value
+            finished = value == 0
+            progress = -value
+        else:
+            finished = value >= 100
+            progress = value
+
+        if self.progress is not None and progress > self.progress:
+            # Moving: poll about twice before the estimated completion
+            rate = (progress - self.progress) / max(now - self.polled_at, 0.001)
+            remaining = (0 if self.kind == 'pscan' else 100) - progress
+            self.interval = min(max(remaining / rate / 2, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+        elif self.progress is not None:
+            # Stalled: back off
+            self.interval = min(self.interval * 1.5, POLL_MAX_INTERVAL)
+
+        self.progress = progress
+        self.polled_at = now
+        self.polls += 1
+        logger.debug(f"{self.kind} {self.scan_id or ''} progress: {value}, next poll in {self.interval:.1f}s")
+        if self.on_progress and self.on_progress(self.kind, value):
+            # The caller has seen enough, e.g. a spider reached its URL limit
+            return True
+        return finished
+
+
+class ScanPoller:
+    """Schedule polls of every in-flight ZAP scan from a single background loop
+
+    Each watched scan is polled on its own adaptive schedule: quickly while
+    its progress is moving, backing off while it stalls. Due polls and
+    their progress callbacks run on a small pool of workers, so one slow
+    ZAP instance or callback does not hold up the other scans' polls.
+    """
+
+    def __init__(self, workers=POLL_WORKERS):
+        self._queue = []
+        self._seq = itertools.count()
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan-poll")
+
+    def wait(self, zap, kind, scan_id=None, timeout=None, on_progress=None):
+        """Block until the scan finishes; return False if `timeout` expires first
+
+        `on_progress(kind, value)` is called after each poll; returning True
+        ends the wait as if the scan had finished. The polls' ZAP calls are
+        traced as children of the wait.
+        """
+        with span(f"wait {kind}", kind=kind, scan_id=scan_id, timeout=timeout) as waiting:
+            task = PollTask(zap, kind, scan_id, on_progress)
+            self._schedule(task, time.time())
+            finished = task.done.wait(timeout)
+            waiting.set(polls=task.polls, progress=task.progress, timed_out=not finished)
+            if not finished:
+                # Let the loop drop the task the next time it comes up
+                task.error = TimeoutError()
+                task.done.set()
+                return False
+            if task.error:
+                raise task.error
+            return True
+
+    def _schedule(self, task, when):
+        with self._wakeup:
+            heapq.heappush(self._queue, (when, next(self._seq), task))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="scan-poller", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+
+    def _loop(self):
+        while True:
+            with self._wakeup:
+                while not self._queue or self._queue[0][0] > time.time():
+                    self._wakeup.wait(self._queue[0][0] - time.time() if self._queue else None)
+                _, _, task = heapq.heappop(self._queue)
+
+            if not task.done.is_set():
+                # A task is back on the queue only after its poll ran, so it is never polled twice at once
+                self._workers.submit(self._poll, task)
+
+    def _poll(self, task):
+        try:
+            if task.context.run(task.poll):
+                task.done.set()
+                return
+        except Exception as e:
+            logger.error(f"Polling {task.kind} {task.scan_id or ''} failed: {str(e)}")
+            task.error = e
+            task.done.set()
+            return
+        self._schedule(task, time.time() + task.interval)
+
+
+poller = ScanPoller()
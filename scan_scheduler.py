@@ -0,0 +1,137 @@
+import copy
+import logging
+import time
+from collections import Counter, OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+def parse_weights(value):
+    """Parse 'name:weight,...' into [(name, weight)] in the given order"""
+    pairs = []
+    for item in value.split(','):
+        name, _, weight = item.strip().partition(':')
+        if name:
+            pairs.append((name.strip(), float(weight) if weight else 1.0))
+    return pairs
+
+
+class FairScheduler:
+    """Choose the next queued job by priority class weight, tenant fair share and age
+
+    Classes are listed from highest priority down. Each class advances a
+    virtual clock by 1/weight per job it starts, and the class whose clock
+    would be furthest behind after its next start goes next. With weights
+    8:4:1 the classes get 8/13, 4/13 and 1/13 of the starts while all are
+    busy, and an idle class does not bank credit. Within a class, tenants
+    take turns the same way and each tenant's jobs start in order. A
+    tenant at its running cap is skipped. A job waiting `aging` seconds
+    moves up one class, so low priority work is delayed, never starved.
+
+    Not thread-safe on its own; JobManager calls it under its lock.
+    """
+
+    def __init__(self, classes, aging=600, tenant_limit=0, tenant_limits=None):
+        self.classes = [name for name, _ in classes]
+        self.weights = dict(classes)
+        self.aging = aging
+        self.tenant_limit = tenant_limit
+        self.tenant_limits = tenant_limits or {}
+        self.running = Counter()
+        self._queues = {name: OrderedDict() for name in self.classes}  # class -> tenant -> deque of job IDs
+        self._class_pass = {name: 0.0 for name in self.classes}
+        self._tenant_pass = {}  # (class, tenant) -> virtual time
+        self._entries = {}      # job ID -> (class, tenant, time queued, time it entered its class)
+
+    def add(self, job_id, priority, tenant, queued_at=None):
+        """Queue a job; `queued_at` keeps the place and age of a job queued earlier, e.g. before a restart"""
+        if not self._waiting(priority):
+            self._class_pass[priority] = max([self._class_pass[priority]] + self._active_passes())
+        queued_at = queued_at or time.time()
+        self._enqueue(job_id, priority, tenant, queued_at, queued_at)
+
+    def promote(self, job_id, priority):
+        """Move a queued job up to `priority` if that is higher than its class"""
+        entry = self._entries.get(job_id)
+        if entry and self.classes.index(priority) < self.classes.index(entry[0]):
+            self._move(job_id, priority)
+
+    def pop(self):
+        """Remove and return the next job ID to start, or None if every queued tenant is at its cap"""
+        self._age()
+        best = None
+        for name in self.classes:
+            tenants = [tenant for tenant, queue in self._queues[name].items() if queue and self._allowed(tenant)]
+            if tenants and (best is None or self._finish_pass(name) < self._finish_pass(best[0])):
+                best = (name, tenants)
+        if best is None:
+            return None
+        name, tenants = best
+        tenant = min(tenants, key=lambda t: self._tenant_pass[(name, t)])
+        job_id = self._queues[name][tenant].popleft()
+        del self._entries[job_id]
+        self._class_pass[name] += 1 / self.weights[name]
+        self._tenant_pass[(name, tenant)] += 1
+        self.running[tenant] += 1
+        return job_id
+
+    def finish(self, tenant):
+        self.running[tenant] -= 1
+        if self.running[tenant] <= 0:
+            del self.running[tenant]
+
+    def order(self):
+        """Queued job IDs in the order they are expected to start, ignoring tenant caps"""
+        simulation = copy.deepcopy(self)
+        simulation.tenant_limit = 0
+        simulation.tenant_limits = {}
+        order = []
+        job_id = simulation.pop()
+        while job_id is not None:
+            order.append(job_id)
+            job_id = simulation.pop()
+        return order
+
+    def _enqueue(self, job_id, priority, tenant, queued_at, entered_at):
+        queues = self._queues[priority]
+        if not queues.get(tenant):
+            passes = [self._tenant_pass[(priority, t)] for t, queue in queues.items() if queue]
+            self._tenant_pass[(priority, tenant)] = max([self._tenant_pass.get((priority, tenant), 0.0)] + passes)
+        queue = queues.setdefault(tenant, deque())
+        # A promoted job goes ahead of the tenant's jobs queued after it
+        position = len(queue)
+        while position and self._entries[queue[position - 1]][2] > queued_at:
+            position -= 1
+        queue.insert(position, job_id)
+        self._entries[job_id] = (priority, tenant, queued_at, entered_at)
+
+    def _move(self, job_id, priority):
+        old, tenant, queued_at, _ = self._entries[job_id]
+        self._queues[old][tenant].remove(job_id)
+        if not self._waiting(priority):
+            self._class_pass[priority] = max([self._class_pass[priority]] + self._active_passes())
+        self._enqueue(job_id, priority, tenant, queued_at, time.time())
+        logger.debug(f"Job {job_id} moved from {old} to {priority}")
+
+    def _age(self):
+        """Move jobs that waited `aging` seconds in their class up one class"""
+        if not self.aging:
+            return
+        now = time.time()
+        for level, name in enumerate(self.classes[1:], start=1):
+            for queue in list(self._queues[name].values()):
+                for job_id in [job_id for job_id in queue if now - self._entries[job_id][3] >= self.aging]:
+                    self._move(job_id, self.classes[level - 1])
+
+    def _finish_pass(self, name):
+        return self._class_pass[name] + 1 / self.weights[name]
+
+    def _allowed(self, tenant):
+        limit = self.tenant_limits.get(tenant, self.tenant_limit)
+        return not limit or self.running[tenant] < limit
+
+    def _waiting(self, priority):
+        return any(self._queues[priority].values())
+
+    def _active_passes(self):
+        return [self._class_pass[name] for name in self.classes if self._waiting(name)]
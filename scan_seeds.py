@@ -0,0 +1,168 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from zap_client import ZapConnectionError, ZapError
+
+logger = logging.getLogger(__name__)
+
+# Seed files live where both the service and ZAP can read them (the shared reports volume by default)
+SEED_DIR = os.getenv("SEED_DIR", "/zap/reports/seeds")
+ZAP_SEED_DIR = os.getenv("ZAP_SEED_DIR", SEED_DIR)  # The same directory as mounted in the ZAP containers
+SEED_MAX_BYTES = int(os.getenv("SEED_MAX_BYTES", str(20 * 1024 * 1024)))  # Largest accepted seed upload
+SEED_CONCURRENCY = int(os.getenv("SEED_CONCURRENCY", "8"))  # Seed requests sent to ZAP at once
+SEED_MAX_REQUESTS = int(os.getenv("SEED_MAX_REQUESTS", "5000"))  # Seed requests replayed per scan
+
+SEED_TYPES = ('har', 'openapi', 'urls')
+EXTENSIONS = {'har': 'har', 'openapi': 'spec', 'urls': 'txt'}
+
+# Headers ZAP or the HTTP/1.1 rewrite sets itself
+SKIPPED_HEADERS = {'content-length', 'host', 'connection', 'transfer-encoding'}
+
+
+def save_seed(seed):
+    """Validate a {"type", "content" | "url" | "urls"} seed and store it; return its reference
+
+    Uploaded content is stored once under a hash of itself, so the
+    reference is short enough to key jobs on and the same upload is never
+    stored twice. An OpenAPI document given by URL is fetched by ZAP.
+    """
+    if not isinstance(seed, dict) or seed.get('type') not in SEED_TYPES:
+        raise ValueError(f"seed type must be one of: {', '.join(SEED_TYPES)}")
+    seed_type = seed['type']
+    if seed_type == 'openapi' and seed.get('url'):
+        if not seed['url'].startswith(('http://', 'https://')):
+            raise ValueError("seed url must be an http(s) URL")
+        return f"openapi_url:{seed['url']}"
+
+    content = seed.get('urls') if seed_type == 'urls' and 'urls' in seed else seed.get('content')
+    if content is None:
+        raise ValueError(f"{seed_type} seed needs content")
+    if isinstance(content, list):
+        content = '\n'.join(str(url) for url in content)
+    elif isinstance(content, dict):
+        content = json.dumps(content)
+    if isinstance(content, str):
+        content = content.encode()
+    if len(content) > SEED_MAX_BYTES:
+        raise ValueError(f"seed is larger than {SEED_MAX_BYTES} bytes")
+
+    if seed_type == 'har':
+        try:
+            entries = json.loads(content)['log']['entries']
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("har seed is not a HAR document (no log.entries)")
+        if not entries:
+            raise ValueError("har seed has no entries")
+    elif not content.strip():
+        raise ValueError(f"{seed_type} seed is empty")
+
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    os.makedirs(SEED_DIR, exist_ok=True)
+    path = os.path.join(SEED_DIR, f"{digest}.{EXTENSIONS[seed_type]}")
+    if not os.path.exists(path):
+        with open(f"{path}.part", 'wb') as f:
+            f.write(content)
+        os.replace(f"{path}.part", path)
+    logger.debug(f"Stored {seed_type} seed at {path}")
+    return f"{seed_type}:{digest}"
+
+
+def seed_path(reference, directory=SEED_DIR):
+    seed_type, _, digest = reference.partition(':')
+    return os.path.join(directory, f"{digest}.{EXTENSIONS[seed_type]}")
+
+
+def in_scope(url, target_url):
+    return url == target_url or url.startswith(target_url.rstrip('/') + '/') or url.startswith(target_url + '?')
+
+
+def har_requests(path, target_url):
+    """Yield raw HTTP/1.1 requests for the HAR entries under target_url"""
+    with open(path) as f:
+        entries = json.load(f)['log']['entries']
+    for entry in entries:
+        req = entry.get('request') or {}
+        url = req.get('url', '')
+        if not in_scope(url, target_url):
+            continue
+        parts = urllib.parse.urlsplit(url)
+        body = (req.get('postData') or {}).get('text') or ''
+        lines = [f"{req.get('method', 'GET')} {url} HTTP/1.1", f"Host: {parts.netloc}"]
+        for header in req.get('headers', []):
+            name = header.get('name', '')
+            # HTTP/2 pseudo-headers and framing headers do not carry over
+            if name.startswith(':') or name.lower() in SKIPPED_HEADERS:
+                continue
+            lines.append(f"{name}: {header.get('value', '')}")
+        if body:
+            lines.append(f"Content-Length: {len(body.encode())}")
+        yield '\r\n'.join(lines) + '\r\n\r\n' + body
+
+
+def listed_urls(path, target_url):
+    """Yield the URLs of a URL list under target_url; paths are taken relative to it"""
+    with open(path) as f:
+        for line in f:
+            url = line.strip()
+            if not url or url.startswith('#'):
+                continue
+            if url.startswith('/'):
+                url = target_url.rstrip('/') + url
+            if in_scope(url, target_url):
+                yield url
+
+
+def fan_out(call, items, concurrency, limit=SEED_MAX_REQUESTS):
+    """Run call(item) for up to `limit` items (None for all), `concurrency` at a time; return (sent, failed)
+
+    Each call runs in the caller's context so its ZAP deadline applies.
+    A lost ZAP connection stops the fan-out; other failures are counted.
+    """
+    items = [item for _, item in zip(range(limit), items)] if limit else list(items)
+    context = contextvars.copy_context()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="zap-seed") as pool:
+        futures = [pool.submit(context.copy().run, call, item) for item in items]
+        for future in futures:
+            try:
+                future.result()
+            except ZapConnectionError:
+                for pending in futures:
+                    pending.cancel()
+                raise
+            except ZapError as e:
+                failed += 1
+                logger.debug(f"Seed request failed: {str(e)}")
+    return len(items) - failed, failed
+
+
+def apply_seed(zap, reference, target_url, context_id=None, concurrency=SEED_CONCURRENCY):
+    """Load a stored seed into ZAP for target_url; return {"type", "sent", "failed"}"""
+    seed_type, _, value = reference.partition(':')
+    if seed_type == 'openapi_url':
+        params = {'url': value}
+        if context_id:
+            params['contextId'] = context_id
+        warnings = zap.action('openapi', 'importUrl', **params).get('importUrl', [])
+        return {"type": "openapi", "sent": None, "failed": None, "warnings": warnings}
+    if seed_type == 'openapi':
+        params = {'file': seed_path(reference, ZAP_SEED_DIR), 'target': target_url}
+        if context_id:
+            params['contextId'] = context_id
+        warnings = zap.action('openapi', 'importFile', **params).get('importFile', [])
+        return {"type": "openapi", "sent": None, "failed": None, "warnings": warnings}
+
+    if seed_type == 'har':
+        call = lambda raw: zap.action('core', 'sendRequest', post=True, request=raw, followRedirects='false')
+        items = har_requests(seed_path(reference), target_url)
+    else:
+        call = lambda url: zap.action('core', 'accessUrl', url=url, followRedirects='false')
+        items = listed_urls(seed_path(reference), target_url)
+    sent, failed = fan_out(call, items, concurrency)
+    logger.info(f"Seeded {target_url} with {sent} requests from {seed_type} ({failed} failed)")
+    return {"type": seed_type, "sent": sent, "failed": failed}
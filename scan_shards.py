@@ -0,0 +1,133 @@
+import html
+import logging
+import os
+from datetime import datetime
+
+from url_inventory import MESSAGE_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+FULL_SCAN_SHARDS = int(os.getenv("FULL_SCAN_SHARDS", "1"))  # ZAP instances one full scan's active scan is split across
+SHARD_MIN_URLS = int(os.getenv("SHARD_MIN_URLS", "50"))  # Fewest URLs worth giving a shard of their own
+SHARD_ACQUIRE_TIMEOUT = int(os.getenv("SHARD_ACQUIRE_TIMEOUT", "0"))  # Seconds to wait for a first extra instance
+
+RISK_ORDER = ['High', 'Medium', 'Low', 'Informational']
+
+
+def split_urls(urls, shards):
+    """Split URLs into at most `shards` lists of near-equal size, each a contiguous range in path order
+
+    Sorting keeps each subtree together, so shards cut the site tree into
+    neighbouring branches rather than scattering every branch across all
+    instances.
+    """
+    ordered = sorted(set(urls))
+    shards = max(1, min(shards, len(ordered)))
+    size, extra = divmod(len(ordered), shards)
+    groups = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(ordered[start:end])
+        start = end
+    return groups
+
+
+def recorded_requests(zap, base_url, shard_of):
+    """Return {shard: [raw request]} for the messages ZAP holds under base_url
+
+    `shard_of` maps URL -> shard. Each method and URL is replayed once;
+    URLs outside every shard are skipped.
+    """
+    requests = {}
+    seen = set()
+    start = 0
+    while True:
+        page = zap.view('core', 'messages', baseurl=base_url, start=start,
+                        count=MESSAGE_PAGE_SIZE).get('messages', [])
+        for message in page:
+            header = message.get('requestHeader', '')
+            request_line = header.split('\r\n', 1)[0].split(' ')
+            if len(request_line) < 2 or request_line[1] not in shard_of or tuple(request_line[:2]) in seen:
+                continue
+            seen.add(tuple(request_line[:2]))
+            if not header.endswith('\r\n\r\n'):
+                header = header.rstrip('\r\n') + '\r\n\r\n'
+            requests.setdefault(shard_of[request_line[1]], []).append(header + message.get('requestBody', ''))
+        if len(page) < MESSAGE_PAGE_SIZE:
+            break
+        start += len(page)
+    return requests
+
+
+def alert_key(alert):
+    """Identity of a finding regardless of which ZAP instance raised it"""
+    return (alert.get('pluginId'), alert.get('alert'), alert.get('method'), alert.get('url'), alert.get('param'))
+
+
+def merge_alerts(alert_lists):
+    """Concatenate alert lists, keeping the first of each finding raised by more than one instance"""
+    merged = []
+    seen = set()
+    for alerts in alert_lists:
+        for alert in alerts:
+            key = alert_key(alert)
+            if key not in seen:
+                seen.add(key)
+                merged.append(alert)
+    return merged
+
+
+def render_report(target_url, mode, alerts, shards):
+    """Yield an HTML report of merged alerts, in chunks for write_report
+
+    ZAP's own report only covers the alerts of the instance it runs on,
+    so a sharded scan's report is built from the merged alerts instead.
+    """
+    escape = lambda value: html.escape(str(value or ''))
+    counts = {risk: 0 for risk in RISK_ORDER}
+    for alert in alerts:
+        counts[alert.get('risk')] = counts.get(alert.get('risk'), 0) + 1
+    yield f"""<!DOCTYPE html>
+<html>
+<head>
+    <title>ZAP Scanning Report</title>
+    <style>
+        body {{ font-family: Arial, sans-serif; margin: 40px; }}
+        table {{ border-collapse: collapse; width: 100%; margin-bottom: 20px; }}
+        th, td {{ border: 1px solid #ccc; padding: 6px; text-align: left; vertical-align: top; }}
+        .High {{ background-color: #fcc; }} .Medium {{ background-color: #fdb; }}
+        .Low {{ background-color: #ffc; }} .Informational {{ background-color: #eef; }}
+    </style>
+</head>
+<body>
+    <h1>ZAP Scanning Report</h1>
+    <p><strong>Target:</strong> {escape(target_url)}<br>
+    <strong>Scan Mode:</strong> {escape(mode)}, active scan split across {len(shards)} ZAP instances<br>
+    <strong>Time:</strong> {datetime.now().isoformat()}</p>
+    <h2>Summary of Alerts</h2>
+    <table><tr><th>Risk</th><th>Number of Alerts</th></tr>
+""".encode()
+    yield ''.join(f"<tr class=\"{escape(risk)}\"><td>{escape(risk)}</td><td>{count}</td></tr>\n"
+                  for risk, count in counts.items()).encode()
+    yield "</table>\n<h2>Shards</h2>\n<table><tr><th>ZAP instance</th><th>URLs</th><th>Status</th></tr>\n".encode()
+    yield ''.join(f"<tr><td>{escape(shard['instance'])}</td><td>{shard['urls']}</td><td>{escape(shard['status'])}</td></tr>\n"
+                  for shard in shards).encode()
+    yield "</table>\n<h2>Alerts</h2>\n".encode()
+
+    rank = {risk: i for i, risk in enumerate(RISK_ORDER)}
+    for alert in sorted(alerts, key=lambda a: (rank.get(a.get('risk'), len(RISK_ORDER)), a.get('alert') or '')):
+        yield f"""<table class="{escape(alert.get('risk'))}">
+<tr><th colspan="2">{escape(alert.get('risk'))}: {escape(alert.get('alert'))}</th></tr>
+<tr><td>URL</td><td>{escape(alert.get('method'))} {escape(alert.get('url'))}</td></tr>
+<tr><td>Parameter</td><td>{escape(alert.get('param'))}</td></tr>
+<tr><td>Attack</td><td>{escape(alert.get('attack'))}</td></tr>
+<tr><td>Evidence</td><td>{escape(alert.get('evidence'))}</td></tr>
+<tr><td>Confidence</td><td>{escape(alert.get('confidence'))}</td></tr>
+<tr><td>Description</td><td>{escape(alert.get('description'))}</td></tr>
+<tr><td>Solution</td><td>{escape(alert.get('solution'))}</td></tr>
+<tr><td>Reference</td><td>{escape(alert.get('reference'))}</td></tr>
+<tr><td>CWE / WASC</td><td>{escape(alert.get('cweid'))} / {escape(alert.get('wascid'))}</td></tr>
+</table>
+""".encode()
+    yield "</body>\n</html>\n".encode()
@@ -0,0 +1,188 @@
+import atexit
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # JSONL file spans are appended to; empty disables tracing
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "jsonl")  # jsonl (one flat span per line) or otlp (OTLP/JSON export requests)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))  # Fraction of scans whose traces are recorded
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(100 * 1024 * 1024)))  # Size at which the file is rotated
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))  # Rotated trace files kept
+
+SERVICE_NAME = 'zap-service'
+
+_current = contextvars.ContextVar('trace_span', default=None)
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+class Span:
+    """One timed operation in a trace; `set` adds attributes until it ends"""
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.error = None
+
+    @property
+    def sampled(self):
+        return sampled(self.trace_id)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class NoSpan:
+    """Stands in for a span when nothing is recorded, so callers never check"""
+
+    trace_id = None
+    sampled = False
+
+    def set(self, **attributes):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+def sampled(trace_id):
+    """Whether a trace is recorded; decided from its ID so every process agrees"""
+    if TRACE_SAMPLE_RATE >= 1:
+        return True
+    return int(hashlib.md5(trace_id.encode()).hexdigest()[:8], 16) / 0xffffffff < TRACE_SAMPLE_RATE
+
+
+@contextmanager
+def trace(name, trace_id=None, **attributes):
+    """Start a trace with a root span; `trace_id` (a job ID) ties spans recorded apart into one trace
+
+    The root span's trace_id may be changed before it ends, e.g. once the
+    job a request created or joined is known.
+    """
+    if not TRACE_FILE:
+        yield NO_SPAN
+        return
+    with _record(Span(name, trace_id or uuid.uuid4().hex, None, attributes)) as span:
+        yield span
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record a child of the current span; outside a sampled trace this costs one lookup"""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        yield NO_SPAN
+        return
+    with _record(Span(name, parent.trace_id, parent.span_id, attributes)) as child:
+        yield child
+
+
+def traced(name):
+    """Decorator recording each call of a function as a span named `name`"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def _record(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        _current.reset(token)
+        if span.sampled:
+            _export(span, time.time_ns())
+
+
+def _export(span, end):
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = _start_exporter()
+    record = otlp_record(span, end) if TRACE_FORMAT == 'otlp' else jsonl_record(span, end)
+    _exporter.info(json.dumps(record, default=str))
+
+
+def _start_exporter():
+    """A logger whose records are written to TRACE_FILE by a background thread, off the scan's path"""
+    os.makedirs(os.path.dirname(TRACE_FILE) or '.', exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    exporter = logging.getLogger('scan_trace.spans')
+    exporter.propagate = False
+    exporter.setLevel(logging.INFO)
+    exporter.addHandler(logging.handlers.QueueHandler(records))
+    logger.info(f"Writing {TRACE_FORMAT} trace spans to {TRACE_FILE} (sample rate {TRACE_SAMPLE_RATE})")
+    return exporter
+
+
+def jsonl_record(span, end):
+    return {
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        "name": span.name,
+        "start": span.start / 1e9,
+        "duration_ms": round((end - span.start) / 1e6, 3),
+        "status": "error" if span.error else "ok",
+        "error": span.error,
+        "attributes": span.attributes
+    }
+
+
+def otlp_record(span, end):
+    """One span as an OTLP/JSON ExportTraceServiceRequest, the line format of the collector's otlpjsonfile receiver"""
+    otlp_span = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start),
+        "endTimeUnixNano": str(end),
+        "attributes": [{"key": key, "value": otlp_value(value)} for key, value in span.attributes.items()
+                       if value is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+    }
+    if span.parent_id:
+        otlp_span["parentSpanId"] = span.parent_id
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [otlp_span]}]
+    }]}
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
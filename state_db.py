@@ -0,0 +1,43 @@
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+STATE_DB = os.getenv("STATE_DB", "/zap/data/zap_service.db")
+
+_local = threading.local()
+_schemas_lock = threading.Lock()
+_schemas_created = set()
+
+
+def connect():
+    """Return this thread's connection to the service database"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(STATE_DB) or '.', exist_ok=True)
+        conn = sqlite3.connect(STATE_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers query while scans are writing
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        logger.debug(f"Opened database {STATE_DB}")
+    return conn
+
+
+def ensure_schema(name, sql, migrate=None):
+    """Create a module's tables and indexes once per process
+
+    `migrate(conn)` then runs once per process too, to bring tables
+    created by an earlier version up to date.
+    """
+    if name in _schemas_created:
+        return
+    with _schemas_lock:
+        if name not in _schemas_created:
+            connect().executescript(sql)
+            if migrate:
+                migrate(connect())
+            _schemas_created.add(name)
@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from state_db import connect, ensure_schema
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "100"))  # HTTP messages fetched from ZAP per call
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS url_inventory (
+    target TEXT NOT NULL,
+    url TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (target, url)
+);
+"""
+
+
+def message_fingerprint(message):
+    """Fingerprint a response by its ETag, or by a hash of its status line and body"""
+    status_line, _, headers = message.get('responseHeader', '').partition('\r\n')
+    for line in headers.split('\r\n'):
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'etag' and value.strip():
+            return f"etag:{value.strip()}"
+    digest = hashlib.sha256()
+    digest.update(status_line.encode())
+    digest.update(message.get('responseBody', '').encode())
+    return f"sha256:{digest.hexdigest()}"
+
+
+def fingerprint_urls(zap, base_url):
+    """Return {url: fingerprint} for the messages ZAP holds under base_url
+
+    Messages are read in pages; when a URL was fetched more than once the
+    latest response wins.
+    """
+    fingerprints = {}
+    start = 0
+    while True:
+        page = zap.view('core', 'messages', baseurl=base_url, start=start,
+                        count=MESSAGE_PAGE_SIZE).get('messages', [])
+        for message in page:
+            request_line = message.get('requestHeader', '').split('\r\n', 1)[0].split(' ')
+            if len(request_line) >= 2:
+                fingerprints[request_line[1]] = message_fingerprint(message)
+        if len(page) < MESSAGE_PAGE_SIZE:
+            break
+        start += len(page)
+    logger.debug(f"Fingerprinted {len(fingerprints)} URLs under {base_url}")
+    return fingerprints
+
+
+def diff_inventory(target, fingerprints):
+    """Compare fingerprints with the last stored inventory for target
+
+    Returns (changed, unchanged): the list of new or changed URLs, and a
+    dict mapping each unchanged URL to the job that last scanned it.
+    """
+    ensure_schema('url_inventory', SCHEMA)
+    previous = {
+        row['url']: (row['fingerprint'], row['job_id'])
+        for row in connect().execute("SELECT url, fingerprint, job_id FROM url_inventory WHERE target = ?", (target,))
+    }
+    changed = []
+    unchanged = {}
+    for url, fingerprint in fingerprints.items():
+        known = previous.get(url)
+        if known and known[0] == fingerprint:
+            unchanged[url] = known[1]
+        else:
+            changed.append(url)
+    return changed, unchanged
+
+
+def save_inventory(target, fingerprints, job_id):
+    """Record the URLs and fingerprints covered by job_id"""
+    ensure_schema('url_inventory', SCHEMA)
+    now = datetime.now().isoformat()
+    conn = connect()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO url_inventory (target, url, fingerprint, job_id, updated_at) VALUES (?, ?, ?, ?, ?)",
+            [(target, url, fingerprint, job_id, now) for url, fingerprint in fingerprints.items()])
+    logger.debug(f"Saved inventory of {len(fingerprints)} URLs for {target}")
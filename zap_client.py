@@ -0,0 +1,278 @@
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import counter, histogram
+from scan_trace import span
+
+logger = logging.getLogger(__name__)
+
+# Connection settings for calls to the ZAP API
+ZAP_CONNECT_TIMEOUT = float(os.getenv("ZAP_CONNECT_TIMEOUT", "5"))
+ZAP_READ_TIMEOUT = float(os.getenv("ZAP_READ_TIMEOUT", "60"))
+ZAP_RETRIES = int(os.getenv("ZAP_RETRIES", "3"))  # Attempts for idempotent view/other calls
+ZAP_RETRY_BACKOFF = float(os.getenv("ZAP_RETRY_BACKOFF", "0.5"))  # Seconds, doubled on each retry
+ZAP_POOL_SIZE = int(os.getenv("ZAP_POOL_SIZE", "20"))  # Keep-alive connections per ZAP instance
+
+# Logging of ZAP response bodies, which can be megabytes for URL lists and alerts
+ZAP_BODY_LOG_LEVEL = os.getenv("ZAP_BODY_LOG_LEVEL", "DEBUG").upper()  # Level bodies are logged at, or OFF
+ZAP_BODY_LOG_MAX = int(os.getenv("ZAP_BODY_LOG_MAX", "1000"))  # Characters of each body logged (0 for all)
+ZAP_BODY_LOG_SAMPLE = float(os.getenv("ZAP_BODY_LOG_SAMPLE", "1"))  # Fraction of successful responses logged
+
+ZAP_API_SECONDS = histogram('zap_api_request_seconds', 'Latency of ZAP API calls, per attempt', ('endpoint',))
+ZAP_API_ERRORS = counter('zap_api_errors_total', 'Failed ZAP API call attempts', ('endpoint', 'reason'))
+
+
+class ZapError(Exception):
+    """ZAP answered the API call with an error"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ZapConnectionError(ZapError):
+    """ZAP could not be reached or did not answer in time"""
+
+
+class ZapDeadlineExceeded(ZapError):
+    """The caller's deadline passed before the ZAP call could complete"""
+
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+_deadline = contextvars.ContextVar('zap_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """Bound every ZAP call and retry sleep made in this context to the next `seconds`
+
+    A nested deadline replaces the outer one, which lets cleanup run for a
+    short grace period after a scan has used up its budget.
+    """
+    token = _deadline.set(time.time() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining():
+    """Seconds left before the current deadline, or None if there is none"""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.time()
+
+
+def log_response(path, res):
+    """Log a JSON response body at ZAP_BODY_LOG_LEVEL, truncated and sampled; errors are never sampled out
+
+    Nothing is decoded unless the record will be emitted.
+    """
+    level = logging.getLevelName(ZAP_BODY_LOG_LEVEL)
+    if not isinstance(level, int) or not logger.isEnabledFor(level):
+        return
+    if res.status_code == 200 and ZAP_BODY_LOG_SAMPLE < 1 and random.random() >= ZAP_BODY_LOG_SAMPLE:
+        return
+    body = res.content
+    shown = body[:ZAP_BODY_LOG_MAX] if ZAP_BODY_LOG_MAX else body
+    more = f"... ({len(body) - len(shown)} more bytes)" if len(shown) < len(body) else ""
+    logger.log(level, f"ZAP {path} response: {shown.decode(errors='replace')}{more}, Status Code: {res.status_code}")
+
+
+def sleep(seconds):
+    """Sleep, but raise ZapDeadlineExceeded instead if the deadline would pass first"""
+    remaining = time_remaining()
+    if remaining is not None and remaining <= seconds:
+        raise ZapDeadlineExceeded(f"Deadline leaves {max(remaining, 0):.1f}s, not enough to wait {seconds}s")
+    time.sleep(seconds)
+
+
+class CircuitBreaker:
+    """Fail calls to an unreachable ZAP instance fast
+
+    After `threshold` consecutive failures the breaker opens and calls fail
+    immediately for `cooldown` seconds. It is then half-open: calls go
+    through again, and the first success closes it while another failure
+    opens it for a new cooldown.
+    """
+
+    def __init__(self, threshold=3, cooldown=30):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.threshold:
+            return BREAKER_CLOSED
+        return BREAKER_OPEN if time.time() < self.open_until else BREAKER_HALF_OPEN
+
+    def allow(self):
+        return self.state != BREAKER_OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.last_error = None
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.failures >= self.threshold:
+                self.open_until = time.time() + self.cooldown
+
+    def trip(self, error):
+        """Open the breaker now, e.g. after a scan lost its instance"""
+        with self._lock:
+            self.failures = max(self.failures + 1, self.threshold)
+            self.last_error = str(error)
+            self.open_until = time.time() + self.cooldown
+
+
+class ZapClient:
+    """Thin client for the ZAP JSON/OTHER API over a pooled keep-alive session"""
+
+    def __init__(self, base_url, api_key=None, connect_timeout=ZAP_CONNECT_TIMEOUT,
+                 read_timeout=ZAP_READ_TIMEOUT, retries=ZAP_RETRIES,
+                 backoff=ZAP_RETRY_BACKOFF, pool_size=ZAP_POOL_SIZE, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.breaker = breaker
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if api_key:
+            self.session.headers['X-ZAP-API-Key'] = api_key
+
+    def view(self, component, name, timeout=None, **params):
+        """Call a JSON view; views are idempotent and retried on transient failures"""
+        return self._request('JSON', component, 'view', name, params, timeout, retry=True).json()
+
+    def action(self, component, name, timeout=None, post=False, **params):
+        """Call a JSON action; actions change ZAP state and are never retried
+
+        `post` sends the parameters as a form body, for values too large
+        for a query string such as raw requests.
+        """
+        return self._request('JSON', component, 'action', name, params, timeout, retry=False, post=post).json()
+
+    def other(self, component, name, timeout=None, stream=False, **params):
+        """Call an OTHER endpoint and return the raw response"""
+        return self._request('OTHER', component, 'other', name, params, timeout, retry=True, stream=stream)
+
+    def probe(self, timeout):
+        """Fetch the ZAP version once, without retries; return (version, seconds taken)
+
+        Probes bypass the circuit breaker and report their outcome to it, so
+        a successful probe closes an open breaker.
+        """
+        start = time.monotonic()
+        try:
+            res = self.session.get(f"{self.base_url}/JSON/core/view/version/",
+                                   timeout=(min(self.connect_timeout, timeout), timeout))
+            res.raise_for_status()
+            version = res.json().get('version', 'unknown')
+        except (requests.RequestException, ValueError) as e:
+            if self.breaker:
+                self.breaker.record_failure(e)
+            raise ZapConnectionError(f"ZAP probe of {self.base_url} failed: {str(e)}")
+        if self.breaker:
+            self.breaker.record_success()
+        return version, time.monotonic() - start
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, fmt, component, kind, name, params, timeout, retry, stream=False, post=False):
+        endpoint = f"{component}/{kind}/{name}"
+        with span(f"zap {endpoint}", endpoint=endpoint, instance=self.base_url) as call:
+            res = self._send(fmt, component, kind, name, params, timeout, retry, stream, post, call)
+            call.set(http_status=res.status_code)
+            return res
+
+    def _send(self, fmt, component, kind, name, params, timeout, retry, stream, post, call):
+        path = f"{fmt}/{component}/{kind}/{name}"
+        url = f"{self.base_url}/{path}/"
+        attempts = self.retries if retry else 1
+        endpoint = f"{component}/{kind}/{name}"
+
+        for attempt in range(attempts):
+            call.set(attempts=attempt + 1)
+            if self.breaker and not self.breaker.allow():
+                ZAP_API_ERRORS.inc(endpoint=endpoint, reason='circuit_open')
+                raise ZapConnectionError(f"ZAP {path} not attempted: circuit open after "
+                                         f"{self.breaker.failures} failures ({self.breaker.last_error})")
+            read_timeout = timeout or self.read_timeout
+            connect_timeout = self.connect_timeout
+            remaining = time_remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise ZapDeadlineExceeded(f"ZAP {path} not attempted: deadline exceeded")
+                read_timeout = min(read_timeout, remaining)
+                connect_timeout = min(connect_timeout, remaining)
+
+            start = time.monotonic()
+            try:
+                if post:
+                    res = self.session.post(url, data=params, timeout=(connect_timeout, read_timeout))
+                else:
+                    res = self.session.get(url, params=params, timeout=(connect_timeout, read_timeout), stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                ZAP_API_SECONDS.observe(time.monotonic() - start, endpoint=endpoint)
+                remaining = time_remaining()
+                if remaining is not None and remaining <= 0:
+                    # Cut short by the deadline, not a sign that ZAP is down
+                    raise ZapDeadlineExceeded(f"ZAP {path} did not finish before the deadline")
+                ZAP_API_ERRORS.inc(endpoint=endpoint, reason='timeout' if isinstance(e, requests.Timeout) else 'connection')
+                if attempt < attempts - 1:
+                    delay = self.backoff * (2 ** attempt)
+                    logger.warning(f"ZAP {path} attempt {attempt + 1} failed: {str(e)}, retrying in {delay}s")
+                    sleep(delay)
+                    continue
+                if self.breaker:
+                    self.breaker.record_failure(e)
+                raise ZapConnectionError(f"ZAP {path} unreachable: {str(e)}")
+
+            # Streamed responses are timed to the headers; the body is read by the caller
+            ZAP_API_SECONDS.observe(time.monotonic() - start, endpoint=endpoint)
+            if res.status_code != 200:
+                ZAP_API_ERRORS.inc(endpoint=endpoint, reason=str(res.status_code))
+
+            if res.status_code >= 500 and attempt < attempts - 1:
+                delay = self.backoff * (2 ** attempt)
+                logger.warning(f"ZAP {path} returned {res.status_code}, retrying in {delay}s")
+                res.close()
+                sleep(delay)
+                continue
+
+            if self.breaker:
+                # ZAP answered, so it is reachable even if the call itself failed
+                self.breaker.record_success()
+
+            if fmt == 'JSON':
+                log_response(path, res)
+            if res.status_code != 200:
+                call.set(http_status=res.status_code)
+                text = res.text
+                res.close()
+                raise ZapError(f"ZAP {path} failed: {text}", status_code=res.status_code)
+            return res
@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from zap_client import ZapClient, CircuitBreaker, BREAKER_CLOSED
+
+logger = logging.getLogger(__name__)
+
+
+class NoZapInstanceAvailable(Exception):
+    """No healthy ZAP instance could take the scan"""
+
+
+class ZapInstance:
+    """One ZAP daemon, its circuit breaker and the scans currently running on it"""
+
+    def __init__(self, url, api_key, capacity, breaker_threshold=3, cooldown=30):
+        self.url = url
+        self.breaker = CircuitBreaker(breaker_threshold, cooldown)
+        self.client = ZapClient(url, api_key, breaker=self.breaker)
+        self.capacity = capacity
+        self.active = 0
+        # Targets of the scans running here; ZAP filters alerts by URL prefix, so these must not overlap
+        self.targets = []
+        # ZAP runs a single AJAX spider at a time
+        self.ajax_lock = threading.Lock()
+        # Filled in by health probes
+        self.version = None
+        self.latency = None
+        self.probed_at = None
+        self.probe_ok = True
+
+    def overlaps(self, target):
+        """Whether a scan of `target` here would see another running scan's alerts under its base URL"""
+        return any(t.startswith(target) or target.startswith(t) for t in self.targets)
+
+    @property
+    def healthy(self):
+        # The breaker tolerates a few failed calls; health reports the last probe straight away
+        return self.probe_ok and self.breaker.state == BREAKER_CLOSED
+
+    def status(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "active_scans": self.active,
+            "targets": list(self.targets),
+            "capacity": self.capacity,
+            "version": self.version,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "probed_at": self.probed_at,
+            "last_error": self.breaker.last_error
+        }
+
+
+class ZapFleet:
+    """Route scans to the least-loaded healthy ZAP instance
+
+    Instances whose circuit breaker is open are skipped, and when every
+    instance is open scans fail straight away instead of waiting.
+    """
+
+    def __init__(self, urls, api_key, capacity=2, cooldown=30, reset_when_idle=True, breaker_threshold=3):
+        self.instances = [ZapInstance(url, api_key, capacity, breaker_threshold, cooldown) for url in urls]
+        self.cooldown = cooldown
+        self.reset_when_idle = reset_when_idle
+        self._changed = threading.Condition()
+        self._probing = False
+        logger.debug(f"ZAP fleet: {', '.join(urls)} ({capacity} scans each)")
+
+    @contextmanager
+    def acquire(self, timeout=None, exclude=(), reset=True, target=None):
+        """Reserve a scan slot on the least-loaded healthy instance
+
+        Blocks while every eligible instance is full. Instances listed in
+        `exclude` (by URL) are skipped, which lets callers requeue a scan
+        elsewhere after its instance failed. `reset=False` keeps an idle
+        instance's session, for resuming a scan still running in it. An
+        instance already scanning a target that is a prefix of `target`,
+        or under it, counts as full for it, so concurrent scans never
+        read each other's alerts.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._changed:
+            while True:
+                candidates = [i for i in self.instances if i.url not in exclude and i.breaker.allow()]
+                if not candidates:
+                    raise NoZapInstanceAvailable("No healthy ZAP instance available")
+                free = [i for i in candidates if i.active < i.capacity and not (target and i.overlaps(target))]
+                if free:
+                    instance = min(free, key=lambda i: i.active / i.capacity)
+                    instance.active += 1
+                    if target:
+                        instance.targets.append(target)
+                    idle = instance.active == 1
+                    break
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise NoZapInstanceAvailable(f"Timed out after {timeout}s waiting for a ZAP instance")
+                # Wake up periodically so breakers opening or closing are noticed
+                self._changed.wait(min(remaining, 1) if remaining is not None else 1)
+
+        logger.debug(f"Scan assigned to ZAP instance {instance.url} ({instance.active}/{instance.capacity})")
+        try:
+            if idle and reset and self.reset_when_idle:
+                # Nothing else is using the daemon, so drop the old session to bound ZAP memory
+                try:
+                    instance.client.action('core', 'newSession')
+                except Exception as e:
+                    logger.warning(f"Failed to reset idle ZAP session on {instance.url}: {str(e)}")
+            yield instance
+        finally:
+            with self._changed:
+                instance.active -= 1
+                if target:
+                    instance.targets.remove(target)
+                self._changed.notify_all()
+
+    def mark_unhealthy(self, instance, error):
+        """Open an instance's circuit breaker so it is skipped until its cooldown expires"""
+        instance.breaker.trip(error)
+        logger.warning(f"ZAP instance {instance.url} marked unhealthy: {str(error)}")
+
+    def mark_healthy(self, instance):
+        was_healthy = instance.healthy
+        instance.probe_ok = True
+        instance.breaker.record_success()
+        with self._changed:
+            self._changed.notify_all()
+        if not was_healthy:
+            logger.info(f"ZAP instance {instance.url} is healthy again")
+
+    def probe(self, instance, timeout):
+        """Check one instance's liveness and latency and update its breaker"""
+        try:
+            instance.version, instance.latency = instance.client.probe(timeout)
+            instance.probe_ok = True
+        except Exception as e:
+            if instance.probe_ok:
+                logger.warning(f"Health probe of {instance.url} failed: {str(e)}")
+            instance.probe_ok = False
+            instance.latency = None
+        instance.probed_at = datetime.now().isoformat()
+        with self._changed:
+            self._changed.notify_all()
+
+    def start_probing(self, interval, timeout):
+        """Probe every instance in the background, each on its own thread"""
+        if self._probing:
+            return
+        self._probing = True
+        for instance in self.instances:
+            threading.Thread(target=self._probe_loop, args=(instance, interval, timeout),
+                             name=f"zap-prober-{instance.url}", daemon=True).start()
+        logger.debug(f"Probing ZAP instances every {interval}s")
+
+    @property
+    def probing(self):
+        return self._probing
+
+    def status(self):
+        with self._changed:
+            return [i.status() for i in self.instances]
+
+    def _probe_loop(self, instance, interval, timeout):
+        while True:
+            started = time.monotonic()
+            self.probe(instance, timeout)
+            time.sleep(max(0, interval - (time.monotonic() - started)))
@@ -1,129 +1,178 @@
-import requests
-import time
-import urllib.parse
+import argparse
+import hashlib
+import json
 import sys
 import os
 import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from zap_client import ZapClient
+from scan_poller import poller
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'DEBUG').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-ZAP_URL = os.getenv('ZAP_URL')
+ZAP_URL = os.getenv('ZAP_URL', 'http://localhost:8088')
 API_KEY = os.getenv('ZAP_API_KEY')
 REPORT_DIR = os.getenv('REPORT_DIR', "/zap/reports")
+ZAP_REPORT_DIR = os.getenv('ZAP_REPORT_DIR', REPORT_DIR)  # REPORT_DIR as ZAP sees it, where ZAP writes the reports
 SPIDER_TIMEOUT = 300  # 5 minutes
 SCAN_TIMEOUT = 1200  # 20 minutes
+PASSIVE_SCAN_TIMEOUT = 60  # 1 minute for the passive scan queue to drain
+REPORT_TIMEOUT = 300  # 5 minutes to render large HTML reports
+SCAN_CONCURRENCY = int(os.getenv('SCAN_CONCURRENCY', '4'))  # Targets scanned at once with --targets
+ALERT_PAGE_SIZE = 500  # Alerts read per call when counting a scan's alerts by risk
+REPORT_TEMPLATE = 'traditional-html'
+MODES = ['baseline', 'full']
+
+zap = ZapClient(ZAP_URL, API_KEY)
+
+def create_context(context_name, target_url):
+    """Create a ZAP context holding the target; return its ID"""
+    logger.debug(f"Creating new ZAP context {context_name}")
+    context_id = zap.action('context', 'newContext', contextName=context_name).get('contextId')
+    zap.action('context', 'includeInContext', contextName=context_name, regex=target_url + '.*')
+    return context_id
 
-def clear_zap_state():
-    """Clear previous ZAP state"""
+def clear_zap_state(context_name, spider_id=None, scan_id=None):
+    """Remove the spider, active scan and context created by this run"""
     try:
-        logger.debug("Clearing ZAP sessions and contexts")
-        requests.get(f"{ZAP_URL}/JSON/core/action/newSession/?apikey={API_KEY}")
-        requests.get(f"{ZAP_URL}/JSON/context/action/removeContext/?contextName=scan_context&apikey={API_KEY}")
+        logger.debug(f"Cleaning up ZAP state for context {context_name}")
+        if scan_id:
+            zap.action('ascan', 'stop', scanId=scan_id)
+            zap.action('ascan', 'removeScan', scanId=scan_id)
+        if spider_id:
+            zap.action('spider', 'stop', scanId=spider_id)
+            zap.action('spider', 'removeScan', scanId=spider_id)
+        zap.action('context', 'removeContext', contextName=context_name)
     except Exception as e:
         logger.warning(f"Failed to clear ZAP state: {str(e)}")
 
-def run_baseline_scan(target_url):
-    """Baseline scan - passive only, no spider (FAST)"""
+def number_of_alerts(target_url):
+    """How many alerts ZAP holds under target_url, including earlier scans' in the session"""
+    return int(zap.view('core', 'numberOfAlerts', baseurl=target_url).get('numberOfAlerts', 0))
+
+def alert_counts(target_url, start):
+    """Return {risk: count} of ZAP's alerts under target_url from offset `start`, i.e. this scan's"""
+    counts = {}
+    try:
+        while True:
+            page = zap.view('core', 'alerts', baseurl=target_url, start=start, count=ALERT_PAGE_SIZE).get('alerts', [])
+            for alert in page:
+                counts[alert.get('risk')] = counts.get(alert.get('risk'), 0) + 1
+            if len(page) < ALERT_PAGE_SIZE:
+                return counts
+            start += len(page)
+    except Exception as e:
+        logger.warning(f"Failed to read alert counts for {target_url}: {str(e)}")
+        return {}
+
+def finish_scan(target_url, context_name, alerts_before, report_path):
+    """Count the alerts the scan raised and have ZAP write the report of its context
+
+    ZAP's session holds every target scanned so far, including those of
+    concurrent scans, so neither comes from session-wide views.
+    """
+    alerts_count = number_of_alerts(target_url) - alerts_before
+    logger.info(f"Found {alerts_count} alerts")
+
+    logger.debug("Generating HTML report")
+    zap.action('reports', 'generate', timeout=REPORT_TIMEOUT, title='ZAP Scanning Report', template=REPORT_TEMPLATE,
+               contexts=context_name, reportDir=ZAP_REPORT_DIR, reportFileName=os.path.basename(report_path))
+    return {"alerts_count": alerts_count, "alerts_by_risk": alert_counts(target_url, alerts_before)}
+
+def run_baseline_scan(target_url, report_path):
+    """Baseline scan - passive only, no spider (FAST)
+
+    Returns {"alerts_count": n, "alerts_by_risk": {...}}, with "error" set
+    and an error report written instead when the scan failed.
+    """
+    # The context only scopes the report to this target
+    context_name = f"scan_baseline_{uuid.uuid4().hex[:12]}"
     try:
         logger.info(f"Running baseline scan on {target_url}")
-        
+        alerts_before = number_of_alerts(target_url)
+        create_context(context_name, target_url)
+
         # Access URL through ZAP proxy (triggers passive scanning)
         logger.debug("Accessing target URL through ZAP...")
-        access_url = f"{ZAP_URL}/JSON/core/action/accessUrl/?url={urllib.parse.quote(target_url)}&apikey={API_KEY}"
-        access_res = requests.get(access_url, timeout=30)
-        logger.debug(f"Access URL response: {access_res.text}, Status: {access_res.status_code}")
+        zap.action('core', 'accessUrl', url=target_url, timeout=30)
         
-        # Give passive scanners time to finish
+        # Wait for the passive scan queue to drain
         logger.debug("Waiting for passive scanners...")
-        time.sleep(5)
-        
-        # Get alerts
-        alerts_res = requests.get(f"{ZAP_URL}/JSON/core/view/numberOfAlerts/?baseurl={urllib.parse.quote(target_url)}&apikey={API_KEY}")
-        alerts_count = alerts_res.json().get('numberOfAlerts', 0)
-        logger.info(f"Found {alerts_count} alerts")
-        
-        # Generate report
-        logger.debug("Generating HTML report")
-        report = requests.get(f"{ZAP_URL}/OTHER/core/other/htmlreport/?apikey={API_KEY}")
-        return report.text
-        
+        if not poller.wait(zap, 'pscan', timeout=PASSIVE_SCAN_TIMEOUT):
+            logger.warning("Passive scanners still busy, reporting alerts found so far")
+
+        return finish_scan(target_url, context_name, alerts_before, report_path)
+
     except Exception as e:
         logger.error(f"Baseline scan failed: {str(e)}")
-        return create_error_report(target_url, str(e), 'baseline')
+        write_error_report(report_path, target_url, str(e), 'baseline')
+        return {"error": str(e)}
+    finally:
+        clear_zap_state(context_name)
 
-def run_full_scan(target_url):
-    """Complete scanning workflow with spider"""
-    try:
-        # Clear previous state
-        clear_zap_state()
+def fall_back_to_baseline(target_url, report_path, reason):
+    """Run a baseline scan in place of a full one, recording why"""
+    logger.warning(f"{reason}, falling back to baseline scan")
+    result = run_baseline_scan(target_url, report_path)
+    result["fallback"] = reason
+    return result
+
+def run_full_scan(target_url, report_path):
+    """Complete scanning workflow with spider
 
-        # Context setup
-        logger.debug("Creating new ZAP context")
-        requests.get(f"{ZAP_URL}/JSON/context/action/newContext/?contextName=scan_context&apikey={API_KEY}")
-        encoded_url = urllib.parse.quote(target_url + '.*')
-        requests.get(f"{ZAP_URL}/JSON/context/action/includeInContext/?contextName=scan_context&regex={encoded_url}&apikey={API_KEY}")
+    Falls back to a baseline scan when spidering or the active scan cannot
+    run; the result's "fallback" says why.
+    """
+    # Unique context so runs never clobber scans sharing the same ZAP daemon
+    context_name = f"scan_full_{uuid.uuid4().hex[:12]}"
+    spider_id = scan_id = None
+    try:
+        alerts_before = number_of_alerts(target_url)
+        context_id = create_context(context_name, target_url)
 
         # Spider
         logger.debug(f"Running spider: {target_url}")
-        spider = requests.get(f"{ZAP_URL}/JSON/spider/action/scan/?url={urllib.parse.quote(target_url)}&contextName=scan_context&recurse=true&subtreeOnly=false&apikey={API_KEY}")
-        spider_id = spider.json().get("scan")
+        spider_id = zap.action('spider', 'scan', url=target_url, contextName=context_name,
+                               recurse='true', subtreeOnly='false').get("scan")
         
         if not spider_id:
-            logger.warning("Spider failed to start, falling back to baseline scan")
-            return run_baseline_scan(target_url)
+            return fall_back_to_baseline(target_url, report_path, "Spider failed to start")
         
-        start_time = time.time()
-        while time.time() - start_time < SPIDER_TIMEOUT:
-            status = requests.get(f"{ZAP_URL}/JSON/spider/view/status/?scanId={spider_id}&apikey={API_KEY}").json().get('status', 0)
-            logger.debug(f"Spider status: {status}%")
-            if int(status) >= 100:
-                break
-            time.sleep(10)
-        else:
-            logger.warning("Spider timed out, proceeding with baseline scan")
-            return run_baseline_scan(target_url)
+        if not poller.wait(zap, 'spider', spider_id, timeout=SPIDER_TIMEOUT):
+            return fall_back_to_baseline(target_url, report_path, "Spider timed out")
 
         # Verify URLs in context
-        urls_res = requests.get(f"{ZAP_URL}/JSON/context/view/urls/?contextName=scan_context&apikey={API_KEY}")
-        logger.debug(f"URLs in context after spidering: {urls_res.text}")
-        if not urls_res.json().get('urls'):
-            logger.warning("No URLs found in context after spidering, using baseline scan")
-            return run_baseline_scan(target_url)
+        urls = zap.view('context', 'urls', contextName=context_name).get('urls')
+        if not urls:
+            return fall_back_to_baseline(target_url, report_path, "No URLs found in context after spidering")
 
         # Active Scan
         logger.debug("Starting active scan")
-        scan = requests.get(f"{ZAP_URL}/JSON/ascan/action/scan/?url={urllib.parse.quote(target_url)}&contextName=scan_context&recurse=true&inScopeOnly=true&apikey={API_KEY}")
-        scan_id = scan.json().get("scan")
+        scan_id = zap.action('ascan', 'scan', url=target_url, contextId=context_id,
+                             recurse='true', inScopeOnly='true').get("scan")
         
         if not scan_id:
-            logger.warning("Active scan failed to start")
-            return run_baseline_scan(target_url)
+            return fall_back_to_baseline(target_url, report_path, "Active scan failed to start")
 
         # Wait for completion
-        start_time = time.time()
-        while time.time() - start_time < SCAN_TIMEOUT:
-            status = requests.get(f"{ZAP_URL}/JSON/ascan/view/status/?scanId={scan_id}&apikey={API_KEY}").json().get('status', 0)
-            logger.debug(f"Scan status: {status}%")
-            if int(status) >= 100:
-                break
-            time.sleep(10)
-        else:
+        if not poller.wait(zap, 'ascan', scan_id, timeout=SCAN_TIMEOUT):
             logger.warning("Active scan timed out, generating partial report")
 
-        # Generate report
-        logger.debug("Generating HTML report")
-        report = requests.get(f"{ZAP_URL}/OTHER/core/other/htmlreport/?apikey={API_KEY}")
-        return report.text
+        return finish_scan(target_url, context_name, alerts_before, report_path)
 
     except Exception as e:
-        logger.error(f"Full scan failed: {str(e)}, falling back to baseline")
-        return run_baseline_scan(target_url)
+        return fall_back_to_baseline(target_url, report_path, f"Full scan failed: {str(e)}")
+    finally:
+        clear_zap_state(context_name, spider_id, scan_id)
 
-def create_error_report(target_url, error_msg, mode='full'):
-    """Create a minimal error report"""
+def write_error_report(report_path, target_url, error_msg, mode='full'):
+    """Write a minimal error report"""
     html = f"""<!DOCTYPE html>
 <html>
 <head>
@@ -144,33 +193,180 @@ def create_error_report(target_url, error_msg, mode='full'):
 </body>
 </html>
     """
-    return html
+    with open(report_path, "w") as f:
+        f.write(html)
+
+def report_path_for(target_url, mode):
+    """Report path unique per target, so concurrent scans finishing in the same second do not collide"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    digest = hashlib.sha1(target_url.encode()).hexdigest()[:8]
+    return os.path.join(REPORT_DIR, f"zap_report_{mode}_{timestamp}_{digest}.html")
+
+def scan_target(target_url, mode):
+    """Scan one target, save its report and return its summary"""
+    started_at = datetime.now().isoformat()
+    started = time.monotonic()
+    report_path = report_path_for(target_url, mode)
+    if mode == 'baseline':
+        result = run_baseline_scan(target_url, report_path)
+    else:
+        result = run_full_scan(target_url, report_path)
+
+    return {
+        "target": target_url,
+        "mode": mode,
+        "status": "failed" if result.get("error") else "completed",
+        "started_at": started_at,
+        "seconds": round(time.monotonic() - started, 1),
+        "alerts_count": result.get("alerts_count"),
+        "alerts_by_risk": result.get("alerts_by_risk", {}),
+        "report_path": report_path,
+        "fallback": result.get("fallback"),
+        "error": result.get("error")
+    }
+
+def read_targets(source):
+    """Yield target URLs from a file, or stdin for '-', skipping blank lines and # comments"""
+    f = sys.stdin if source == '-' else open(source)
+    try:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def load_checkpoint(path):
+    """Return the (target, mode) pairs a previous run already completed"""
+    done = set()
+    if not path or not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A run killed mid-write leaves a partial last line
+                continue
+            done.add((entry["target"], entry["mode"]))
+    return done
+
+class SummaryWriter:
+    """Append JSONL summaries, and completed targets to the checkpoint, one line per target"""
+
+    def __init__(self, summary, checkpoint):
+        self._summary = sys.stdout if summary == '-' else open(summary, 'a') if summary else None
+        self._checkpoint = open(checkpoint, 'a') if checkpoint else None
+        self._lock = threading.Lock()
+
+    def write(self, entry):
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if self._summary:
+                self._summary.write(line)
+                self._summary.flush()
+            if self._checkpoint and entry["status"] == "completed":
+                self._checkpoint.write(line)
+                self._checkpoint.flush()
+                os.fsync(self._checkpoint.fileno())
+
+    def close(self):
+        for f in (self._summary, self._checkpoint):
+            if f and f is not sys.stdout:
+                f.close()
+
+def run_batch(targets, mode, concurrency, writer, done=frozenset()):
+    """Scan targets `concurrency` at a time, skipping those in `done`; return (completed, failed, skipped)"""
+    counts = {"completed": 0, "failed": 0, "skipped": 0}
+    counts_lock = threading.Lock()
+    # Bounds targets read ahead of the workers, so huge inventories stream from disk or stdin
+    slots = threading.BoundedSemaphore(concurrency * 2)
+
+    def scan(target_url):
+        try:
+            try:
+                entry = scan_target(target_url, mode)
+            except Exception as e:
+                logger.error(f"Scan of {target_url} failed: {str(e)}")
+                entry = {"target": target_url, "mode": mode, "status": "failed", "error": str(e)}
+            writer.write(entry)
+            with counts_lock:
+                counts[entry["status"]] += 1
+        finally:
+            slots.release()
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="zap-scan")
+    try:
+        for target_url in targets:
+            if (target_url, mode) in done:
+                counts["skipped"] += 1
+                continue
+            slots.acquire()
+            executor.submit(scan, target_url)
+        executor.shutdown(wait=True)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; waiting for running scans to finish and clean up. Resume with the same checkpoint")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    return counts["completed"], counts["failed"], counts["skipped"]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scan one target, or many from a file or stdin, with ZAP")
+    parser.add_argument('target', nargs='?', help="Target URL (omit with --targets)")
+    parser.add_argument('mode', nargs='?', choices=MODES, help="Scan mode (default baseline)")
+    parser.add_argument('--targets', metavar='FILE', help="File of target URLs, one per line; '-' reads stdin")
+    parser.add_argument('--mode', dest='mode_option', choices=MODES, help="Scan mode for --targets runs")
+    parser.add_argument('--concurrency', type=int, default=SCAN_CONCURRENCY, help="Targets scanned at once")
+    parser.add_argument('--summary', metavar='FILE',
+                        help="Append one JSON summary line per target here ('-' for stdout, the default with --targets)")
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help="Record completed targets here and skip those already recorded, to resume a run")
+    parser.add_argument('--new-session', action='store_true',
+                        help="Start a new ZAP session first, dropping what earlier runs left in ZAP's memory; "
+                             "only when no other scans use the daemon")
+    args = parser.parse_args(argv)
+    if bool(args.target) == bool(args.targets):
+        parser.error("give either a target URL or --targets")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    args.mode = args.mode_option or args.mode or 'baseline'
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python zap_scan.py <target_url> [mode]")
-        print("Modes: baseline (default), full")
-        sys.exit(1)
-
-    target_url = sys.argv[1]
-    scan_mode = sys.argv[2] if len(sys.argv) > 2 else 'baseline'
-    
     # Ensure reports directory exists
     os.makedirs(REPORT_DIR, exist_ok=True)
-    
-    # Run scan based on mode
-    if scan_mode == 'baseline':
-        logger.info(f"Running baseline scan on {target_url}")
-        result = run_baseline_scan(target_url)
-    else:
-        logger.info(f"Running full scan on {target_url}")
-        result = run_full_scan(target_url)
-    
-    # Save report
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    report_path = f"{REPORT_DIR}/zap_report_{scan_mode}_{timestamp}.html"
-    
-    with open(report_path, "w") as f:
-        f.write(result if isinstance(result, str) else "Scan completed but no report generated")
-    
-    print(f"Scan completed. Report saved to {report_path}")
\ No newline at end of file
+
+    if args.new_session:
+        # Scheduled runs against a dedicated daemon would otherwise grow ZAP's session without limit
+        logger.info("Starting a new ZAP session")
+        zap.action('core', 'newSession')
+
+    if args.target:
+        summary = scan_target(args.target, args.mode)
+        if args.summary:
+            writer = SummaryWriter(args.summary, None)
+            writer.write(summary)
+            writer.close()
+        if summary["fallback"]:
+            print(f"Full scan fell back to baseline: {summary['fallback']}")
+        print(f"Scan completed. Report saved to {summary['report_path']}")
+        return 0 if summary["status"] == "completed" else 1
+
+    done = load_checkpoint(args.checkpoint)
+    if done:
+        logger.info(f"Resuming: {len(done)} targets already completed according to {args.checkpoint}")
+    writer = SummaryWriter(args.summary or '-', args.checkpoint)
+    try:
+        completed, failed, skipped = run_batch(read_targets(args.targets), args.mode, args.concurrency, writer, done)
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        writer.close()
+    logger.info(f"Batch finished: {completed} completed, {failed} failed, {skipped} skipped from checkpoint")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
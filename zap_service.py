@@ -1,28 +1,152 @@
-from flask import Flask, request, jsonify, send_file, abort
-import requests
+from flask import Flask, Response, request, jsonify, abort
 import time
-import urllib.parse
 import os
+import re
+import urllib.parse
+import uuid
 from datetime import datetime
 import logging
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+import contextvars
 from dotenv import load_dotenv
+from scan_jobs import JobManager, RemoteJobManager, JobQueueFullError, JOB_QUEUED, FINISHED_STATES
+from job_store import claim_runner, save_checkpoint, load_checkpoint
+from scan_batches import BatchManager
+from scan_scheduler import FairScheduler, parse_weights
+from zap_client import ZapError, ZapConnectionError, deadline, sleep
+from zap_fleet import ZapFleet, NoZapInstanceAvailable
+from scan_poller import poller
+from scan_budget import ScanPlan
+from scan_policies import PolicyManager, load_policies
+from scan_events import EventHub, format_event
+from scan_seeds import SEED_MAX_BYTES, SEED_CONCURRENCY, save_seed, apply_seed, fan_out
+from scan_shards import (FULL_SCAN_SHARDS, SHARD_MIN_URLS, SHARD_ACQUIRE_TIMEOUT, split_urls, recorded_requests,
+                         alert_key, merge_alerts, render_report)
+from report_store import REPORT_CHUNK_SIZE, write_report, find_report, serve_report
+from report_catalog import (new_report_name, report_id_for, catalog_report, query_reports, get_report, catalog_totals,
+                            start_retention)
+from findings import (fetch_alerts, number_of_alerts, ingest_alerts, save_alerts, carry_over_alerts, query_alerts,
+                      get_alert, count_by_risk, record_scan, diff_findings)
+from url_inventory import fingerprint_urls, diff_inventory, save_inventory
+from metrics import CONTENT_TYPE, REGISTRY, gauge, histogram
+from scan_trace import trace, span, traced
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging; ZAP response bodies are bounded separately (ZAP_BODY_LOG_*)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Configuration from environment variables with defaults
 ZAP_URL = os.getenv("ZAP_URL", "http://zap:8088")
+ZAP_URLS = [u.strip() for u in (os.getenv("ZAP_URLS") or ZAP_URL).split(",") if u.strip()]  # ZAP fleet
 API_KEY = os.getenv("API_KEY")
 REPORT_DIR = os.getenv("REPORT_DIR", "/zap/reports")
+ZAP_REPORT_DIR = os.getenv("ZAP_REPORT_DIR", REPORT_DIR)  # REPORT_DIR as mounted in the ZAP containers
 SCAN_TIMEOUT = int(os.getenv("SCAN_TIMEOUT", "1200"))  # 20 minutes
 SPIDER_TIMEOUT = int(os.getenv("SPIDER_TIMEOUT", "300"))  # 5 minutes
 SPIDER_RETRIES = int(os.getenv("SPIDER_RETRIES", "3"))  # Retry spider initiation up to 3 times
+PASSIVE_SCAN_TIMEOUT = int(os.getenv("PASSIVE_SCAN_TIMEOUT", "60"))  # Max wait for the passive scan queue to drain
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "4"))  # Scans running in parallel
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "500"))  # Jobs waiting for a worker before /scan returns 503
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "1000"))  # Finished jobs kept for /jobs lookups
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "900"))  # Seconds a completed scan is reused for the same target and mode
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))  # Cached results kept before LRU eviction
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(SCAN_WORKERS)))  # Default scans one batch runs at once
+BATCH_MAX_TARGETS = int(os.getenv("BATCH_MAX_TARGETS", "500"))  # Targets accepted by one /scan/batch request
+BATCH_RETENTION = int(os.getenv("BATCH_RETENTION", "100"))  # Finished batches kept for lookups
+# Priority classes from highest down, with their share of scan starts while all are queued
+PRIORITY_CLASSES = parse_weights(os.getenv("PRIORITY_CLASSES", "interactive:8,ci:4,bulk:1"))
+DEFAULT_PRIORITY = os.getenv("DEFAULT_PRIORITY", "ci")  # Priority of /scan requests that do not set one
+BATCH_PRIORITY = os.getenv("BATCH_PRIORITY", "bulk")  # Priority of /scan/batch entries that do not set one
+PRIORITY_AGING = int(os.getenv("PRIORITY_AGING", "600"))  # Seconds queued before a job moves up one class (0 disables)
+TENANT_MAX_RUNNING = int(os.getenv("TENANT_MAX_RUNNING", "0"))  # Scans one tenant may run at once (0 = no cap)
+# Per-tenant overrides of TENANT_MAX_RUNNING, e.g. "nightly:1,appsec:4"
+TENANT_LIMITS = {tenant: int(limit) for tenant, limit in parse_weights(os.getenv("TENANT_LIMITS", ""))}
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))  # Events kept per job for /scan/<id>/events replay
+EVENT_RETENTION = int(os.getenv("EVENT_RETENTION", "100"))  # Finished jobs whose event streams are kept
+EVENT_HEARTBEAT = int(os.getenv("EVENT_HEARTBEAT", "15"))  # Seconds between keep-alive comments on idle streams
+JOB_SYNC_INTERVAL = float(os.getenv("JOB_SYNC_INTERVAL", "1"))  # Seconds between syncs of jobs and batches with the job store
+DRAIN_TIMEOUT = int(os.getenv("DRAIN_TIMEOUT", "60"))  # Seconds shutdown waits for running scans before leaving them to resume
+INCREMENTAL_REGEX_BATCH = int(os.getenv("INCREMENTAL_REGEX_BATCH", "100"))  # Changed URLs per includeInContext regex
+REPORT_TIMEOUT = int(os.getenv("REPORT_TIMEOUT", "300"))  # Read timeout for htmlreport on large sites
+REPORT_MAX_AGE_DAYS = int(os.getenv("REPORT_MAX_AGE_DAYS", "30"))  # Reports older than this are deleted (0 keeps them)
+REPORT_MAX_PER_TARGET = int(os.getenv("REPORT_MAX_PER_TARGET", "20"))  # Newest reports kept per target (0 keeps all)
+REPORT_QUOTA_MB = int(os.getenv("REPORT_QUOTA_MB", "5120"))  # Disk space for reports; oldest are deleted beyond it (0 disables)
+REPORT_RETENTION_INTERVAL = int(os.getenv("REPORT_RETENTION_INTERVAL", "3600"))  # Seconds between retention sweeps (0 disables)
+ZAP_MAX_CONCURRENT_SCANS = int(os.getenv("ZAP_MAX_CONCURRENT_SCANS", "2"))  # Scans sharing one ZAP daemon
+ZAP_RESET_SESSION_WHEN_IDLE = os.getenv("ZAP_RESET_SESSION_WHEN_IDLE", "true").lower() == "true"
+ZAP_UNHEALTHY_COOLDOWN = int(os.getenv("ZAP_UNHEALTHY_COOLDOWN", "30"))  # Seconds before a failed instance is retried
+ZAP_ACQUIRE_TIMEOUT = int(os.getenv("ZAP_ACQUIRE_TIMEOUT", "3600"))  # Seconds a job waits for a free instance
+ZAP_REQUEUE_ATTEMPTS = int(os.getenv("ZAP_REQUEUE_ATTEMPTS", "3"))  # Instances tried before a scan fails
+ZAP_BREAKER_THRESHOLD = int(os.getenv("ZAP_BREAKER_THRESHOLD", "3"))  # Consecutive failed ZAP calls before failing fast
+ZAP_PROBE_INTERVAL = float(os.getenv("ZAP_PROBE_INTERVAL", "5"))  # Seconds between background health probes (0 disables)
+ZAP_PROBE_TIMEOUT = float(os.getenv("ZAP_PROBE_TIMEOUT", "2"))  # Seconds a health probe may take
+ZAP_CLEANUP_TIMEOUT = int(os.getenv("ZAP_CLEANUP_TIMEOUT", "15"))  # Grace period for cleanup after a scan's deadline
+SCAN_REPORT_RESERVE = int(os.getenv("SCAN_REPORT_RESERVE", "60"))  # Seconds of a scan budget kept for alerts and report
+# Overall time allowed for one scan, across requeues, by mode
+SCAN_BUDGETS = {
+    'baseline': int(os.getenv("BASELINE_SCAN_BUDGET", "300")),
+    'quick': int(os.getenv("QUICK_SCAN_BUDGET", "1200")),
+    'full': int(os.getenv("FULL_SCAN_BUDGET", str(SPIDER_TIMEOUT + SCAN_TIMEOUT + REPORT_TIMEOUT)))
+}
+# Spider limits by mode; 0 means no limit. Depth counts path segments below the target
+SPIDER_LIMITS = {
+    'quick': {
+        'max_depth': int(os.getenv("QUICK_SPIDER_MAX_DEPTH", "3")),
+        'max_children': int(os.getenv("QUICK_SPIDER_MAX_CHILDREN", "10")),  # Child nodes crawled per node
+        'max_duration': int(os.getenv("QUICK_SPIDER_MAX_DURATION", "120")),
+        'max_urls': int(os.getenv("QUICK_SPIDER_MAX_URLS", "200")),
+        'ajax': os.getenv("QUICK_AJAX_SPIDER", "false").lower() == "true"
+    },
+    'full': {
+        'max_depth': int(os.getenv("FULL_SPIDER_MAX_DEPTH", "0")),
+        'max_children': int(os.getenv("FULL_SPIDER_MAX_CHILDREN", "0")),
+        'max_duration': int(os.getenv("FULL_SPIDER_MAX_DURATION", str(SPIDER_TIMEOUT))),
+        'max_urls': int(os.getenv("FULL_SPIDER_MAX_URLS", "0")),
+        'ajax': os.getenv("FULL_AJAX_SPIDER", "false").lower() == "true"
+    }
+}
+AJAX_SPIDER_MAX_DURATION = int(os.getenv("AJAX_SPIDER_MAX_DURATION", "300"))  # Upper bound on the AJAX spider phase
+SEEDED_SPIDER_MAX_DURATION = int(os.getenv("SEEDED_SPIDER_MAX_DURATION", "30"))  # Spider seconds for seeded scans (0 skips it)
+# ZAP report template, and the prefix of reports ZAP is still writing, which the catalog ignores
+REPORT_TEMPLATE = 'traditional-html'
+PARTIAL_REPORT_PREFIX = 'partial_'
+# ZAP alert risks from least to most severe, for fail_on thresholds
+RISK_LEVELS = ['informational', 'low', 'medium', 'high']
+# ZAP alert fields sent in 'alert' events
+EVENT_ALERT_FIELDS = ('id', 'pluginId', 'alert', 'risk', 'confidence', 'url', 'method', 'param')
+# Relative share of a scan's budget (after SCAN_REPORT_RESERVE) given to each phase
+PHASE_WEIGHTS = {
+    'baseline': {'passive_scan': 1},
+    'quick': {'spider': 1, 'ajax_spider': 1, 'active_scan': 3},
+    'full': {'spider': 1, 'ajax_spider': 1, 'active_scan': 4}
+}
+
+# With several WSGI workers, one process runs scans and the others serve the API from the job store
+is_runner = claim_runner()
+draining = threading.Event()
+drain_started = None
+
+fleet = ZapFleet(ZAP_URLS, API_KEY, capacity=ZAP_MAX_CONCURRENT_SCANS, cooldown=ZAP_UNHEALTHY_COOLDOWN,
+                 reset_when_idle=ZAP_RESET_SESSION_WHEN_IDLE, breaker_threshold=ZAP_BREAKER_THRESHOLD)
+if ZAP_PROBE_INTERVAL > 0:
+    fleet.start_probing(ZAP_PROBE_INTERVAL, ZAP_PROBE_TIMEOUT)
+if REPORT_RETENTION_INTERVAL > 0 and is_runner:
+    start_retention(REPORT_DIR, REPORT_RETENTION_INTERVAL, max_age_days=REPORT_MAX_AGE_DAYS,
+                    max_per_target=REPORT_MAX_PER_TARGET, quota_bytes=REPORT_QUOTA_MB * 1024 * 1024)
+policies = PolicyManager(load_policies())
+events = EventHub(buffer_size=EVENT_BUFFER_SIZE, retention=EVENT_RETENTION)
+
+SCAN_PHASE_SECONDS = histogram('zap_scan_phase_seconds', 'Time spent in each scan phase', ('phase', 'mode'))
+SCAN_SECONDS = histogram('zap_scan_seconds', 'Time to run a scan on a ZAP instance', ('mode', 'outcome'))
 
 # Scan modes
 SCAN_MODE_BASELINE = 'baseline'  # Fast passive scan, no spider
@@ -35,140 +159,674 @@ def setup_environment():
     os.makedirs(REPORT_DIR, exist_ok=True)
     os.chmod(REPORT_DIR, 0o777)
 
+def parse_fail_on(value):
+    """Parse a fail_on threshold such as 'high' or 'medium:5' into (risk, count) or raise ValueError"""
+    risk, _, count = str(value).strip().lower().partition(':')
+    if risk not in RISK_LEVELS:
+        raise ValueError(f"fail_on risk must be one of: {', '.join(RISK_LEVELS)}")
+    try:
+        count = int(count) if count else 1
+    except ValueError:
+        raise ValueError("fail_on count must be an integer, e.g. medium:5")
+    if count < 1:
+        raise ValueError("fail_on count must be at least 1")
+    return risk, count
+
+def normalize_target(target_url):
+    """Prepend https:// when no scheme is given and canonicalise the URL
+
+    The normalized URL keys scan coalescing and the result cache, so
+    equivalent spellings of a target share one scan.
+    """
+    if not target_url.lower().startswith(('http://', 'https://')):
+        target_url = f"https://{target_url}"
+    parts = urllib.parse.urlsplit(target_url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, parts.port) in (('http', 80), ('https', 443)):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = '' if parts.path == '/' else parts.path
+    return urllib.parse.urlunsplit((scheme, netloc, path, parts.query, ''))
+
 def generate_report_filename(target_url, mode='baseline'):
-    """Generate timestamped report filename"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    report_filename = f"zap_report_{mode}_{timestamp}.html"
+    """Generate a unique, timestamped report filename"""
+    _, report_filename = new_report_name(mode)
     report_path = os.path.join(REPORT_DIR, report_filename)
     logger.debug(f"Generated report filename: {report_path}")
     return report_path, report_filename
 
-def clear_zap_state():
-    """Clear previous ZAP state"""
+class ScanState:
+    """ZAP context, spider and active scan owned by a single scan, and its time plan"""
+
+    def __init__(self, job_id, target_url, mode, zap, options=None, deadline_at=None, ajax_lock=None):
+        self.job_id = job_id
+        self.target_url = target_url
+        self.mode = mode
+        self.zap = zap
+        self.options = options or {}
+        self.limits = SPIDER_LIMITS.get(mode, {})
+        weights = {phase: weight for phase, weight in PHASE_WEIGHTS[mode].items()
+                   if phase != 'ajax_spider' or self.limits.get('ajax')}
+        self.plan = ScanPlan(deadline_at or time.time() + SCAN_BUDGETS[mode], weights, SCAN_REPORT_RESERVE)
+        # ZAP runs one AJAX spider at a time, so scans sharing an instance share this lock
+        self.ajax_lock = ajax_lock or threading.Lock()
+        self.ajax_running = False
+        self.context_name = f"scan_{mode}_{uuid.uuid4().hex[:12]}"
+        self.context_id = None
+        self.spider_id = None
+        self.scan_id = None
+        self.ascan_complete = False
+        # Uncompressed size of the written report, for the catalog
+        self.report_bytes = None
+        # Alerts ZAP already held for the target when the scan started, raised by earlier scans,
+        # and the offset into ZAP's alert list of the first alert not yet read
+        self.alerts_before = 0
+        self.alert_offset = 0
+        # fail_on gating: (risk, count) threshold and alerts at or above that risk seen so far
+        self.fail_on = parse_fail_on(self.options['fail_on']) if self.options.get('fail_on') else None
+        self.gate_matches = 0
+        self.gated = False
+        # Incremental scans only: delta context, URL fingerprints and URLs left unscanned
+        self.delta_context_name = None
+        self.fingerprints = None
+        self.unchanged = None
+        # Seeded scans only: stored seed reference and what loading it sent to ZAP
+        self.seed = self.options.get('seed')
+        self.seed_result = None
+        # Sharded full scans only: shards requested, and for the parent the alerts seen across
+        # instances, their merged list and each shard's outcome; a shard points at its parent
+        self.shards = 1 if self.options.get('incremental') else \
+            int(self.options.get('shards') or (FULL_SCAN_SHARDS if mode == SCAN_MODE_FULL else 1))
+        self.seen_alerts = None
+        self.merged_alerts = None
+        self.shard_results = None
+        self.shards_cancelled = False
+        self.parent = None
+        self.shard_index = None
+        # Picked up from a checkpoint after a restart, with its active scan already running
+        self.resumed = False
+
+@contextmanager
+def scan_phase(scan, phase):
+    """Time a scan phase and publish its start and end to the job's event stream"""
+    events.publish(scan.job_id, 'phase', {"phase": phase, "state": "started"})
+    started = time.monotonic()
+    try:
+        with SCAN_PHASE_SECONDS.time(phase=phase, mode=scan.mode), span(phase, phase=phase, mode=scan.mode):
+            yield
+    finally:
+        events.publish(scan.job_id, 'phase', {"phase": phase, "state": "finished",
+                                              "seconds": round(time.monotonic() - started, 1)})
+
+def watch_progress(scan, check=None):
+    """Return a poller.wait progress callback publishing the scan's progress and new alerts
+
+    Events ride on the poll the scan makes anyway. New alerts are read from
+    ZAP's alert list from the scan's last offset, and only while someone is
+    watching or the scan has a fail_on gate; a count view is checked first
+    so polls without new alerts fetch nothing. Crossing the gate ends the
+    wait; otherwise `check` decides whether to stop waiting.
+    """
+    def callback(kind, value):
+        progress = {"kind": kind, "records_to_scan" if kind == 'pscan' else "percent": value}
+        if scan.parent:
+            progress["shard"] = scan.shard_index
+        events.publish(scan.job_id, 'progress', progress)
+        if scan.fail_on or events.watchers(scan.job_id):
+            read_new_alerts(scan)
+        if (scan.parent or scan).gated or (scan.parent and scan.parent.shards_cancelled):
+            return True
+        return check(kind, value) if check else False
+    return callback
+
+def gate_tripped(scan):
+    """Whether the scan crossed its fail_on gate, checked between phases
+
+    Polls only read alerts while a phase runs, so alerts raised after a
+    phase's last poll are read here before the next phase starts.
+    """
+    gate = scan.parent or scan
+    if gate.fail_on and not gate.gated:
+        read_new_alerts(scan)
+    return gate.gated
+
+def skip_earlier_alerts(scan):
+    """Start the scan's alert reads after the alerts ZAP already holds for the target
+
+    ZAP keeps every alert raised in its session, so without this a scan
+    would count, publish and store what earlier scans of the target found.
+    """
+    try:
+        scan.alerts_before = scan.alert_offset = number_of_alerts(scan.zap, scan.target_url)
+    except ZapConnectionError:
+        raise
+    except ZapError as e:
+        logger.warning(f"Could not count earlier alerts for {scan.target_url}: {str(e)}")
+
+def read_new_alerts(scan):
+    """Publish alerts ZAP raised for the target since the last call and check the fail_on gate
+
+    A shard reads its own instance's alerts but counts them towards its
+    parent scan, skipping alerts another instance already raised.
+    """
+    gate = scan.parent or scan
+    try:
+        if number_of_alerts(scan.zap, scan.target_url) <= scan.alert_offset:
+            return
+        for page in fetch_alerts(scan.zap, scan.target_url, start=scan.alert_offset):
+            for alert in page:
+                if gate.seen_alerts is not None:
+                    if alert_key(alert) in gate.seen_alerts:
+                        continue
+                    gate.seen_alerts.add(alert_key(alert))
+                events.publish(scan.job_id, 'alert', {key: alert.get(key) for key in EVENT_ALERT_FIELDS})
+                if gate.fail_on and str(alert.get('risk', '')).lower() in RISK_LEVELS and \
+                        RISK_LEVELS.index(str(alert['risk']).lower()) >= RISK_LEVELS.index(gate.fail_on[0]):
+                    gate.gate_matches += 1
+            scan.alert_offset += len(page)
+    except ZapConnectionError:
+        raise
+    except ZapError as e:
+        logger.warning(f"Could not read new alerts for job {scan.job_id}: {str(e)}")
+
+    if gate.fail_on and not gate.gated and gate.gate_matches >= gate.fail_on[1]:
+        gate.gated = True
+        risk, count = gate.fail_on
+        logger.info(f"Job {scan.job_id} crossed fail_on {risk}:{count} with {gate.gate_matches} alerts, stopping early")
+        events.publish(scan.job_id, 'gate', {"fail_on": gate.options['fail_on'], "matches": gate.gate_matches})
+
+def publish_job_status(job):
+    """JobManager status hook: publish job state changes and end the stream once it finishes"""
+    if job["status"] in FINISHED_STATES:
+        events.close(job["job_id"], 'done', {"status": job["status"], "result": job["result"]})
+    else:
+        events.publish(job["job_id"], 'status', {"status": job["status"], "started_at": job["started_at"]})
+
+@traced('clear_zap_state')
+def clear_zap_state(scan):
+    """Remove the spider, active scan and context created for this scan"""
+    zap = scan.zap
+    try:
+        logger.debug(f"Cleaning up ZAP state for context {scan.context_name}")
+        # Cleanup gets its own short deadline so it still runs after the scan's has passed
+        with deadline(ZAP_CLEANUP_TIMEOUT):
+            if scan.ajax_running:
+                zap.action('ajaxSpider', 'stop')
+            if scan.scan_id:
+                zap.action('ascan', 'stop', scanId=scan.scan_id)
+                zap.action('ascan', 'removeScan', scanId=scan.scan_id)
+            if scan.spider_id:
+                zap.action('spider', 'stop', scanId=scan.spider_id)
+                zap.action('spider', 'removeScan', scanId=scan.spider_id)
+            if scan.delta_context_name:
+                zap.action('context', 'removeContext', contextName=scan.delta_context_name)
+            if scan.context_id:
+                zap.action('context', 'removeContext', contextName=scan.context_name)
+    except Exception as e:
+        logger.warning(f"Failed to clear ZAP state for {scan.context_name}: {str(e)}")
+
+def checkpoint_scan(scan):
+    """Record the scan's ZAP instance, context, spider and active scan in the job store
+
+    After a restart the job is resumed from its active scan, or has what
+    it left in ZAP removed before it runs again.
+    """
+    if scan.parent:
+        return
     try:
-        logger.debug("Clearing ZAP sessions and contexts")
-        new_session_res = requests.get(f"{ZAP_URL}/JSON/core/action/newSession/?apikey={API_KEY}")
-        logger.debug(f"New session response: {new_session_res.text}, Status Code: {new_session_res.status_code}")
-        remove_context_res = requests.get(f"{ZAP_URL}/JSON/context/action/removeContext/?contextName=scan_context&apikey={API_KEY}")
-        logger.debug(f"Remove context response: {remove_context_res.text}, Status Code: {remove_context_res.status_code}")
+        save_checkpoint(scan.job_id, {
+            "instance": next((i.url for i in fleet.instances if i.client is scan.zap), scan.zap.base_url),
+            "context_name": scan.context_name,
+            "context_id": scan.context_id,
+            "spider_id": scan.spider_id,
+            "scan_id": scan.scan_id,
+            "delta_context_name": scan.delta_context_name,
+            "deadline_at": scan.plan.deadline,
+            "allotments": scan.plan.allotments,
+            "seed_result": scan.seed_result,
+            "alerts_before": scan.alerts_before
+        })
     except Exception as e:
-        logger.warning(f"Failed to clear ZAP state: {str(e)}")
+        logger.warning(f"Could not checkpoint job {scan.job_id}: {str(e)}")
+
+def scan_from_checkpoint(job_id, target_url, scan_mode, options, instance, checkpoint):
+    """A ScanState pointing at the ZAP state an earlier process recorded for the job"""
+    scan = ScanState(job_id, target_url, scan_mode, instance.client, options,
+                     deadline_at=max(checkpoint["deadline_at"], time.time() + SCAN_REPORT_RESERVE),
+                     ajax_lock=instance.ajax_lock)
+    for field in ('context_name', 'context_id', 'spider_id', 'scan_id', 'delta_context_name', 'seed_result'):
+        setattr(scan, field, checkpoint.get(field))
+    scan.alerts_before = scan.alert_offset = checkpoint.get("alerts_before") or 0
+    scan.plan.allotments.update(checkpoint.get("allotments") or {})
+    return scan
+
+def resume_scan(job_id, target_url, scan_mode, options, instance, checkpoint):
+    """Pick up an active scan an earlier process left running on `instance`
+
+    Returns its ScanState, or None after removing what the scan left in
+    ZAP when ZAP no longer has it, e.g. because ZAP restarted too.
+    """
+    scan = scan_from_checkpoint(job_id, target_url, scan_mode, options, instance, checkpoint)
+    try:
+        with deadline(ZAP_CLEANUP_TIMEOUT):
+            progress = instance.client.view('ascan', 'status', scanId=scan.scan_id).get('status')
+    except ZapError as e:
+        logger.warning(f"Cannot resume job {job_id} on {instance.url}, scanning again: {str(e)}")
+        clear_zap_state(scan)
+        return None
+    # The spider phases are over; the active scan gets the rest of the budget
+    scan.plan.skip('spider')
+    scan.plan.skip('ajax_spider')
+    scan.resumed = True
+    logger.info(f"Resuming the active scan of {target_url} on {instance.url} at {progress}%")
+    return scan
+
+def clear_checkpointed_state(job_id, target_url, scan_mode, options, checkpoint):
+    """Remove what an interrupted scan that cannot be resumed left in ZAP, before it runs again"""
+    instance = next((i for i in fleet.instances if i.url == checkpoint["instance"]), None)
+    if instance is None:
+        return
+    logger.info(f"Removing what job {job_id} left on {instance.url} before scanning again")
+    clear_zap_state(scan_from_checkpoint(job_id, target_url, scan_mode, options, instance, checkpoint))
+
+def depth_exclude_regex(target_url, max_depth):
+    """Regex matching URLs more than max_depth path segments below the target"""
+    return f"^{re.escape(target_url)}(?:/[^/?#]+){{{max_depth + 1}}}.*"
 
-def start_spider(target_url):
+@traced('start_spider')
+def start_spider(scan):
     """Start ZAP spider with retries"""
-    spider_url = f"{ZAP_URL}/JSON/spider/action/scan/?url={urllib.parse.quote(target_url)}&contextName=scan_context&recurse=true&subtreeOnly=false&apikey={API_KEY}"
+    zap = scan.zap
+    target_url = scan.target_url
+    limits = {'maxChildren': scan.limits['max_children']} if scan.limits.get('max_children') else {}
     for attempt in range(SPIDER_RETRIES):
         try:
             logger.debug(f"Attempt {attempt + 1}: Running spider: {target_url}")
-            spider_res = requests.get(spider_url)
-            logger.debug(f"Spider response: {spider_res.text}, Status Code: {spider_res.status_code}")
-            if spider_res.status_code != 200:
-                logger.error(f"Spider initiation failed: {spider_res.text}")
-                if attempt < SPIDER_RETRIES - 1:
-                    logger.debug("Retrying spider initiation after 5 seconds")
-                    time.sleep(5)
-                    continue
-                raise Exception(f"Spider initiation failed after {SPIDER_RETRIES} attempts: {spider_res.text}")
-            spider_data = spider_res.json()
+            spider_data = zap.action('spider', 'scan', url=target_url, contextName=scan.context_name,
+                                     recurse='true', subtreeOnly='false', **limits)
             spider_id = spider_data.get('scan')
             if not spider_id:
                 logger.error(f"Spider response missing 'scan' ID: {spider_data}")
                 if attempt < SPIDER_RETRIES - 1:
                     logger.debug("Retrying spider initiation after 5 seconds")
-                    time.sleep(5)
+                    sleep(5)
                     continue
                 raise Exception(f"Spider response missing 'scan' ID after {SPIDER_RETRIES} attempts: {spider_data}")
             return spider_id
-        except Exception as e:
+        except ZapConnectionError:
+            # The client has already retried; let the scan move to another instance
+            raise
+        except ZapError as e:
             logger.error(f"Spider attempt {attempt + 1} failed: {str(e)}")
             if attempt < SPIDER_RETRIES - 1:
                 logger.debug("Retrying spider initiation after 5 seconds")
-                time.sleep(5)
+                sleep(5)
                 continue
             raise Exception(f"Spider initiation failed after {SPIDER_RETRIES} attempts: {str(e)}")
 
-def prepare_target(target_url):
-    """Set up ZAP context and spider target"""
+@traced('prepare_target')
+def prepare_target(scan):
+    """Set up the scan's ZAP context and spider target"""
+    zap = scan.zap
+    target_url = scan.target_url
     try:
-        # Clear previous state
-        clear_zap_state()
-
-        # Create context
-        logger.debug("Creating new ZAP context")
-        context_res = requests.get(f"{ZAP_URL}/JSON/context/action/newContext/?contextName=scan_context&apikey={API_KEY}")
-        logger.debug(f"Context creation response: {context_res.text}, Status Code: {context_res.status_code}")
-        if context_res.status_code != 200:
-            raise Exception(f"Context creation failed: {context_res.text}")
-
-        # Include target in context
-        logger.debug(f"Including target in context: {urllib.parse.quote(target_url)}.*")
-        include_url = f"{ZAP_URL}/JSON/context/action/includeInContext/?contextName=scan_context&regex={urllib.parse.quote(target_url)}.*&apikey={API_KEY}"
-        logger.debug(f"Constructed include URL: {include_url}")
-        include_res = requests.get(include_url)
-        logger.debug(f"Include in context response: {include_res.text}, Status Code: {include_res.status_code}")
-        if include_res.status_code != 200:
-            raise Exception(f"Include in context failed: {include_res.text}")
-
-        # Start spider with retries
-        spider_id = start_spider(target_url)
-        logger.debug(f"Spider started with ID: {spider_id}")
-
-        # Wait for spider to complete
-        start_time = time.time()
-        while time.time() - start_time < SPIDER_TIMEOUT:
-            status_res = requests.get(f"{ZAP_URL}/JSON/spider/view/status/?scanId={spider_id}&apikey={API_KEY}")
-            logger.debug(f"Spider status response: {status_res.text}, Status Code: {status_res.status_code}")
-            if status_res.status_code != 200:
-                logger.error(f"Failed to get spider status: {status_res.text}")
-                raise Exception(f"Failed to get spider status: {status_res.text}")
-            status = status_res.json().get('status', 0)
-            logger.debug(f"Spider status: {status}%")
-            if int(status) >= 100:
-                break
-            time.sleep(10)
+        with scan_phase(scan, 'context_setup'):
+            # Create context
+            logger.debug(f"Creating new ZAP context {scan.context_name}")
+            scan.context_id = zap.action('context', 'newContext', contextName=scan.context_name).get('contextId')
+            checkpoint_scan(scan)
+
+            # Include target in context
+            logger.debug(f"Including target in context: {target_url}.*")
+            zap.action('context', 'includeInContext', contextName=scan.context_name, regex=f"{target_url}.*")
+
+            # Limit depth through the context so the spider and active scan both stay shallow
+            if scan.limits.get('max_depth'):
+                zap.action('context', 'excludeFromContext', contextName=scan.context_name,
+                           regex=depth_exclude_regex(target_url, scan.limits['max_depth']))
+
+        if scan.seed:
+            with scan_phase(scan, 'seed'):
+                scan.seed_result = apply_seed(zap, scan.seed, target_url, scan.context_id)
+
+        if scan.seed and SEEDED_SPIDER_MAX_DURATION == 0:
+            # The seed already covers the known URL surface
+            scan.plan.skip('spider')
         else:
-            logger.error("Spider timed out")
-            raise Exception("Spider timed out")
+            with scan_phase(scan, 'spider'):
+                run_spider(scan)
+
+        if scan.limits.get('ajax') and not gate_tripped(scan):
+            with scan_phase(scan, 'ajax_spider'):
+                run_ajax_spider(scan)
 
         # Verify URLs in context
-        urls_res = requests.get(f"{ZAP_URL}/JSON/context/view/urls/?contextName=scan_context&apikey={API_KEY}")
-        logger.debug(f"URLs in context after spidering: {urls_res.text}")
-        if not urls_res.json().get('urls'):
+        urls = zap.view('context', 'urls', contextName=scan.context_name).get('urls')
+        if not urls:
             logger.error("No URLs found in context after spidering")
             raise Exception("No URLs found in context after spidering")
 
+    except ZapConnectionError:
+        raise
     except Exception as e:
         logger.error(f"Target preparation failed: {str(e)}")
         raise Exception(f"Target preparation failed: {str(e)}")
 
-def run_baseline_scan(target_url):
+def number_of_messages(zap, base_url):
+    """How many requests ZAP has recorded under base_url"""
+    return int(zap.view('core', 'numberOfMessages', baseurl=base_url).get('numberOfMessages', 0))
+
+def run_spider(scan):
+    """Spider the target within the mode's limits and the time the plan allots
+
+    A spider that hits its time or URL limit is stopped and the scan
+    carries on with the URLs found so far.
+    """
+    zap = scan.zap
+    messages_before = number_of_messages(zap, scan.target_url) if scan.limits.get('max_urls') else 0
+    spider_id = start_spider(scan)
+    scan.spider_id = spider_id
+    checkpoint_scan(scan)
+    logger.debug(f"Spider started with ID: {spider_id}")
+
+    max_urls = scan.limits.get('max_urls')
+    url_limit_hit = False
+
+    def check_url_limit(kind, value):
+        # The spider's results view lists every URL found, so count the target's messages
+        # ZAP recorded since the spider started instead: one per URL the spider fetched
+        nonlocal url_limit_hit
+        found = number_of_messages(zap, scan.target_url) - messages_before
+        url_limit_hit = found >= max_urls
+        return url_limit_hit
+
+    cap = SEEDED_SPIDER_MAX_DURATION if scan.seed else scan.limits.get('max_duration') or SPIDER_TIMEOUT
+    timeout = scan.plan.allot('spider', cap=cap)
+    finished = poller.wait(zap, 'spider', spider_id, timeout=timeout,
+                           on_progress=watch_progress(scan, check_url_limit if max_urls else None))
+    if scan.gated:
+        zap.action('spider', 'stop', scanId=spider_id)
+    elif url_limit_hit or not finished:
+        reason = f"{max_urls} URL limit" if url_limit_hit else f"{timeout:.0f}s budget"
+        logger.info(f"Spider reached its {reason}, continuing with the URLs found")
+        zap.action('spider', 'stop', scanId=spider_id)
+
+def run_ajax_spider(scan):
+    """Crawl JavaScript-rendered pages with the AJAX spider within the time the plan allots"""
+    zap = scan.zap
+    timeout = scan.plan.allot('ajax_spider', cap=AJAX_SPIDER_MAX_DURATION)
+    started = time.monotonic()
+    if not scan.ajax_lock.acquire(timeout=timeout):
+        logger.warning(f"AJAX spider busy with another scan for {timeout:.0f}s, skipping it")
+        return
+    try:
+        zap.action('ajaxSpider', 'scan', url=scan.target_url, contextName=scan.context_name)
+        scan.ajax_running = True
+        if not poller.wait(zap, 'ajax', timeout=max(0, timeout - (time.monotonic() - started)),
+                           on_progress=watch_progress(scan)):
+            logger.info("AJAX spider reached its budget, continuing with the URLs found")
+            zap.action('ajaxSpider', 'stop')
+        elif scan.gated:
+            zap.action('ajaxSpider', 'stop')
+        scan.ajax_running = False
+    finally:
+        scan.ajax_lock.release()
+
+def create_delta_context(scan):
+    """Fingerprint the spidered URLs and scope a context to the new or changed ones
+
+    Returns the delta context ID, or None when nothing changed since the
+    last scan of the target.
+    """
+    zap = scan.zap
+    scan.fingerprints = fingerprint_urls(zap, scan.target_url)
+    changed, scan.unchanged = diff_inventory(scan.target_url, scan.fingerprints)
+    logger.info(f"Incremental scan of {scan.target_url}: {len(changed)} new or changed URLs, "
+                f"{len(scan.unchanged)} unchanged")
+    if not changed:
+        return None
+
+    scan.delta_context_name = f"{scan.context_name}_delta"
+    context_id = zap.action('context', 'newContext', contextName=scan.delta_context_name).get('contextId')
+    include_urls(zap, scan.delta_context_name, changed)
+    return context_id
+
+def include_urls(zap, context_name, urls):
+    """Include exactly these URLs in a context, INCREMENTAL_REGEX_BATCH of them per regex"""
+    for i in range(0, len(urls), INCREMENTAL_REGEX_BATCH):
+        batch = urls[i:i + INCREMENTAL_REGEX_BATCH]
+        regex = '^(?:' + '|'.join(re.escape(url) for url in batch) + ')$'
+        zap.action('context', 'includeInContext', contextName=context_name, regex=regex)
+
+@traced('start_active_scan')
+def start_active_scan(scan):
+    """Start an active scan restricted to the scan's context and return its scan ID
+
+    Incremental scans are restricted to new or changed URLs instead, and
+    return None without scanning when there are none.
+    """
+    context_id = scan.context_id
+    if scan.options.get('incremental'):
+        context_id = create_delta_context(scan)
+        if context_id is None:
+            scan.ascan_complete = True
+            return None
+    scan_data = policies.start_scan(scan.zap, scan.options.get('policy'), url=scan.target_url,
+                                    contextId=context_id, recurse='true', inScopeOnly='true')
+    scan_id = scan_data.get("scan")
+    if not scan_id:
+        raise Exception(f"Scan response missing 'scan' ID: {scan_data}")
+    scan.scan_id = scan_id
+    checkpoint_scan(scan)
+    return scan_id
+
+def write_html_report(scan):
+    """Have ZAP write the HTML report of the scan's context, then compress it into REPORT_DIR
+
+    core/other/htmlreport covers the whole ZAP session, including other
+    scans' targets, so the report is generated for the scan's context
+    only. ZAP writes it to the shared report directory (ZAP_REPORT_DIR in
+    its containers) under a name the catalog ignores until it is stored.
+    """
+    zap = scan.zap
+    logger.debug("Generating HTML report")
+    report_path, report_filename = generate_report_filename(scan.target_url, scan.mode)
+
+    logger.debug(f"Writing report to {report_path}")
+    with scan_phase(scan, 'report'):
+        if not scan.context_id:
+            # Baseline scans have no context of their own; one is made to scope the report
+            scan.context_id = zap.action('context', 'newContext', contextName=scan.context_name).get('contextId')
+            zap.action('context', 'includeInContext', contextName=scan.context_name, regex=f"{scan.target_url}.*")
+        generated = zap.action('reports', 'generate', timeout=REPORT_TIMEOUT, title='ZAP Scanning Report',
+                               template=REPORT_TEMPLATE, contexts=scan.context_name, reportDir=ZAP_REPORT_DIR,
+                               reportFileName=f"{PARTIAL_REPORT_PREFIX}{report_filename}").get('generate')
+        if not generated:
+            raise Exception("Report response missing the generated file")
+        raw_path = os.path.join(REPORT_DIR, os.path.basename(generated))
+        try:
+            with open(raw_path, 'rb') as raw:
+                _, scan.report_bytes = write_report(report_path, iter(lambda: raw.read(REPORT_CHUNK_SIZE), b''))
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+    return report_filename
+
+def write_merged_report(scan):
+    """Write the report of a sharded scan from its merged alerts"""
+    report_path, report_filename = generate_report_filename(scan.target_url, scan.mode)
+    logger.debug(f"Writing merged report to {report_path}")
+    with scan_phase(scan, 'report'):
+        _, scan.report_bytes = write_report(report_path, render_report(scan.target_url, scan.mode, scan.merged_alerts, scan.shard_results))
+    return report_filename
+
+def new_shard(scan, index, zap):
+    """A ScanState for one shard of a sharded scan, with its own context on `zap`"""
+    shard = ScanState(scan.job_id, scan.target_url, scan.mode, zap, scan.options, deadline_at=scan.plan.deadline)
+    shard.context_name = f"{scan.context_name}_shard{index}"
+    shard.parent = scan
+    shard.shard_index = index
+    return shard
+
+def scan_shard(shard, urls, requests, ends_at):
+    """Load, scope and actively scan one shard on its instance; return its status
+
+    Extra instances have not spidered the target, so the requests the
+    spider recorded for the shard's URLs are replayed there first.
+    """
+    zap = shard.zap
+    try:
+        if shard.shard_index:
+            # Shard 0 carries on from the scan's own alert offset
+            skip_earlier_alerts(shard)
+        if requests:
+            sent, failed = fan_out(
+                lambda raw: zap.action('core', 'sendRequest', post=True, request=raw, followRedirects='false'),
+                requests, SEED_CONCURRENCY, limit=None)
+            if not sent:
+                raise Exception(f"none of the shard's {failed} recorded requests could be replayed")
+            if failed:
+                logger.warning(f"{failed} of {sent + failed} requests for shard {shard.shard_index} failed to replay")
+        if shard.parent.shards_cancelled:
+            return 'cancelled'
+        shard.context_id = zap.action('context', 'newContext', contextName=shard.context_name).get('contextId')
+        include_urls(zap, shard.context_name, urls)
+
+        scan_data = policies.start_scan(zap, shard.options.get('policy'), url=shard.target_url,
+                                        contextId=shard.context_id, recurse='true', inScopeOnly='true')
+        shard.scan_id = scan_data.get("scan")
+        if not shard.scan_id:
+            raise Exception(f"Scan response missing 'scan' ID: {scan_data}")
+        if not poller.wait(zap, 'ascan', shard.scan_id, timeout=max(0, ends_at - time.time()),
+                           on_progress=watch_progress(shard)):
+            zap.action('ascan', 'stop', scanId=shard.scan_id)
+            return 'timed_out'
+        if shard.parent.gated:
+            zap.action('ascan', 'stop', scanId=shard.scan_id)
+            return 'gated'
+        if shard.parent.shards_cancelled:
+            zap.action('ascan', 'stop', scanId=shard.scan_id)
+            return 'cancelled'
+        return 'completed'
+    finally:
+        clear_zap_state(shard)
+
+def run_sharded_active_scan(scan):
+    """Split the active scan across up to scan.shards ZAP instances and merge their alerts
+
+    The context's URLs are cut into balanced ranges, one per free instance
+    (the scan's own included), and scanned in parallel within the time the
+    plan allots. A shard whose instance fails is scanned again on the
+    scan's own instance; if the scan's own shard fails, the others are
+    stopped. Returns False without scanning when the target
+    has too few URLs or no other instance is free.
+    """
+    zap = scan.zap
+    urls = zap.view('context', 'urls', contextName=scan.context_name).get('urls', [])
+    wanted = min(scan.shards, len(urls) // SHARD_MIN_URLS)
+    if wanted < 2:
+        logger.info(f"{len(urls)} URLs are too few to shard the scan of {scan.target_url}")
+        return False
+
+    own = [instance.url for instance in fleet.instances if instance.client is zap]
+    with ExitStack() as stack:
+        helpers = []
+        while len(helpers) < wanted - 1:
+            # Only the first extra instance is waited for; sharding must not hold up a busy fleet
+            try:
+                helpers.append(stack.enter_context(fleet.acquire(timeout=0 if helpers else SHARD_ACQUIRE_TIMEOUT,
+                                                                 exclude=own + [h.url for h in helpers],
+                                                                 target=scan.target_url)))
+            except NoZapInstanceAvailable:
+                break
+        if not helpers:
+            logger.info(f"No free ZAP instance to shard the scan of {scan.target_url}, scanning on one")
+            return False
+
+        groups = split_urls(urls, len(helpers) + 1)
+        shard_of = {url: i for i, group in enumerate(groups) for url in group}
+        requests = recorded_requests(zap, scan.target_url, shard_of)
+        requests.pop(0, None)  # Shard 0 stays on this instance, which already holds them
+        # Alerts already read from this instance must not be counted again when other instances raise them
+        seen = [alert for page in fetch_alerts(zap, scan.target_url, start=scan.alerts_before, stop=scan.alert_offset)
+                for alert in page]
+        scan.seen_alerts = {alert_key(alert) for alert in seen}
+        shards = [new_shard(scan, 0, zap)] + [new_shard(scan, i + 1, h.client) for i, h in enumerate(helpers)]
+        shards[0].alerts_before, shards[0].alert_offset = scan.alerts_before, scan.alert_offset
+        logger.info(f"Sharding the active scan of {scan.target_url} ({len(urls)} URLs) across "
+                    f"{len(shards)} ZAP instances: {', '.join(str(len(group)) for group in groups)} URLs")
+
+        ends_at = time.time() + scan.plan.allot('active_scan', cap=SCAN_TIMEOUT)
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="zap-shard") as pool:
+            futures = [pool.submit(context.copy().run, scan_shard, shard, group, requests.get(i), ends_at)
+                       for i, (shard, group) in enumerate(zip(shards, groups))]
+            # The scan's own instance failing requeues the whole scan, as without sharding,
+            # so the other shards are stopped rather than left scanning until their time runs out
+            try:
+                statuses = [futures[0].result()]
+            except Exception:
+                scan.shards_cancelled = True
+                raise
+            alert_lists = []
+            retry = []
+            for helper, shard, group, future in zip(helpers, shards[1:], groups[1:], futures[1:]):
+                try:
+                    statuses.append(future.result())
+                    alert_lists.append([alert for page in fetch_alerts(shard.zap, scan.target_url,
+                                                                       start=shard.alerts_before) for alert in page])
+                except Exception as e:
+                    logger.warning(f"Shard {shard.shard_index} of {scan.target_url} failed on {helper.url}: {str(e)}")
+                    if isinstance(e, ZapConnectionError):
+                        fleet.mark_unhealthy(helper, e)
+                        policies.forget(helper.url)
+                    statuses.append('failed')
+                    retry.append((shard.shard_index, group))
+
+        results = [{"instance": s.zap.base_url, "urls": len(g), "status": status}
+                   for s, g, status in zip(shards, groups, statuses)]
+        for index, group in retry:
+            if scan.gated:
+                break
+            logger.info(f"Scanning shard {index} of {scan.target_url} on {zap.base_url} instead")
+            status = scan_shard(new_shard(scan, index, zap), group, None, ends_at)
+            results.append({"instance": zap.base_url, "urls": len(group), "status": status, "retry_of": index})
+
+    scan.merged_alerts = merge_alerts([[alert for page in fetch_alerts(zap, scan.target_url, start=scan.alerts_before)
+                                        for alert in page]] + alert_lists)
+    scan.shard_results = results
+    scan.ascan_complete = all(r["status"] == 'completed' for r in results if r["status"] != 'failed')
+    logger.info(f"Sharded scan of {scan.target_url} found {len(scan.merged_alerts)} distinct alerts")
+    return True
+
+def run_baseline_scan(scan):
     """Execute baseline scan - passive only, no spider (FAST)"""
+    target_url, zap = scan.target_url, scan.zap
     try:
         logger.info(f"Running baseline scan on {target_url}")
         
         # Access URL through ZAP proxy (triggers passive scanning)
         logger.debug("Accessing target URL through ZAP...")
-        access_url = f"{ZAP_URL}/JSON/core/action/accessUrl/?url={urllib.parse.quote(target_url)}&apikey={API_KEY}"
-        access_res = requests.get(access_url, timeout=30)
-        logger.debug(f"Access URL response: {access_res.text}, Status: {access_res.status_code}")
+        zap.action('core', 'accessUrl', url=target_url, timeout=30)
+
+        # Seeded URLs are passively scanned too
+        if scan.seed:
+            with scan_phase(scan, 'seed'):
+                scan.seed_result = apply_seed(zap, scan.seed, target_url)
         
-        # Give passive scanners time to finish
+        # Wait for the passive scan queue to drain
         logger.debug("Waiting for passive scanners...")
-        time.sleep(5)
+        with scan_phase(scan, 'passive_scan'):
+            if not poller.wait(zap, 'pscan', timeout=scan.plan.allot('passive_scan', cap=PASSIVE_SCAN_TIMEOUT),
+                               on_progress=watch_progress(scan)):
+                logger.warning("Passive scanners still busy, reporting alerts found so far")
         
         # Get alerts count
-        alerts_res = requests.get(f"{ZAP_URL}/JSON/core/view/numberOfAlerts/?baseurl={urllib.parse.quote(target_url)}&apikey={API_KEY}")
-        alerts_count = alerts_res.json().get('numberOfAlerts', 0)
+        alerts_count = number_of_alerts(zap, target_url) - scan.alerts_before
         logger.info(f"Found {alerts_count} alerts")
         
         # Generate report
-        logger.debug("Generating HTML report")
-        report = requests.get(f"{ZAP_URL}/OTHER/core/other/htmlreport/?apikey={API_KEY}").text
-        report_path, report_filename = generate_report_filename(target_url, 'baseline')
-        
-        logger.debug(f"Writing report to {report_path}")
-        with open(report_path, 'w') as f:
-            f.write(report)
+        report_filename = write_html_report(scan)
         
         return {
             "success": True,
@@ -179,63 +837,51 @@ def run_baseline_scan(target_url):
             "mode": "baseline"
         }
     
+    except ZapConnectionError:
+        raise
     except Exception as e:
         logger.error(f"Baseline scan failed: {str(e)}")
-        # Create error report
-        report_path, report_filename = generate_report_filename(target_url, 'baseline')
-        create_error_report(report_path, target_url, str(e), 'baseline')
-        return {
-            "success": False,
-            "status": "failed",
-            "error": str(e),
-            "report_path": report_filename
-        }
+        return failed_scan_result(target_url, 'baseline', str(e), scan.job_id)
+    finally:
+        clear_zap_state(scan)
 
-def run_quick_scan(target_url):
+def run_quick_scan(scan):
     """Execute quick scan with limited spider and active scanning"""
+    target_url, zap = scan.target_url, scan.zap
     try:
         logger.info(f"Running quick scan on {target_url}")
         
-        # Prepare target (includes spider)
-        logger.debug(f"Preparing target: {target_url}")
-        prepare_target(target_url)
-        
-        # Start active scan with light policy
-        logger.debug("Starting quick active scan")
-        scan_url = f"{ZAP_URL}/JSON/ascan/action/scan/?url={urllib.parse.quote(target_url)}&contextName=scan_context&recurse=true&inScopeOnly=true&apikey={API_KEY}"
-        scan_res = requests.get(scan_url)
-        logger.debug(f"Scan start response: {scan_res.text}, Status Code: {scan_res.status_code}")
+        # Prepare target (includes spider); a resumed scan did that before the restart
+        if not scan.resumed:
+            logger.debug(f"Preparing target: {target_url}")
+            prepare_target(scan)
         
-        if scan_res.status_code != 200:
-            raise Exception(f"Scan failed to start: {scan_res.text}")
-        
-        scan_id = scan_res.json().get("scan")
-        if not scan_id:
-            raise Exception(f"Scan response missing 'scan' ID: {scan_res.json()}")
-        
-        # Wait for completion (shorter timeout for quick scan)
-        start_time = time.time()
-        timeout = 600  # 10 minutes for quick scan
-        while time.time() - start_time < timeout:
-            status = requests.get(f"{ZAP_URL}/JSON/ascan/view/status/?scanId={scan_id}&apikey={API_KEY}").json().get("status", 0)
-            logger.debug(f"Scan status: {status}%")
-            if int(status) >= 100:
-                break
-            time.sleep(5)
-        else:
-            logger.warning("Quick scan timed out, generating partial report")
+        # A fail_on gate crossed while spidering makes the active scan moot
+        scan_id = None
+        if not gate_tripped(scan):
+            with scan_phase(scan, 'active_scan'):
+                # Start active scan with light policy
+                logger.debug("Starting quick active scan")
+                scan_id = scan.scan_id if scan.resumed else start_active_scan(scan)
+
+                # Wait for completion within what the quick scan budget has left
+                if scan_id and not poller.wait(zap, 'ascan', scan_id, timeout=scan.plan.allot('active_scan'),
+                                               on_progress=watch_progress(scan)):
+                    zap.action('ascan', 'stop', scanId=scan_id)
+                    logger.warning("Quick scan timed out, generating partial report")
+                elif scan_id and scan.gated:
+                    zap.action('ascan', 'stop', scanId=scan_id)
+                elif scan_id:
+                    scan.ascan_complete = True
+
+            # Alerts raised after the last poll still count towards the gate
+            gate_tripped(scan)
         
         # Get alerts count
-        alerts_res = requests.get(f"{ZAP_URL}/JSON/core/view/numberOfAlerts/?baseurl={urllib.parse.quote(target_url)}&apikey={API_KEY}")
-        alerts_count = alerts_res.json().get('numberOfAlerts', 0)
+        alerts_count = number_of_alerts(zap, target_url) - scan.alerts_before
         
         # Generate report
-        logger.debug("Generating HTML report")
-        report = requests.get(f"{ZAP_URL}/OTHER/core/other/htmlreport/?apikey={API_KEY}").text
-        report_path, report_filename = generate_report_filename(target_url, 'quick')
-        
-        with open(report_path, 'w') as f:
-            f.write(report)
+        report_filename = write_html_report(scan)
         
         return {
             "success": True,
@@ -246,63 +892,61 @@ def run_quick_scan(target_url):
             "mode": "quick"
         }
     
+    except ZapConnectionError:
+        raise
     except Exception as e:
         logger.error(f"Quick scan failed: {str(e)}")
-        report_path, report_filename = generate_report_filename(target_url, 'quick')
-        create_error_report(report_path, target_url, str(e), 'quick')
-        return {
-            "success": False,
-            "status": "failed",
-            "error": str(e),
-            "report_path": report_filename
-        }
+        return failed_scan_result(target_url, 'quick', str(e), scan.job_id)
+    finally:
+        clear_zap_state(scan)
 
-def run_full_scan(target_url):
+def run_full_scan(scan):
     """Execute full comprehensive scan"""
+    target_url, zap = scan.target_url, scan.zap
     try:
         logger.info(f"Running full scan on {target_url}")
         
-        # Prepare target
-        logger.debug(f"Preparing target: {target_url}")
-        prepare_target(target_url)
-        
-        # Start active scan
-        logger.debug("Starting full active scan")
-        scan_url = f"{ZAP_URL}/JSON/ascan/action/scan/?url={urllib.parse.quote(target_url)}&contextName=scan_context&recurse=true&inScopeOnly=true&apikey={API_KEY}"
-        scan_res = requests.get(scan_url)
-        logger.debug(f"Scan start response: {scan_res.text}, Status Code: {scan_res.status_code}")
-        
-        if scan_res.status_code != 200:
-            raise Exception(f"Scan failed to start: {scan_res.text}")
+        # Prepare target; a resumed scan did that before the restart
+        if not scan.resumed:
+            logger.debug(f"Preparing target: {target_url}")
+            prepare_target(scan)
         
-        scan_id = scan_res.json().get("scan")
-        if not scan_id:
-            raise Exception(f"Scan response missing 'scan' ID: {scan_res.json()}")
+        # A fail_on gate crossed while spidering makes the active scan moot
+        scan_id = None
+        if not gate_tripped(scan):
+            with scan_phase(scan, 'active_scan'):
+                # Large targets may be split across several ZAP instances
+                sharded = not scan.resumed and scan.shards > 1 and run_sharded_active_scan(scan)
+
+                # Start active scan
+                if not sharded:
+                    logger.debug("Starting full active scan")
+                    scan_id = scan.scan_id if scan.resumed else start_active_scan(scan)
+
+                # Wait for completion
+                if scan_id and not poller.wait(zap, 'ascan', scan_id,
+                                               timeout=scan.plan.allot('active_scan', cap=SCAN_TIMEOUT),
+                                               on_progress=watch_progress(scan)):
+                    zap.action('ascan', 'stop', scanId=scan_id)
+                    logger.warning("Full scan timed out, generating partial report")
+                elif scan_id and scan.gated:
+                    zap.action('ascan', 'stop', scanId=scan_id)
+                elif scan_id:
+                    scan.ascan_complete = True
+
+            # Alerts raised after the last poll still count towards the gate
+            gate_tripped(scan)
         
-        # Wait for completion
-        start_time = time.time()
-        while time.time() - start_time < SCAN_TIMEOUT:
-            status = requests.get(f"{ZAP_URL}/JSON/ascan/view/status/?scanId={scan_id}&apikey={API_KEY}").json().get("status", 0)
-            logger.debug(f"Scan status: {status}%")
-            if int(status) >= 100:
-                break
-            time.sleep(10)
+        # Get alerts count; a sharded scan counts its merged alerts
+        if scan.merged_alerts is not None:
+            alerts_count = len(scan.merged_alerts)
         else:
-            logger.warning("Full scan timed out, generating partial report")
-        
-        # Get alerts count
-        alerts_res = requests.get(f"{ZAP_URL}/JSON/core/view/numberOfAlerts/?baseurl={urllib.parse.quote(target_url)}&apikey={API_KEY}")
-        alerts_count = alerts_res.json().get('numberOfAlerts', 0)
+            alerts_count = number_of_alerts(zap, target_url) - scan.alerts_before
         
         # Generate report
-        logger.debug("Generating HTML report")
-        report = requests.get(f"{ZAP_URL}/OTHER/core/other/htmlreport/?apikey={API_KEY}").text
-        report_path, report_filename = generate_report_filename(target_url, 'full')
+        report_filename = write_merged_report(scan) if scan.merged_alerts is not None else write_html_report(scan)
         
-        with open(report_path, 'w') as f:
-            f.write(report)
-        
-        return {
+        result = {
             "success": True,
             "status": "completed",
             "report_path": report_filename,
@@ -310,17 +954,17 @@ def run_full_scan(target_url):
             "alerts_count": alerts_count,
             "mode": "full"
         }
+        if scan.shard_results:
+            result["shards"] = scan.shard_results
+        return result
     
+    except ZapConnectionError:
+        raise
     except Exception as e:
         logger.error(f"Full scan failed: {str(e)}")
-        report_path, report_filename = generate_report_filename(target_url, 'full')
-        create_error_report(report_path, target_url, str(e), 'full')
-        return {
-            "success": False,
-            "status": "failed",
-            "error": str(e),
-            "report_path": report_filename
-        }
+        return failed_scan_result(target_url, 'full', str(e), scan.job_id)
+    finally:
+        clear_zap_state(scan)
 
 def create_error_report(report_path, target_url, error_msg, mode):
     """Create a minimal error report when scan fails"""
@@ -364,96 +1008,655 @@ def create_error_report(report_path, target_url, error_msg, mode):
 </html>
     """
     try:
-        with open(report_path, 'w') as f:
-            f.write(html)
+        _, size = write_report(report_path, [html.encode()])
         logger.info(f"Created error report at {report_path}")
+        return size
     except Exception as e:
         logger.error(f"Failed to create error report: {str(e)}")
+        return None
 
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check endpoint"""
+def failed_scan_result(target_url, mode, error_msg, job_id=None):
+    """Write an error report and build the result dict for a failed scan"""
+    report_path, report_filename = generate_report_filename(target_url, mode)
+    report_bytes = create_error_report(report_path, target_url, error_msg, mode)
+    report_id = record_report(job_id, target_url, mode, report_filename, 'failed', report_bytes)
+    return {
+        "success": False,
+        "status": "failed",
+        "error": error_msg,
+        "report_path": report_filename,
+        "report_id": report_id
+    }
+
+def record_report(job_id, target_url, mode, report_filename, status, report_bytes=None):
+    """Add a written report to the catalog without failing the scan; return its ID"""
     try:
-        # Check ZAP connection
-        version_res = requests.get(f"{ZAP_URL}/JSON/core/view/version/?apikey={API_KEY}", timeout=5)
-        if version_res.status_code == 200:
-            version = version_res.json().get('version', 'unknown')
-            return jsonify({
-                'status': 'healthy',
-                'zap_version': version,
-                'timestamp': datetime.now().isoformat()
-            }), 200
-        else:
-            return jsonify({
-                'status': 'unhealthy',
-                'error': 'ZAP not responding'
-            }), 503
+        entry = catalog_report(REPORT_DIR, report_filename, target_url, mode, status, job_id, report_bytes)
+        return entry and entry["report_id"]
+    except Exception as e:
+        logger.error(f"Failed to catalog report {report_filename}: {str(e)}")
+        return None
+
+def store_alerts(scan, result):
+    """Ingest the scan's alerts into the findings store without failing the scan"""
+    try:
+        with scan_phase(scan, 'alert_fetch'):
+            if scan.merged_alerts is not None:
+                result["alerts_stored"] = save_alerts(scan.job_id, scan.target_url, scan.mode, [scan.merged_alerts])
+            else:
+                result["alerts_stored"] = ingest_alerts(scan.zap, scan.job_id, scan.target_url, scan.mode,
+                                                         start=scan.alerts_before)
+        if scan.fingerprints is not None:
+            carried = carry_over_alerts(scan.job_id, scan.mode, scan.unchanged)
+            result["incremental"] = {
+                "changed_urls": len(scan.fingerprints) - len(scan.unchanged),
+                "unchanged_urls": len(scan.unchanged),
+                "carried_over_alerts": carried
+            }
+            if scan.ascan_complete:
+                save_inventory(scan.target_url, scan.fingerprints, scan.job_id)
+        record_scan(scan.job_id, scan.target_url, scan.mode, result["status"])
     except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
+        logger.error(f"Failed to store alerts for job {scan.job_id}: {str(e)}")
+
+def run_scan(job_id, target_url, scan_mode, options=None):
+    """Execute a scan on the least-loaded healthy ZAP instance
+
+    If the instance becomes unreachable mid-scan it is taken out of
+    rotation and the scan is requeued on another instance. Every ZAP call
+    and wait shares one deadline, SCAN_BUDGETS[scan_mode] seconds from
+    when the scan first gets an instance, so requeues cannot extend it.
+
+    A job that was running when an earlier process stopped resumes its
+    active scan on the same instance if ZAP still has it, keeping its
+    original deadline; otherwise what it left in ZAP is removed and it
+    scans again from the start.
+    """
+    with trace('scan', trace_id=job_id, job_id=job_id, target=target_url, mode=scan_mode) as root:
+        scan_functions = {
+            SCAN_MODE_BASELINE: run_baseline_scan,
+            SCAN_MODE_QUICK: run_quick_scan,
+            SCAN_MODE_FULL: run_full_scan
+        }
+        result = None
+        error = None
+        tried = []
+        expires = None
+        # Only the active scan phase of a non-incremental scan can be picked up where it was
+        resume = load_checkpoint(job_id)
+        if resume and (not resume.get("scan_id") or (options or {}).get('incremental')
+                       or resume["instance"] not in [i.url for i in fleet.instances]):
+            clear_checkpointed_state(job_id, target_url, scan_mode, options, resume)
+            resume = None
+        # Failing to get the resumed scan's instance does not use up a requeue attempt
+        for attempt in range(ZAP_REQUEUE_ATTEMPTS + bool(resume)):
+            acquire_timeout = ZAP_ACQUIRE_TIMEOUT
+            if expires is not None:
+                acquire_timeout = min(acquire_timeout, expires - time.time())
+                if acquire_timeout <= 0:
+                    error = f"{error}; no time left in the {SCAN_BUDGETS[scan_mode]}s scan budget to requeue"
+                    break
+            exclude = [i.url for i in fleet.instances if i.url != resume["instance"]] if resume else tried
+            try:
+                with fleet.acquire(timeout=acquire_timeout, exclude=exclude, reset=not resume,
+                                   target=target_url) as instance:
+                    tried.append(instance.url)
+                    scan = resume and resume_scan(job_id, target_url, scan_mode, options, instance, resume)
+                    resume = None
+                    if scan:
+                        expires = scan.plan.deadline
+                    else:
+                        if expires is None:
+                            expires = time.time() + SCAN_BUDGETS[scan_mode]
+                        logger.info(f"Starting {scan_mode} scan for {target_url} on {instance.url}")
+                        scan = ScanState(job_id, target_url, scan_mode, instance.client, options,
+                                         deadline_at=expires, ajax_lock=instance.ajax_lock)
+                    started = time.monotonic()
+                    try:
+                        with deadline(expires - time.time()):
+                            if not scan.resumed:
+                                skip_earlier_alerts(scan)
+                            result = scan_functions[scan_mode](scan)
+                            SCAN_SECONDS.observe(time.monotonic() - started, mode=scan_mode,
+                                                 outcome='completed' if result.get('success') else 'failed')
+                            result["zap_instance"] = instance.url
+                            result["time_plan"] = scan.plan.allotments
+                            if scan.seed_result:
+                                result["seed"] = scan.seed_result
+                            if scan.resumed:
+                                result["resumed"] = True
+                            if result.get('success') and scan.gated:
+                                result["status"] = "gated"
+                                result["gate"] = {"fail_on": options["fail_on"], "matches": scan.gate_matches}
+                            if result.get('success'):
+                                result["report_id"] = record_report(job_id, target_url, scan_mode,
+                                                                    result["report_path"], result["status"],
+                                                                    scan.report_bytes)
+                                store_alerts(scan, result)
+                        fleet.mark_healthy(instance)
+                    except ZapConnectionError as e:
+                        SCAN_SECONDS.observe(time.monotonic() - started, mode=scan_mode, outcome='requeued')
+                        fleet.mark_unhealthy(instance, e)
+                        # It may come back as a fresh ZAP without our policies
+                        policies.forget(instance.url)
+                        error = str(e)
+                        logger.warning(f"Requeueing {scan_mode} scan of {target_url} after {instance.url} failed")
+            except NoZapInstanceAvailable as e:
+                if resume:
+                    logger.warning(f"Cannot resume job {job_id} on {resume['instance']}, scanning again: {str(e)}")
+                    resume = None
+                    continue
+                error = str(e)
+                break
+            if result:
+                break
+
+        if result is None:
+            result = failed_scan_result(target_url, scan_mode, error, job_id)
+
+        root.set(status=result.get('status'), zap_instance=result.get('zap_instance'), instances_tried=len(tried),
+                 resumed=bool(result.get('resumed')))
+        if result.get('success'):
+            logger.info(f"Scan completed successfully: {result}")
+        else:
+            logger.error(f"Scan failed: {result.get('error')}")
+        return result
+
+scheduler = FairScheduler(PRIORITY_CLASSES, aging=PRIORITY_AGING, tenant_limit=TENANT_MAX_RUNNING,
+                          tenant_limits=TENANT_LIMITS)
+if is_runner:
+    job_manager = JobManager(run_scan, workers=SCAN_WORKERS, max_queued=MAX_QUEUED_JOBS, retention=JOB_RETENTION,
+                             cache_ttl=RESULT_CACHE_TTL, cache_size=RESULT_CACHE_SIZE, on_status=publish_job_status,
+                             scheduler=scheduler)
+else:
+    job_manager = RemoteJobManager(scheduler, max_queued=MAX_QUEUED_JOBS, cache_ttl=RESULT_CACHE_TTL)
+batch_manager = BatchManager(job_manager, retention=BATCH_RETENTION, count_alerts=count_by_risk, runner=is_runner)
+
+def start_sync(interval):
+    """Pick up jobs and batches other workers stored, and publish queue estimates for them, every `interval` seconds"""
+    def loop():
+        while not draining.wait(interval):
+            try:
+                job_manager.sync()
+                batch_manager.sync()
+            except Exception as e:
+                logger.error(f"Job store sync failed: {str(e)}")
+    threading.Thread(target=loop, name="job-sync", daemon=True).start()
+
+if is_runner and JOB_SYNC_INTERVAL > 0:
+    start_sync(JOB_SYNC_INTERVAL)
+
+def begin_drain():
+    """Stop accepting scans and starting queued jobs; running scans carry on"""
+    global drain_started
+    if draining.is_set():
+        return
+    drain_started = time.time()
+    draining.set()
+    job_manager.drain(0)
+
+def drain():
+    """Wait up to DRAIN_TIMEOUT seconds from the start of the drain for running scans to finish
+
+    Scans still running are left in ZAP with their checkpoints, for the
+    next process to resume. Queued jobs stay in the job store.
+    """
+    begin_drain()
+    remaining = job_manager.drain(max(0, drain_started + DRAIN_TIMEOUT - time.time()))
+    if remaining:
+        logger.warning(f"Shutting down with {remaining} scans running; the next process resumes them")
+    else:
+        logger.info("Drained, no scans running")
+    return remaining
+
+def shutdown(signum, frame):
+    """SIGTERM handler for the development server: drain, then exit"""
+    logger.info(f"Received signal {signum}, draining")
+    drain()
+    raise SystemExit(0)
+
+gauge('zap_jobs', 'Scan jobs by status', ('status',),
+      collect=lambda: {(status,): count for status, count in job_manager.stats().items()})
+gauge('zap_jobs_queued', 'Queued scan jobs by priority class and tenant', ('priority', 'tenant'),
+      collect=job_manager.queue_depths)
+gauge('zap_instance_active_scans', 'Scans running on each ZAP instance', ('instance',),
+      collect=lambda: {(i["url"],): i["active_scans"] for i in fleet.status()})
+gauge('zap_instance_healthy', 'Whether each ZAP instance is in rotation', ('instance',),
+      collect=lambda: {(i["url"],): int(i["healthy"]) for i in fleet.status()})
+gauge('zap_instance_probe_seconds', 'Latency of the last successful health probe', ('instance',),
+      collect=lambda: {(i["url"],): i["latency_ms"] / 1000 for i in fleet.status() if i["latency_ms"] is not None})
+gauge('zap_reports_stored', 'Reports in the report catalog', collect=lambda: {(): catalog_totals()[0]})
+gauge('zap_reports_stored_bytes', 'Disk space used by catalogued reports', collect=lambda: {(): catalog_totals()[1]})
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check endpoint
+
+    Serves the state kept by the background prober; ZAP is only called
+    here when probing is disabled.
+    """
+    if not fleet.probing:
+        for instance in fleet.instances:
+            fleet.probe(instance, ZAP_PROBE_TIMEOUT)
+    instances = fleet.status()
+    healthy = [i for i in instances if i['healthy']]
+
+    if not healthy:
         return jsonify({
             'status': 'unhealthy',
-            'error': str(e)
+            'error': 'No ZAP instance responding',
+            'instances': instances
         }), 503
+    return jsonify({
+        'status': 'healthy' if len(healthy) == len(instances) else 'degraded',
+        'zap_version': next((i['version'] for i in healthy if i['version']), None),
+        'instances': instances,
+        'role': 'runner' if is_runner else 'api',
+        'draining': draining.is_set(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+def parse_scan_request(data, default_priority=DEFAULT_PRIORITY, default_tenant=None):
+    """Validate a scan request; return (target_url, mode, options, force, schedule) or raise ValueError
+
+    `schedule` holds the job's priority class and tenant, which decide
+    when it runs but not what it scans.
+    """
+    target_url = data.get('url')
+    scan_mode = data.get('mode', SCAN_MODE_BASELINE)
+    force = str(data.get('force', 'false')).lower() == 'true'
+    incremental = str(data.get('incremental', 'false')).lower() == 'true'
+    policy = data.get('policy')
+    fail_on = data.get('fail_on')
+    seed = data.get('seed')
+    shards = data.get('shards')
+    priority = data.get('priority') or default_priority
+    tenant = data.get('tenant') or default_tenant or 'default'
+
+    logger.debug(f"Requested URL: {target_url}, Mode: {scan_mode}")
+
+    if not target_url:
+        raise ValueError("URL parameter is required")
+
+    target_url = normalize_target(target_url)
+    logger.debug(f"Normalized URL: {target_url}")
+
+    # Validate scan mode
+    if scan_mode not in [SCAN_MODE_BASELINE, SCAN_MODE_QUICK, SCAN_MODE_FULL]:
+        raise ValueError(f"Invalid scan mode. Use: {SCAN_MODE_BASELINE}, {SCAN_MODE_QUICK}, or {SCAN_MODE_FULL}")
+
+    options = {}
+    if incremental:
+        if scan_mode == SCAN_MODE_BASELINE:
+            raise ValueError("incremental requires quick or full mode")
+        options["incremental"] = True
+    if policy:
+        if scan_mode == SCAN_MODE_BASELINE:
+            raise ValueError("policy requires quick or full mode")
+        if policy not in policies.policies:
+            raise ValueError(f"Unknown scan policy. Use: {', '.join(sorted(policies.policies)) or 'none configured'}")
+        options["policy"] = policy
+    if fail_on:
+        risk, count = parse_fail_on(fail_on)
+        options["fail_on"] = f"{risk}:{count}"
+    if priority not in scheduler.classes:
+        raise ValueError(f"Unknown priority. Use: {', '.join(scheduler.classes)}")
+    if not re.fullmatch(r'[\w.-]{1,64}', str(tenant)):
+        raise ValueError("tenant must be 1-64 letters, digits, '_', '.' or '-'")
+    if shards not in (None, ''):
+        try:
+            shards = int(shards)
+        except (TypeError, ValueError):
+            raise ValueError("shards must be a positive integer")
+        if shards < 1:
+            raise ValueError("shards must be a positive integer")
+        if shards > 1 and scan_mode != SCAN_MODE_FULL:
+            raise ValueError("shards requires full mode")
+        if shards > 1 and incremental:
+            raise ValueError("shards cannot be combined with incremental")
+        options["shards"] = shards
+    if seed:
+        # Stored up front; the job carries only its reference
+        options["seed"] = save_seed(seed)
+    return target_url, scan_mode, options, force, {"priority": priority, "tenant": tenant}
 
 @app.route('/scan', methods=['GET', 'POST'])
 def scan():
     """Scan endpoint supporting multiple modes"""
     logger.debug("Received /scan request")
+    if draining.is_set():
+        return jsonify({
+            "status": "error",
+            "message": "Service is shutting down, retry shortly"
+        }), 503
     
-    # Get parameters from GET or POST
-    if request.method == 'POST':
+    # Get parameters from GET or POST; a seed file may be uploaded as multipart form data
+    if request.files.get('seed'):
+        data = request.form.to_dict()
+        data['seed'] = {"type": data.pop('seed_type', None), "content": request.files['seed'].read(SEED_MAX_BYTES + 1)}
+    elif request.method == 'POST':
         data = request.get_json() or {}
-        target_url = data.get('url')
-        scan_mode = data.get('mode', SCAN_MODE_BASELINE)
     else:
-        target_url = request.args.get('url')
-        scan_mode = request.args.get('mode', SCAN_MODE_BASELINE)
-    
-    logger.debug(f"Requested URL: {target_url}, Mode: {scan_mode}")
-    
-    if not target_url:
-        logger.error("No URL parameter provided")
+        data = request.args
+    try:
+        target_url, scan_mode, options, force, schedule = parse_scan_request(data)
+    except ValueError as e:
+        logger.error(f"Invalid scan request: {str(e)}")
         return jsonify({
             "status": "error",
-            "message": "URL parameter is required"
+            "message": str(e)
         }), 400
-    
-    if not target_url.startswith(('http://', 'https://')):
-        target_url = f"https://{target_url}"
-        logger.debug(f"Prepended https to URL: {target_url}")
-    
-    # Validate scan mode
-    if scan_mode not in [SCAN_MODE_BASELINE, SCAN_MODE_QUICK, SCAN_MODE_FULL]:
-        logger.error(f"Invalid scan mode: {scan_mode}")
+
+    # Traced under the job's ID, so requests joining a job show up in its trace
+    with trace(f"{request.method} {request.url_rule.rule}", target=target_url, mode=scan_mode) as request_span:
+        try:
+            job = job_manager.submit(target_url, scan_mode, options=options, force=force, **schedule)
+        except JobQueueFullError as e:
+            logger.error(f"Rejecting scan: {str(e)}")
+            request_span.set(rejected=True)
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 503
+        request_span.trace_id = job["job_id"]
+        request_span.set(job_id=job["job_id"], coalesced=bool(job.get("coalesced")), cached=bool(job.get("cached")))
+
+    response = {
+        "status": job["status"],
+        "job_id": job["job_id"],
+        "target": target_url,
+        "mode": scan_mode,
+        "priority": job["priority"],
+        "tenant": job["tenant"],
+        "status_url": f"/jobs/{job['job_id']}",
+        "result_url": f"/jobs/{job['job_id']}/result"
+    }
+    if job["status"] == JOB_QUEUED:
+        response.update(queue_position=job["queue_position"], estimated_start=job["estimated_start"])
+    if job.get("cached"):
+        response.update(cached=True, finished_at=job["finished_at"], result=job["result"])
+        return jsonify(response), 200
+    if job.get("coalesced"):
+        response["coalesced"] = True
+    return jsonify(response), 202
+
+@app.route('/scan/batch', methods=['POST'])
+def scan_batch():
+    """Scan many targets in one request, a bounded number at a time"""
+    if draining.is_set():
         return jsonify({
             "status": "error",
-            "message": f"Invalid scan mode. Use: {SCAN_MODE_BASELINE}, {SCAN_MODE_QUICK}, or {SCAN_MODE_FULL}"
+            "message": "Service is shutting down, retry shortly"
+        }), 503
+    data = request.get_json(silent=True) or {}
+    targets = data.get('targets')
+    if not isinstance(targets, list) or not targets:
+        return jsonify({
+            "status": "error",
+            "message": "targets must be a non-empty list of {url, mode} entries"
+        }), 400
+    if len(targets) > BATCH_MAX_TARGETS:
+        return jsonify({
+            "status": "error",
+            "message": f"A batch may hold at most {BATCH_MAX_TARGETS} targets"
         }), 400
-    
     try:
-        # Execute scan based on mode
-        logger.info(f"Starting {scan_mode} scan for {target_url}")
-        
-        if scan_mode == SCAN_MODE_BASELINE:
-            result = run_baseline_scan(target_url)
-        elif scan_mode == SCAN_MODE_QUICK:
-            result = run_quick_scan(target_url)
-        elif scan_mode == SCAN_MODE_FULL:
-            result = run_full_scan(target_url)
-        
-        if result.get('success'):
-            logger.info(f"Scan completed successfully: {result}")
-            return jsonify(result), 200
-        else:
-            logger.error(f"Scan failed: {result.get('error')}")
-            return jsonify(result), 500
-            
-    except Exception as e:
-        logger.error(f"Scan exception: {str(e)}")
+        concurrency = int(data.get('concurrency', BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        concurrency = 0
+    if concurrency < 1:
+        return jsonify({
+            "status": "error",
+            "message": "concurrency must be a positive integer"
+        }), 400
+
+    entries = []
+    for i, item in enumerate(targets):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("entry must be an object")
+            target_url, scan_mode, options, force, schedule = parse_scan_request(
+                item, default_priority=data.get('priority') or BATCH_PRIORITY, default_tenant=data.get('tenant'))
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"targets[{i}]: {str(e)}"
+            }), 400
+        entries.append({"target": target_url, "mode": scan_mode, "options": options, "force": force, **schedule})
+
+    batch = batch_manager.submit(entries, concurrency)
+    batch["status_url"] = f"/scan/batch/{batch['batch_id']}"
+    return jsonify(batch), 202
+
+@app.route('/scan/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Return progress, per-target results and an alert summary for a batch"""
+    batch = batch_manager.get(batch_id)
+    if not batch:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown batch: {batch_id}"
+        }), 404
+    return jsonify(batch), 200
+
+@app.route('/scan/<job_id>/events', methods=['GET'])
+def scan_events(job_id):
+    """Stream a job's status, phases, progress and new alerts as Server-Sent Events
+
+    Every watcher reads the events the scan publishes from its own polls,
+    so watchers add no ZAP traffic. Clients resume after a reconnect with
+    Last-Event-ID (or ?last_event_id=). A worker that does not run scans
+    only has the job store, so it streams status changes and the outcome.
+    Streams end when the service drains; clients reconnect to another
+    worker.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown job: {job_id}"
+        }), 404
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id', 0))
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "Last-Event-ID must be an integer"
+        }), 400
+
+    def generate():
+        yield format_event(None, 'status', {"status": job["status"], "target": job["target"], "mode": job["mode"]})
+        if job["status"] in FINISHED_STATES and not events.known(job_id):
+            # The stream has been pruned; the job record still has the outcome
+            yield format_event(None, 'done', {"status": job["status"], "result": job["result"]})
+            return
+        stream = events.subscribe(job_id, after=after, heartbeat=EVENT_HEARTBEAT) if is_runner else follow_job(job)
+        for event in stream:
+            if draining.is_set():
+                return
+            yield format_event(*event) if event else ': keep-alive\n\n'
+
+    return Response(generate(), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def follow_job(job):
+    """Yield status and done events for a job from the job store, None between changes as a heartbeat"""
+    status = job["status"]
+    waited = 0
+    while status not in FINISHED_STATES:
+        time.sleep(JOB_SYNC_INTERVAL or 1)
+        waited += JOB_SYNC_INTERVAL or 1
+        latest = job_manager.get(job["job_id"])
+        if latest is None:
+            return
+        job = latest
+        if job["status"] != status:
+            status = job["status"]
+            if status not in FINISHED_STATES:
+                yield None, 'status', {"status": status, "started_at": job["started_at"]}
+        elif waited >= EVENT_HEARTBEAT or draining.is_set():
+            waited = 0
+            yield None
+    yield None, 'done', {"status": job["status"], "result": job["result"]}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Return the status of a queued or running scan job"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown job: {job_id}"
+        }), 404
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Return the scan result once the job has finished"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown job: {job_id}"
+        }), 404
+
+    if job["status"] not in FINISHED_STATES:
+        return jsonify({
+            "job_id": job_id,
+            "status": job["status"]
+        }), 202
+
+    result = job["result"]
+    return jsonify(result), 200 if result.get('success') else 500
+
+@app.route('/policies', methods=['GET'])
+def list_policies():
+    """List the named scan policies accepted by /scan"""
+    return jsonify({"policies": policies.policies}), 200
+
+@app.route('/alerts', methods=['GET'])
+def list_alerts():
+    """Query stored findings by target, risk, confidence, plugin ID and job"""
+    try:
+        limit = int(request.args.get('limit', 100))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "limit and offset must be integers"
+        }), 400
+
+    alerts, total = query_alerts(request.args, limit=limit, offset=offset)
+    return jsonify({
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "alerts": alerts
+    }), 200
+
+@app.route('/alerts/<int:alert_id>', methods=['GET'])
+def alert_detail(alert_id):
+    """Return a single stored finding"""
+    alert = get_alert(alert_id)
+    if not alert:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown alert: {alert_id}"
+        }), 404
+    return jsonify(alert), 200
+
+@app.route('/diff', methods=['GET'])
+def diff_scans():
+    """Compare two scans of a target: new, fixed and persisting findings, from the fingerprint index
+
+    `to` defaults to the target's latest scan and `from` to the completed
+    scan of the same mode before it. With `fail_on`, the gate counts only
+    new findings, so CI fails on regressions rather than known issues.
+    """
+    target = request.args.get('target')
+    if not target:
+        return jsonify({
+            "status": "error",
+            "message": "target parameter is required"
+        }), 400
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "limit must be an integer"
+        }), 400
+    try:
+        fail_on = parse_fail_on(request.args['fail_on']) if request.args.get('fail_on') else None
+    except ValueError as e:
         return jsonify({
-            "status": "failed",
-            "error": str(e)
-        }), 500
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    try:
+        diff = diff_findings(normalize_target(target), request.args.get('from'), request.args.get('to'), limit=limit)
+    except LookupError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 404
+
+    if fail_on:
+        risk, count = fail_on
+        threshold = RISK_LEVELS.index(risk)
+        matches = sum(n for r, n in diff["summary"]["new"]["by_risk"].items()
+                      if str(r).lower() in RISK_LEVELS and RISK_LEVELS.index(str(r).lower()) >= threshold)
+        diff["gate"] = {"fail_on": request.args['fail_on'], "matches": matches, "passed": matches < count}
+    return jsonify(diff), 200
+
+@app.route('/reports', methods=['GET'])
+def list_reports():
+    """List catalogued reports, newest first, by target, mode, status, job and creation date"""
+    try:
+        limit = int(request.args.get('limit', 100))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "limit and offset must be integers"
+        }), 400
+
+    filters = request.args.to_dict()
+    if filters.get('target'):
+        filters['target'] = ','.join(normalize_target(t.strip()) for t in filters['target'].split(',') if t.strip())
+    try:
+        reports, total = query_reports(filters, limit=limit, offset=offset)
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "since and until must be ISO dates, e.g. 2025-05-22 or 2025-05-22T15:27:00"
+        }), 400
+    for report in reports:
+        report["download_url"] = f"/download-report?report_path={report['filename']}"
+    return jsonify({
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "reports": reports
+    }), 200
+
+@app.route('/reports/<report_id>', methods=['GET'])
+def report_detail(report_id):
+    """Return one catalogued report's metadata"""
+    report = get_report(report_id)
+    if not report:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown report: {report_id}"
+        }), 404
+    report["download_url"] = f"/download-report?report_path={report['filename']}"
+    return jsonify(report), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose scan, ZAP API, queue and report metrics in Prometheus text format"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 @app.route('/download-report', methods=['GET'])
 def download_report():
@@ -468,19 +1671,19 @@ def download_report():
     
     # Security: prevent directory traversal - use only the filename
     report_filename = os.path.basename(report_path)
-    full_path = os.path.join(REPORT_DIR, report_filename)
+    full_path = find_report(REPORT_DIR, report_filename)
     logger.debug(f"Full path: {full_path}")
 
-    if not os.path.exists(full_path):
-        logger.error(f"File does not exist at path: {full_path}")
+    if not full_path:
+        logger.error(f"Report does not exist in {REPORT_DIR}: {report_filename}")
         abort(404, description=f"Report file not found: {report_filename}")
 
     logger.info(f"Serving file: {full_path}")
-    return send_file(full_path, 
-                    mimetype='text/html',
-                    as_attachment=True,
-                    download_name='zap-security-report.html')
+    report = get_report(report_id_for(report_filename))
+    return serve_report(full_path, 'zap-security-report.html', size=report and report["uncompressed_bytes"])
 
 if __name__ == "__main__":
+    # Development server; production runs under gunicorn (gunicorn.conf.py)
     setup_environment()
+    signal.signal(signal.SIGTERM, shutdown)
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file